@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of local query results
+
+Results are stored in the user cache directory, keyed on the query and on a
+catalogue generation marker (see :func:`catalogue_generation`) so a refresh of
+the catalogue invalidates them. The least recently used results are removed
+when the cache grows larger than :data:`max_size`.
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import text
+
+
+# Default cache location, can be changed with the CLEF_CACHE environment
+# variable, setting it to an empty string disables the cache
+default_cache = os.path.join(os.path.expanduser('~'), '.cache', 'clef')
+
+# Maximum total size of the cached results in bytes
+max_size = 200 * 1024 * 1024
+
+
+def cache_dir():
+    """Return the cache directory or None if the cache is disabled"""
+    path = os.environ.get('CLEF_CACHE', default_cache)
+    return path if path else None
+
+
+def catalogue_generation(session):
+    """Return a marker that changes every time the catalogue is refreshed
+
+    For the clef database this is the last generation in the
+    ``catalogue_generation`` table, for a snapshot the time it was last
+    updated.
+
+    Args:
+        session: database or snapshot session
+
+    Returns:
+        generation (str) or None if not available
+    """
+    bind = session.get_bind()
+    if bind.dialect.name == 'postgresql':
+        if session.execute(text("SELECT to_regclass('catalogue_generation')")).scalar() is None:
+            return None
+        value = session.execute(text("SELECT max(generation) FROM catalogue_generation")).scalar()
+    elif bind.dialect.name == 'sqlite':
+        if session.execute(text("SELECT name FROM sqlite_master WHERE name = 'snapshot_info'")).scalar() is None:
+            return None
+        value = session.execute(text("SELECT max(value) FROM snapshot_info "
+                                     "WHERE key IN ('created', 'synced')")).scalar()
+    else:
+        return None
+    if value is None:
+        return None
+    return f'{bind.url}#{value}'
+
+
+def _encode(value):
+    """Convert a value to the types json can write
+
+    Sets and tuples are tagged, json would write both as lists. Only the
+    types found in query results are accepted, anything else raises a
+    TypeError rather than being silently changed to a string.
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (set, frozenset)):
+        return {'__set__': [_encode(v) for v in sorted(value, key=str)]}
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return _encode(value.item())
+    raise TypeError(f'Can not cache a value of type {type(value).__name__}: {value!r}')
+
+
+def _decode(obj):
+    if list(obj) == ['__set__']:
+        return set(obj['__set__'])
+    if list(obj) == ['__tuple__']:
+        return tuple(obj['__tuple__'])
+    return obj
+
+
+def frame_to_json(df):
+    """Encode a DataFrame as JSON, keeping the sets in its values and the column types
+
+    Unlike a pickle, reading it back can't run any code, so the cache
+    directory doesn't have to be trusted
+
+    Raises:
+        TypeError: if the DataFrame has values that can't be encoded, see
+            :func:`_encode`
+    """
+    return json.dumps({'index': [_encode(v) for v in df.index.tolist()],
+                       'index_name': _encode(df.index.name),
+                       'columns': [[_encode(c), str(df[c].dtype), [_encode(v) for v in df[c].tolist()]]
+                                   for c in df.columns]})
+
+
+def frame_from_json(data):
+    """Decode a DataFrame encoded with :func:`frame_to_json`"""
+    doc = json.loads(data, object_hook=_decode)
+    index = pd.Index(doc['index'], name=doc['index_name'])
+    df = pd.DataFrame({c: values for c, dtype, values in doc['columns']}, index=index,
+                      columns=[c for c, dtype, values in doc['columns']])
+    for c, dtype, values in doc['columns']:
+        if dtype != 'object':
+            df[c] = df[c].astype(dtype)
+    return df
+
+
+class QueryCache(object):
+    """Compressed local query results with a least recently used size cap
+
+    Results are pandas DataFrames with sets as values, they are stored as
+    gzip compressed JSON, see :func:`frame_to_json`
+    """
+
+    def __init__(self, path, max_size=max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def key(generation, project, latest, constraints):
+        """Cache key for a query
+
+        Constraints are normalised so the order of keys and values doesn't matter
+
+        Returns:
+            the key, or None if the constraints can't be encoded and the
+            query shouldn't be cached
+        """
+        norm = sorted((k, sorted(v) if isinstance(v, (list, tuple, set)) else v)
+                      for k, v in constraints.items())
+        try:
+            data = json.dumps(_encode([generation, project.upper(), bool(latest), norm]))
+        except TypeError:
+            return None
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json.gz')
+
+    def get(self, key):
+        """Return the cached result for key or None"""
+        fname = self._file(key)
+        try:
+            with gzip.open(fname, 'rt') as f:
+                result = frame_from_json(f.read())
+            # mark as recently used
+            os.utime(fname)
+        except Exception:
+            return None
+        return result
+
+    def put(self, key, result):
+        """Store a result and remove the least recently used ones if the cache is too large
+
+        Results with values that can't be encoded are not cached
+        """
+        try:
+            data = frame_to_json(result)
+        except TypeError:
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fname = self._file(key)
+            tmp = f'{fname}.{os.getpid()}.tmp'
+            with gzip.open(tmp, 'wt') as f:
+                f.write(data)
+            os.replace(tmp, fname)
+            self.evict()
+        except OSError:
+            # caching is best effort
+            pass
+
+    def evict(self):
+        """Remove least recently used results until the cache fits in max_size"""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.json.gz'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(e[1] for e in entries)
+        for mtime, size, fname in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            total -= size
+
+
+def query_cache():
+    """Return the default :class:`QueryCache` or None if caching is disabled"""
+    path = cache_dir()
+    if path is None:
+        return None
+    return QueryCache(os.path.join(path, 'queries'))
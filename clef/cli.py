@@ -21,16 +21,21 @@ import sys
 import os
 import stat
 from itertools import repeat
-from datetime import datetime
+from datetime import datetime, timezone
 
-from .db import connect, Session
+from .db import connect, ReadOnlySession
+from .model import C6Dataset
 from .esgf import match_query, find_local_path, find_missing_id, find_checksum_id
 from .download import write_request, search_queue_csv 
 from . import collections as colls
+from .db_noesgf import PathTemplate
+from . import snapshot as snapshot_
 from .exception import ClefException
-from .code import call_local_query, matching, write_csv, print_stats, ids_df
+from .code import call_local_query, matching, write_csv, print_stats, print_facets, ids_df, \
+                  summary_available, tracking_ids
+from .facets import facet_counts
 from .helpers import load_vocabularies, fix_model, fix_path, get_ids
-from .esdoc import citation, write_cite
+from .esdoc import citation, write_cite, print_path_errata, sync_docs
 import clef.cordex as cordex_
 
 def clef_catch():
@@ -56,9 +61,15 @@ def clef_catch():
                help="send NCI request to download missing files matching ESGF search")
 @click.option('--debug', is_flag=True, default=False,
                help="Show debug info")
+@click.option('--application-name', default='clef',
+               help="Name reported to the database server. Default: clef")
+@click.option('--statement-timeout', type=int, default=None,
+               help="Cancel database queries running longer than this, in milliseconds")
 @click.pass_context
-def clef(ctx, flow, debug):
+def clef(ctx, flow, debug, application_name, statement_timeout):
     ctx.obj={}
+    ctx.obj['application_name'] = application_name
+    ctx.obj['statement_timeout'] = statement_timeout
     # set up a default value for flow if none selected for logging
     if flow is None: flow = 'default'
     ctx.obj['flow'] = flow
@@ -101,10 +112,34 @@ def config_log():
     # return the logger object
     return logger
 
+def db_session(ctx, user=None):
+    """Open a read-only session on the clef database, with the connection options given to clef"""
+    obj = ctx.obj or {}
+    connect(user=user, readonly=True, application_name=obj.get('application_name', 'clef'),
+            statement_timeout=obj.get('statement_timeout'))
+    return ReadOnlySession()
+
+
 def warning(message):
     print("WARNING: %s"%message, file=sys.stderr)
 
 
+def snapshot_notice():
+    """Tell the user that a --local search reads the catalogue snapshot and how old it is"""
+    path = snapshot_.snapshot_path()
+    updated = snapshot_.last_updated()
+    if updated is None:
+        warning(f"Searching the catalogue snapshot {path}, its age is unknown")
+        return
+    days = (datetime.now(timezone.utc) - updated).days
+    message = (f"Searching the catalogue snapshot {path}, last updated "
+               f"{updated:%Y-%m-%d %H:%M} ({days} days ago)")
+    if days >= snapshot_.stale_days:
+        warning(message + ", run 'clef snapshot --update' to bring it up to date")
+    else:
+        print(message, file=sys.stderr)
+
+
 def cmip5_args(f):
     """Define CMIP5 only click arguments
     """
@@ -125,6 +160,8 @@ def cmip5_args(f):
         click.option('--cf_standard_name',multiple=True, help="CF variable standard_name, use instead of variable constraint "),
         click.option('--and', 'and_attr', multiple=True, type=click.Choice(vocab['attributes']),
                       help=("Attributes for which we want to add AND filter, i.e. `--and variable` to apply to variable values")),
+        click.option('--facets', 'facets', is_flag=True, default=False,
+                     help="Print the number of datasets for each facet value matching the constraints, works only with --local. Default: False"),
         click.option('--institution', 'institute', multiple=True, help="Modelling group institution id: MIROC, IPSL, MRI ...")
     ]
     for c in reversed(constraints):
@@ -181,8 +218,12 @@ def cmip6_args(f):
         click.option('--cf_standard_name',multiple=True, help="CF variable standard_name, use instead of variable constraint "),
         click.option('--and', 'and_attr', multiple=True, type=click.Choice(vocab['attributes']),
                       help=("Attributes for which we want to add AND filter, i.e. `--and variable_id` to apply to variable values")),
+        click.option('--facets', 'facets', is_flag=True, default=False,
+                     help="Print the number of datasets for each facet value matching the constraints, works only with --local. Default: False"),
         click.option('--cite', 'cite', is_flag=True, default=False,
                      help="Write list of citations for query results, works only with --remote and --local options. Default: False"),
+        click.option('--errata', 'errata', is_flag=True, default=False,
+                     help="List the ES-DOC errata affecting the files of each result path, works only with --local. Default: False"),
         click.option('--institution', 'institution_id', multiple=True, help="Modelling group institution id: IPSL, NOAA-GFDL ...")
     ]
     for c in reversed(constraints):
@@ -234,7 +275,8 @@ def cmip5(ctx, query, debug, distrib, replica, latest, csvf, stats,
         realm,
         time_frequency,
         variable,
-        and_attr
+        and_attr,
+        facets
         ):
     """
     Search ESGF and local database for CMIP5 files
@@ -265,7 +307,8 @@ def cmip5(ctx, query, debug, distrib, replica, latest, csvf, stats,
         'cf_standard_name': cf_standard_name,
         'and_attr': and_attr
         }
-    common_esgf_cli(ctx, project, query, latest, replica, distrib, csvf, stats, debug, dataset_constraints)
+    common_esgf_cli(ctx, project, query, latest, replica, distrib, csvf, stats, debug,
+            dataset_constraints, facets=facets)
 
 
 @clef.command()
@@ -289,7 +332,9 @@ def cmip6(ctx,query, debug, distrib, replica, latest, csvf, stats,
         grid_label,
         nominal_resolution,
         and_attr,
-        cite
+        facets,
+        cite,
+        errata
         ):
     """
     Search ESGF and local database for CMIP6 files
@@ -320,7 +365,7 @@ def cmip6(ctx,query, debug, distrib, replica, latest, csvf, stats,
         }
 
     common_esgf_cli(ctx, project, query, latest, replica, distrib,
-        csvf, stats, debug, dataset_constraints, cite)
+        csvf, stats, debug, dataset_constraints, cite, facets, errata)
 
 
 @clef.command(cls=cordex_.CordexCommand)
@@ -346,11 +391,11 @@ def cordex(ctx, query, debug, distrib, replica, latest, csvf, stats, **kwargs):
         dataset_constraints['experiment_family'] = (dataset_constraints['experiment_family'],)
 
     common_esgf_cli(ctx, project, [], latest, replica, distrib, csvf, stats, debug,
-            dataset_constraints)
+            dataset_constraints, facets=kwargs['facets'])
 
 
 def common_esgf_cli(ctx, project, query, latest, replica, distrib,
-               csvf, stats, debug, constraints, cite=False):
+               csvf, stats, debug, constraints, cite=False, facets=False, errata=False):
 
     if debug:
         logging.basicConfig(level=logging.DEBUG)
@@ -360,8 +405,12 @@ def common_esgf_cli(ctx, project, query, latest, replica, distrib,
     clef_log = ctx.obj['log']
     user_name=os.environ.get('USER','unknown')
     user=None
-    connect(user=user)
-    s = Session()
+    # local searches use the catalogue snapshot if one was created
+    if ctx.obj['flow'] == 'local' and snapshot_.available():
+        s = snapshot_.connect()
+        snapshot_notice()
+    else:
+        s = db_session(ctx, user)
 
     matching_fixed = {
         'CMIP5': ['model','ensemble'],
@@ -387,6 +436,11 @@ def common_esgf_cli(ctx, project, query, latest, replica, distrib,
         if value is not None and len(value) > 0:
             terms[key] = value
 
+    if facets and ctx.obj['flow'] != 'local':
+        warning("--facets works only with --local, ignoring it")
+    if errata and ctx.obj['flow'] != 'local':
+        warning("--errata works only with --local, ignoring it")
+
     if ctx.obj['flow'] == 'remote':
         if len(and_attr) > 0:
             results, selection = matching(s, and_attr, matching_fixed[project], project=project,
@@ -422,6 +476,9 @@ def common_esgf_cli(ctx, project, query, latest, replica, distrib,
     if ctx.obj['flow'] == 'local':
         if project[0:6] == 'CORDEX':
             project='CORDEX'
+        if facets:
+            print_facets(facet_counts(s, project, **terms))
+            return
         if len(and_attr) > 0:
             results, selection = matching(s, and_attr, matching_fixed[project], project=project,
                                           local=True, latest=latest, **terms)
@@ -431,8 +488,18 @@ def common_esgf_cli(ctx, project, query, latest, replica, distrib,
                     line += f" rcm versions: {', '.join(row.rcm_version_id)}"
                 print(line)
         else:
-            results, paths = call_local_query(s, project, latest, **terms)
-            if not stats:
+            # without a free text query the dataset summaries have all the information needed
+            summary = len(query) == 0 and summary_available(s)
+            results, paths = call_local_query(s, project, latest, query=' '.join(query),
+                                              summary=summary, **terms)
+            if errata and not stats:
+                es = s
+                if s.get_bind().dialect.name != 'postgresql':
+                    # the file tracking ids are only in the clef database
+                    es = db_session(ctx, user)
+                print_path_errata(paths, tracking_ids(es, project, paths, latest,
+                                                      query=' '.join(query), **terms))
+            elif not stats:
                 for p in paths:
                     print(p)
         if csvf:
@@ -489,6 +556,56 @@ def common_esgf_cli(ctx, project, query, latest, replica, distrib,
         else:
             print("\nAll the published data is already available locally, or has been requested, nothing to request")
 
+@clef.command()
+@click.option('--output', '-o', 'path', default=None,
+              help="Snapshot file. Default: $CLEF_SNAPSHOT or ~/.clef/catalogue.db")
+@click.option('--update', is_flag=True, default=False,
+              help="Update an existing snapshot with only the files changed since it was last updated")
+@click.pass_context
+def snapshot(ctx, path, update):
+    """
+    Save a local copy of the catalogue used by --local searches
+
+    Once a snapshot exists --local searches use it instead of the database,
+    run this command again, or with --update, to bring it up to date
+    """
+    s = db_session(ctx)
+    # read every table in the same transaction so the snapshot is consistent
+    with s.begin():
+        if update:
+            added, removed = snapshot_.sync(s, path)
+        else:
+            path = snapshot_.create_snapshot(s, path)
+    if update:
+        print(f'Catalogue snapshot updated: {added} files added or changed, {removed} removed')
+    else:
+        print(f'Catalogue snapshot saved in {path}')
+
+
+@clef.command('docs-sync')
+@click.option('--refresh', is_flag=True, default=False,
+              help="Download again the documents already saved")
+@click.pass_context
+def docs_sync(ctx, refresh):
+    """
+    Save a local copy of the WDCC citations and ES-DOC documents
+
+    Documents are downloaded for the CMIP6 models, experiments and
+    simulations in the local catalogue, citations and documentation lookups
+    then read them from the copy instead of the web services
+    """
+    if snapshot_.available():
+        s = snapshot_.connect()
+    else:
+        s = db_session(ctx)
+    sims = s.query(C6Dataset.activity_id, C6Dataset.institution_id,
+                   C6Dataset.source_id, C6Dataset.experiment_id).distinct().all()
+    saved, failed = sync_docs(sims, refresh=refresh)
+    print(f'Documents saved: {saved}')
+    if failed:
+        warning(f"{failed} documents couldn't be retrieved, run docs-sync again to retry")
+
+
 @clef.command()
 @ds_args
 def ds(**kwargs):
@@ -496,13 +613,18 @@ def ds(**kwargs):
     Search local database for non-ESGF datasets
     """
     # open noesgf connection
-    db = colls.connect()
+    db = colls.connect(readonly=True)
     clefdb = db.session
     datasets, variables, varsearch = db.command_query(**kwargs)
+    # group the variables by dataset in one pass
+    dsvars = {}
+    for v in variables:
+        dsvars.setdefault(v.dataset_id, []).append(v)
     for ds in datasets:
         if not varsearch:
             print(" ".join([ds.name,'v'+ds.version + ":",ds.drs]))
-        for v in variables:
-            if v.dataset_id == ds.id:
-                print(v.varname + ": " + v.path() )
+        if ds.id in dsvars:
+            template = PathTemplate(ds)
+            for v in dsvars[ds.id]:
+                print(v.varname + ": " + v.path(template) )
     return
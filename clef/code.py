@@ -22,17 +22,21 @@ import re
 import pkg_resources
 import itertools
 
-from sqlalchemy import any_
+from sqlalchemy import or_, and_, func, text
 
 from .db import connect, Session
-from .model import Path, C5Dataset, C6Dataset, ExtendedMetadata, CordexDataset
+from .model import C5Dataset, C6Dataset, ExtendedMetadata, CordexDataset, \
+                   C5File, C6File, CordexFile, C5Summary, C6Summary, CordexSummary, FileSearch, \
+                   Info
 from .exception import ClefException
 from .esgf import esgf_query
+from .cache import query_cache, catalogue_generation
 from .helpers import convert_periods, time_axis, check_values, check_keys, fix_model, fix_path, \
-                     get_facets, get_range, get_version, get_keys, load_vocabularies, get_member
+                     get_facets, get_range, get_version, get_keys, load_vocabularies, get_member, \
+                     parse_range
 
 
-def search(session, project='CMIP5', latest=True, **kwargs):
+def search(session, project='CMIP5', latest=True, summary=False, **kwargs):
     """Call local query interactively.
 
     Can be used when in python script, first checks that the arguments names
@@ -43,6 +47,7 @@ def search(session, project='CMIP5', latest=True, **kwargs):
         session (SQLAlchemy obj): the db session
         project (str): data project (default CMIP5)
         latest (bool): version latest (default True) or all (False)
+        summary (bool): use the dataset summaries, see :func:`summary_query`
         kwargs (dict): query constraints
 
     Returns:
@@ -60,8 +65,11 @@ def search(session, project='CMIP5', latest=True, **kwargs):
     vocabularies = load_vocabularies(project)
     check_values(args, project, vocabularies)
     if 'model' in args.keys():
-        args['model'] = fix_model(project, [args['model']])[0]
-    results = local_query(session, project, latest, **args)
+        args['model'] = fix_model(project, [args['model']], session=session)[0]
+    if summary:
+        results = summary_query(session, project, latest, **args)
+    else:
+        results = local_query(session, project, latest, **args)
     if latest:
         results = local_latest(results)
     return results
@@ -92,11 +100,12 @@ def matching(session, cols, fixed, project='CMIP5', local=True, latest=True, **k
         # use local search
         if local:
             msg = "There are no simulations stored locally"
+            summary = summary_available(session)
             # perform the query for each variable separately and concatenate the results
             combs = [dict(zip(kwargs, x)) for x in itertools.product(*kwargs.values())]
             for c in combs:
                 results = results.append(search(session,project=project.upper(),
-                                                latest=latest, **c),
+                                                latest=latest, summary=summary, **c),
                                          ignore_index=True)
         # use ESGF search
         else:
@@ -125,13 +134,15 @@ def matching(session, cols, fixed, project='CMIP5', local=True, latest=True, **k
     return and_filter(results, cols, fixed, **kwargs)
 
 
-def call_local_query(s, project, latest, **kwargs):
+def call_local_query(s, project, latest, query=None, summary=False, **kwargs):
     """Call local_query for each combination of constraints passed as argument
 
     Args:
         s (SQLAlchemy session obj): database session
         project (string): project, i.e. CMIP5/CMIP6
         latest (boolean): True returns only latest version
+        query (str): free text query
+        summary (boolean): call summary_query instead, ignores query
         kwargs (dictionary): query constraints
 
     Returns:
@@ -144,18 +155,25 @@ def call_local_query(s, project, latest, **kwargs):
     paths = []
     combs = [dict(zip(kwargs, x)) for x in itertools.product(*kwargs.values())]
     for c in combs:
-         datasets = datasets.append(local_query(s,project=project, latest=latest, **c), ignore_index=True)
+        if summary:
+            datasets = datasets.append(summary_query(s, project=project, latest=latest, **c), ignore_index=True)
+        else:
+            datasets = datasets.append(local_query(s,project=project, latest=latest, query=query, **c), ignore_index=True)
     paths = datasets['path'].tolist()
     return datasets, paths
 
 
-def local_query(session, project='CMIP5', latest=True, **kwargs):
+def local_query(session, project='CMIP5', latest=True, query=None, **kwargs):
     """Query DB matching directly the constraints to the file attributes instead of querying first the ESGF
 
+    Results are cached, see :mod:`clef.cache`
+
     Args:
         session (SQLAlchemy session obj): database session
         project (string): project, i.e. CMIP5 (default)/CMIP6
         latest (boolean): True (default) returns only latest version
+        query (str): free text query matched against the paths and the
+            descriptive attributes, see :func:`text_filter`
         kwargs (dictionary): query constraints
 
     Returns:
@@ -165,11 +183,26 @@ def local_query(session, project='CMIP5', latest=True, **kwargs):
 
     # make sure project is upper case 
     project = project.upper()
-    r = build_query(session, project, **kwargs)
+
+    # return the cached result if the same query was run on this catalogue generation
+    cache = query_cache()
+    key = None
+    if cache is not None:
+        generation = catalogue_generation(session)
+        if generation is not None:
+            key = cache.key(generation, project, latest,
+                            dict(kwargs, query=query) if query else kwargs)
+            cached = cache.get(key) if key is not None else None
+            if cached is not None:
+                return cached
+
+    r = build_query(session, project, query=query, **kwargs)
 
     # run the sql using pandas read_sql,index data using path, returns a dataframe
     df = pd.read_sql(r.selectable, con=session.connection())
     df = df.rename(columns={'path': 'opath'})
+    # a catalogue snapshot stores periods as text
+    df['period'] = df['period'].map(parse_range)
 
     # fix path by substituing output1/2 with combined, separate path from filenames
     fix_paths = df['opath'].apply(fix_path, latest=latest)
@@ -189,15 +222,166 @@ def local_query(session, project='CMIP5', latest=True, **kwargs):
     todel = ['opath','r','i','p','f','period']
     cols = [c for c in todel if c in res.columns]
     res = res.drop(columns=cols)
+    if key is not None:
+        cache.put(key, res)
     return res
 
 
-def build_query(session, project, **kwargs):
+def summary_available(session):
+    """Check if the dataset summaries can be used
+
+    They are maintained on the clef database, a catalogue snapshot doesn't
+    have them.
+
+    Args:
+        session (SQLAlchemy session obj): database or snapshot session
+
+    Returns:
+        True if the summary views exist
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return False
+    return session.execute(text("SELECT to_regclass('cmip5_summary')")).scalar() is not None
+
+
+def summary_query(session, project='CMIP5', latest=True, **kwargs):
+    """Query the dataset summaries instead of the files
+
+    Gives the same simulations as :func:`local_query`, with the number and
+    total size of the files of each one instead of the file names. The
+    summaries are computed when the catalogue is refreshed, so the files
+    don't need to be read and grouped.
+
+    Args:
+        session (SQLAlchemy session obj): database session
+        project (string): project, i.e. CMIP5 (default)/CMIP6
+        latest (boolean): True (default) returns only latest version
+        kwargs (dictionary): query constraints
+
+    Returns:
+      results (pandas.DataFrame): each row describe one simulation matching the constraints
+
+    """
+    project = project.upper()
+    r = build_query(session, project, summary=True, **kwargs)
+    if latest:
+        r = r.filter_by(latest=True)
+    df = pd.read_sql(r.selectable, con=session.connection())
+    return post_summary(df, latest)
+
+
+def post_summary(df, latest):
+    """Postprocess summary query results, as :func:`post_local` does for files
+
+    Args:
+        df (pandas.DataFrame): rows of a summary view
+        latest (boolean): True if only latest versions are returned
+
+    Returns:
+      results (pandas.DataFrame): each row describe one simulation
+    """
+    if len(df.index) == 0:
+        return df
+    if latest and 'latest' in df.columns:
+        df = df[df['latest'].astype(bool)].copy()
+    df['period'] = df['period'].map(parse_range)
+    # fix_path expects a file path, the trailing / stands for the file name
+    df['path'] = df['path'].map(lambda p: os.path.dirname(fix_path(p + '/', latest)))
+    df = df[df.path != '/path/todelete'].copy()
+    dates = df['period'].map(lambda p: get_range(convert_periods([p]))
+                             if p is not None and p.lower is not None and p.upper is not None
+                             else (None, None))
+    df['fdate'] = dates.map(lambda x: x[0])
+    df['tdate'] = dates.map(lambda x: x[1])
+    # make sure a version is available even for CMIP6 where is usually None
+    missing = df['version'].isnull()
+    df.loc[missing, 'version'] = df.loc[missing, 'path'].map(get_version)
+    if 'f' in df.columns:
+        bad = df['member_id'].map(lambda m: any(x in m for x in ['r0','i0','p0','f0']))
+        df.loc[bad, 'member_id'] = df.loc[bad, 'path'].map(get_member)
+        df.loc[bad, 'variant_label'] = df.loc[bad, 'member_id']
+    # rows merged in the same directory by fix_path, e.g. al33 output1 and
+    # output2, are added up, the other attributes come from the newest version
+    agg_dict = {k: 'last' for k in df.columns if k != 'path'}
+    agg_dict.update(file_count='sum', total_size='sum', time_complete='all',
+                    fdate=lambda x: min(x.dropna(), default=None),
+                    tdate=lambda x: max(x.dropna(), default=None))
+    df = df.sort_values('version').groupby('path', as_index=False, sort=False).agg(agg_dict)
+    todel = ['r','i','p','f','period','latest']
+    return df.drop(columns=[c for c in todel if c in df.columns]).set_index('path', drop=False)
+
+
+def tracking_ids(session, project, paths, latest=True, query=None, **kwargs):
+    """Tracking ids of the files of local query results
+
+    Runs the query of :func:`call_local_query` again on the files, with their
+    tracking id attribute, and groups the files by result path fixing their
+    paths as :func:`local_query` does. Only the clef database has the file
+    attributes, not a catalogue snapshot.
+
+    Args:
+        session (SQLAlchemy session obj): database session
+        project (string): project, i.e. CMIP5/CMIP6
+        paths (list): result paths
+        latest (boolean): True if only latest versions were returned
+        query (str): free text query
+        kwargs (dictionary): query constraints
+
+    Returns:
+        dict {path: set of tracking ids}
+    """
+    project = project.upper()
+    files = {'CMIP5': C5File, 'CMIP6': C6File, 'CORDEX': CordexFile}[project]
+    wanted = set(paths)
+    found = {}
+    combs = [dict(zip(kwargs, x)) for x in itertools.product(*kwargs.values())]
+    for c in combs:
+        r = (build_query(session, project, query=query, **c)
+             .join(Info, Info.file_id == files.file_id)
+             .with_entities(files.path.label('path'), Info.tracking_id.label('tracking_id')))
+        for row in r:
+            path = os.path.dirname(fix_path(row.path, latest))
+            if path in wanted and row.tracking_id:
+                found.setdefault(path, set()).add(row.tracking_id)
+    return found
+
+
+def text_filter(session, files, query):
+    """Free text search condition
+
+    Every word in query has to match the start of a word of the file path or
+    of its title, source and description attributes, using the
+    ``file_search`` full text index. A catalogue snapshot has no attributes,
+    the words are matched anywhere in the path.
+
+    Args:
+        session (SQLAlchemy obj): the db session
+        files: model of the per-file view searched
+        query (str): free text query
+
+    Returns:
+        SQLAlchemy filter condition, None if query has no words
+    """
+    words = re.findall(r'[^\W_]+', query.lower())
+    if not words:
+        return None
+    if session.get_bind().dialect.name == 'postgresql':
+        tsquery = ' & '.join(w + ':*' for w in words)
+        matches = (session.query(FileSearch.file_id)
+                   .filter(FileSearch.document.op('@@')(func.to_tsquery('simple', tsquery))))
+        return files.file_id.in_(matches.subquery())
+    return and_(*[func.lower(files.path).like(f'%{w}%') for w in words])
+
+
+def build_query(session, project, query=None, summary=False, **kwargs):
     """Build local query syntax.
 
     Args:
         session (SQLAlchemy obj): the db session
         project (str): data project
+        query (str): free text query, see :func:`text_filter`
+        summary (bool): query the dataset summaries instead of the files,
+            ignores query
         kwargs (dict): query constraints
 
     Returns:
@@ -212,9 +396,12 @@ def build_query(session, project, **kwargs):
         family = kwargs.pop('experiment_family')
     if project == 'CMIP6' and 'activity_id' in kwargs.keys():
         activity = kwargs.pop('activity_id')
-    ctables={'CMIP5': [C5Dataset, Path.c5dataset],
-          'CMIP6': [C6Dataset, Path.c6dataset],
-          'CORDEX': [CordexDataset, Path.cordexdataset] }
+    ctables={'CMIP5': [C5Dataset, C5File],
+          'CMIP6': [C6Dataset, C6File],
+          'CORDEX': [CordexDataset, CordexFile] }
+    stables={'CMIP5': C5Summary,
+          'CMIP6': C6Summary,
+          'CORDEX': CordexSummary }
     family_dict = {'RCP': ['%rcp%'],
                    'ESM': ['esm%'],
                    'Atmos-only': ['sst%', 'amip%', 'aqua%'],
@@ -225,21 +412,30 @@ def build_query(session, project, **kwargs):
                    'Paleo': ['lgm','midHolocene', 'past1000'],
                    'Historical': ['historical%','%Historical']}
 
-    r = (session.query(Path.path.label('path'),
-         *[c.label(c.name) for c in ctables[project][0].__table__.columns if c.name != 'dataset_id'],
-         *[c.label(c.name) for c in ExtendedMetadata.__table__.columns if c.name != 'file_id']
-        )
-        .join(Path.extended)
-        .join(ctables[project][1])
+    # query the denormalised per-file view, it has the path, the dataset
+    # attributes and the extended metadata of each file so no joins are needed
+    dataset, files = ctables[project]
+    columns = (['path'] +
+               [c.name for c in dataset.__table__.columns if c.name != 'dataset_id'] +
+               [c.name for c in ExtendedMetadata.__table__.columns if c.name != 'file_id'])
+    # or the summary view, one row per dataset version
+    if summary:
+        files = stables[project]
+        columns += ['file_count', 'total_size', 'time_complete', 'latest']
+        query = None
+    r = (session.query(*[files.__table__.c[c].label(c) for c in columns])
+        .select_from(files)
         .filter_by(**kwargs))
-    if 'family' in locals() and project == 'CMIP5':
-          r =r.filter(C5Dataset.experiment.like(any_(family_dict[family])))
-    if 'family' in locals() and project == 'CORDEX':
-          r =r.filter(CordexDataset.experiment.like(any_(family_dict[family])))
+    if 'family' in locals():
+          r =r.filter(or_(*[files.experiment.like(x) for x in family_dict[family]]))
     if 'var' in locals(): 
-        r = r.filter(ExtendedMetadata.variable == var)
+        r = r.filter(files.variable == var)
     if 'activity' in locals():
-          r =r.filter(C6Dataset.activity_id.like("%"+activity+"%"))
+          r =r.filter(files.activity_id.like("%"+activity+"%"))
+    if query:
+        condition = text_filter(session, files, query)
+        if condition is not None:
+            r = r.filter(condition)
     return r
 
 
@@ -386,6 +582,26 @@ def print_stats(results, project):
     print("\n")
 
 
+def print_facets(counts):
+    """Print the number of datasets for each facet value
+
+    Args:
+        counts (dict): output of :func:`clef.facets.facet_counts`
+
+    """
+    total = max((sum(v.values()) for v in counts.values()), default=0)
+    if total == 0:
+        print('No results are available for this query')
+        return
+    for facet, values in counts.items():
+        if len(values) == 0:
+            continue
+        print(f"\n{facet}:")
+        for value, n in sorted(values.items()):
+            print(f"  {value}: {n}")
+    print()
+
+
 def local_latest(results):
     """Sift through local query results dataframe and return only the latest versions
 
@@ -398,7 +614,8 @@ def local_latest(results):
     if len(results.index) <= 1:
         return results
     # separate all the attributes which could be different between two versions
-    separate = ['path', 'version', 'time_complete', 'filename','fdate', 'tdate', 'periods']
+    separate = ['path', 'version', 'time_complete', 'filename','fdate', 'tdate', 'periods',
+                'file_count', 'total_size', 'latest']
     cols = [k for k in results.columns if k not in separate]
     results = results.sort_values('version').drop_duplicates(subset=cols, keep='last')
     return results
@@ -16,11 +16,13 @@ limitations under the License.
 
 import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.dialects import sqlite
 
 from .db_noesgf import Base, Dataset, Variable, QC
+from .exception import ClefException
 
 SQASession = sessionmaker()
 
@@ -109,9 +111,9 @@ class Session(object):
             return datasets, variables, False
         # build query filtering all single value arguments: vargs
         # filter query results using in_() for list of values arguments: vlargs
-        q1 = self.query(Variable).filter_by(**vargs)
+        q = self.query(Variable).filter_by(**vargs)
         for attr, value in vlargs.items():
-            q = q1.filter(getattr(Variable, attr).in_(value))
+            q = q.filter(getattr(Variable, attr).in_(value))
         #print( str(q.statement.compile(dialect=sqlite.dialect())))
         var_outs = q.all()
         if var_outs:
@@ -121,12 +123,80 @@ class Session(object):
 # Default collections database
 default_db = 'sqlite:////g/data/hh5/tmp/clef/tables/clef.db'
 
-def connect(path = None):
+# Version of the catalogue tables, stored in the SQLite user_version pragma.
+# Increase it when the tables in db_noesgf change, so the next writable
+# connection creates the new ones
+schema_version = 1
+
+# Bytes of the catalogue file SQLite reads through a memory map
+mmap_size = 256 * 1024 * 1024
+
+# Engines already created, by url and mode
+_engines = {}
+
+
+def sqlite_url(path, readonly=False, immutable=False):
+    """Add the SQLite URI options for a read-only connection to a database url
+
+    >>> str(sqlite_url('sqlite:////data/clef.db', readonly=True))
+    'sqlite:///file:/data/clef.db?mode=ro&uri=true'
+
+    immutable skips the file locks as well, only use it when nothing else
+    writes to the file while it is open.
+    """
+    url = make_url(path)
+    if not readonly or url.drivername.split('+')[0] != 'sqlite' or url.database in (None, '', ':memory:'):
+        return url
+    query = {'mode': 'ro'}
+    if immutable:
+        query['immutable'] = '1'
+    query['uri'] = 'true'
+    return make_url(f'sqlite:///file:{url.database}?' + '&'.join(f'{k}={v}' for k, v in query.items()))
+
+
+def get_engine(path, readonly=False, immutable=False):
+    """Return the engine for a catalogue, creating it the first time
+
+    Writable connections create the tables if the catalogue schema is older
+    than :data:`schema_version`, read-only ones never change the file.
+    """
+    url = sqlite_url(path, readonly, immutable)
+    key = (str(url), readonly)
+    if key in _engines:
+        return _engines[key]
+    engine = create_engine(url)
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f'PRAGMA mmap_size = {mmap_size}')
+            if readonly:
+                cursor.execute('PRAGMA query_only = 1')
+            cursor.close()
+
+        if not readonly:
+            with engine.connect() as conn:
+                if conn.execute('PRAGMA user_version').scalar() < schema_version:
+                    Base.metadata.create_all(conn)
+                    conn.execute(f'PRAGMA user_version = {schema_version}')
+    elif not readonly:
+        Base.metadata.create_all(engine)
+    # each in-memory engine is a new database
+    if url.database not in (None, '', ':memory:'):
+        _engines[key] = engine
+    return engine
+
+
+def connect(path = None, readonly=False, immutable=False):
     """Connect to the not-ESGF datasets catalog
-    :return: A new :py:class:`Session`
+    :input: path database url, default $CLEF_DB or :data:`default_db`
+    :input: readonly open the catalogue read-only, without checking the tables
+    :input: immutable with readonly, also skip the file locks, see :func:`sqlite_url`
+    :return: A new :py:class:`Session`, raises :class:`ClefException` if a
+             catalogue opened readonly doesn't exist
     Example::
     >>> from clef import collections
-    >>> clefdb   = collections.connect() # doctest: +SKIP
+    >>> clefdb   = collections.connect(readonly=True) # doctest: +SKIP
     >>> outputs = clefdb.query() # doctest: +SKIP
     """
 
@@ -134,8 +204,13 @@ def connect(path = None):
         # Get the path from the environment
         path = os.environ.get('CLEF_DB', default_db)
 
-    engine = create_engine(path)
-    Base.metadata.create_all(engine)
+    # a read-only connection can't create a missing catalogue file
+    url = make_url(path)
+    if (readonly and url.drivername.split('+')[0] == 'sqlite' and
+            url.database not in (None, '', ':memory:') and not os.path.exists(url.database)):
+        raise ClefException(f'The collections catalogue {url.database} does not exist')
+
+    engine = get_engine(path, readonly, immutable)
     SQASession.configure(bind=engine, autoflush=False)
 
     connection = Session()
@@ -94,3 +94,11 @@ class CordexCommand(click.Command):
             help="Attributes for which we want to add AND filter, i.e. -v tasmin -v tasmax --and variable will return only model/ensemble that have both",
         )
         self.params.append(opt)
+
+        opt = click.Option(
+            ["--facets", "facets"],
+            is_flag=True,
+            default=False,
+            help="Print the number of datasets for each facet value matching the constraints, works only with --local. Default: False",
+        )
+        self.params.append(opt)
@@ -22,6 +22,11 @@ Database connection functions
     :class:`sqlalchemy.orm.session.Session` connected to the clef.nci.org.au database
 
     :func:`connect()` must be called before creating any new sessions
+
+.. class:: clef.db.ReadOnlySession
+
+    Autocommit session for the engines connected with ``readonly``, see
+    :func:`connect()`
 """
 
 import sqlalchemy
@@ -39,36 +44,130 @@ default_url = 'postgresql://clef.nci.org.au:5432/clef'
 
 Session = sessionmaker()
 
+# Read-only engines use their own sessions in autocommit mode, so a connection
+# is only held for the length of each query, while Session keeps the usual
+# transactions
+ReadOnlySession = sessionmaker(autocommit=True)
+
+# Engines already created by :func:`connect`, keyed by url, user and mode so
+# that repeated calls reuse the same connection pool
+_engines = {}
+
+# Connection pool settings for the postgres server, connections are checked
+# with a ping before use and recycled before the server drops idle ones
+pool_settings = {
+    'pool_size': 2,
+    'max_overflow': 4,
+    'pool_recycle': 1800,
+    }
+
+auth_message = ('Failed to authenticate with NCI clef.nci.org.au database\n'+
+                'You need to be part of one of the CMIP groups: oi10, al33, rr3.\n'+
+                'If you are already please contact the NCI helpdesk')
+
+
+def _auth_error(context):
+    """Convert a failed first connection into a :class:`ClefException`
+
+    Registered as a ``handle_error`` event, so the authentication check is
+    done by the first real query rather than by a separate probe connection
+    """
+    if context.connection is None and isinstance(context.sqlalchemy_exception,
+                                                 sqlalchemy.exc.OperationalError):
+        raise ClefException(auth_message) from context.original_exception
+
 
-def connect(url=default_url, user=None, debug=False):
+def _readonly_session(dbapi_connection, connection_record):
+    """Make psycopg2 open every transaction with ``BEGIN READ ONLY``"""
+    dbapi_connection.set_session(readonly=True)
+
+
+def _transaction_settings(application_name, statement_timeout):
+    """Pool checkout event setting per-transaction parameters
+
+    The settings are made with ``SET LOCAL`` so they only last until the
+    connection is returned to the pool, which keeps them from leaking to other
+    clients of a transaction-pooling proxy like PgBouncer
+    """
+    settings = {'application_name': application_name}
+    if statement_timeout is not None:
+        settings['statement_timeout'] = str(statement_timeout)
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT ' + ', '.join(
+                           'set_config(%s, %s, true)' for _ in settings),
+                       [x for item in settings.items() for x in item])
+        cursor.close()
+
+    return checkout
+
+
+def connect(url=default_url, user=None, debug=False, readonly=False,
+            application_name='clef', statement_timeout=None, pool_size=None):
     """Connect to the local database and sets up the session
 
+    Engines are cached, calling this function again with the same url and
+    user returns the existing engine and its connection pool. No connection
+    is opened here, authentication errors are raised as a
+    :class:`ClefException` by the first query run on the engine.
+
+    With ``readonly`` the engine is bound to :data:`ReadOnlySession`, which
+    runs in autocommit mode so a connection is only held for the length of
+    each query, and every transaction is started as ``READ ONLY`` with
+    ``application_name`` and ``statement_timeout`` set locally. Nothing
+    relies on server-side prepared statements or session state, so this mode
+    works behind a transaction-pooling proxy. Otherwise the engine is bound
+    to :data:`Session` and the two settings are made when each connection is
+    opened.
+
     Args:
         url: Database URL
         user: Username (password will be prompted via ``getpass``)
         debug: Print debugging information
+        readonly: Use the read-only autocommit mode
+        application_name: Name reported to the server
+        statement_timeout: Maximum query time in milliseconds
+        pool_size: Connections kept open by a postgres engine, by default
+            ``pool_settings['pool_size']``
 
     Returns:
         :class:`sqlalchemy.engine.Engine`
     """
-    _url = make_url(url)
-
-    if user is not None:
-        """
-        Manually specified user
-        """
-        _url.username = user
-        _url.password = getpass("Password for user %s: " % user)
-
-    engine = create_engine(_url, echo=debug)
-    Session.configure(bind=engine)
-
-    try:
-        c = engine.connect()
-        c.close()
-    except sqlalchemy.exc.OperationalError:
-        raise ClefException('Failed to authenticate with NCI clef.nci.org.au database\n'+
-                            'You need to be part of one of the CMIP groups: oi10, al33, rr3.\n'+
-                            'If you are already please contact the NCI helpdesk')
+    key = (str(url), user, readonly, application_name, statement_timeout, pool_size)
+    engine = _engines.get(key)
+
+    if engine is None:
+        _url = make_url(url)
+
+        if user is not None:
+            """
+            Manually specified user
+            """
+            _url.username = user
+            _url.password = getpass("Password for user %s: " % user)
+
+        kwargs = {'pool_pre_ping': True}
+        if _url.get_backend_name() == 'postgresql':
+            kwargs.update(pool_settings)
+            if pool_size is not None:
+                kwargs['pool_size'] = pool_size
+            connect_args = {'application_name': application_name}
+            if statement_timeout is not None and not readonly:
+                connect_args['options'] = f'-c statement_timeout={statement_timeout}'
+            kwargs['connect_args'] = connect_args
+
+        engine = create_engine(_url, echo=debug, **kwargs)
+        sqlalchemy.event.listen(engine, 'handle_error', _auth_error)
+        if readonly and _url.get_backend_name() == 'postgresql':
+            sqlalchemy.event.listen(engine, 'connect', _readonly_session)
+            sqlalchemy.event.listen(engine, 'checkout',
+                    _transaction_settings(application_name, statement_timeout))
+        _engines[key] = engine
+
+    engine.echo = debug
+    sessions = ReadOnlySession if readonly else Session
+    if sessions.kw.get('bind') is not engine:
+        sessions.configure(bind=engine)
 
     return engine
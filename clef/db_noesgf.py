@@ -17,7 +17,7 @@
 
 import re
 
-from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint, inspect
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -115,20 +115,45 @@ class Variable(Base):
     tdate          = Column(String)
     updated_on     = Column(String)
 
-    def path(self):
+    def path(self, template=None):
         """
         Returns the filepath pattern for a variable based on the drs and filename pattern
+        :input: template the :class:`PathTemplate` of the variable dataset, to reuse it for many variables
         :returns:
         """
-        drs = self.dataset.drs + self.dataset.filename
-        placeholds = re.findall('<[a-zA-Z]*[_]?[a-zA-Z]*>', drs)
-        for col in Dataset.__table__.columns.keys():
-            if "<"+col+">" in placeholds:
-                drs = drs.replace("<"+col+">",getattr(self.dataset,col))
-        for col in Variable.__table__.columns.keys():
-            if "<"+col+">" in placeholds and 'date' not in col:
-                drs = drs.replace("<"+col+">",getattr(self,col))
-        return drs
+        if template is None:
+            template = PathTemplate(self.dataset)
+        return template.render(self)
+
+
+class PathTemplate(object):
+    """
+    The drs and filename pattern of a dataset, split once into fixed text and
+    variable attributes so it can be filled in for each of the dataset variables.
+    Placeholders are column names between <>, i.e. <frequency>, variable dates are
+    left as they are.
+    """
+    placeholder = re.compile('(<[a-zA-Z]*[_]?[a-zA-Z]*>)')
+
+    def __init__(self, dataset):
+        dataset_cols = {c.key: p.key for p in inspect(Dataset).column_attrs for c in p.columns}
+        variable_cols = {c.key: p.key for p in inspect(Variable).column_attrs for c in p.columns
+                         if 'date' not in c.key}
+        # fixed text and the names of the variable attributes, alternating
+        self.parts = ['']
+        for i, part in enumerate(self.placeholder.split(dataset.drs + dataset.filename)):
+            col = part[1:-1]
+            if i % 2 == 0 or (col not in dataset_cols and col not in variable_cols):
+                self.parts[-1] += part
+            elif col in dataset_cols:
+                self.parts[-1] += getattr(dataset, dataset_cols[col])
+            else:
+                self.parts += [variable_cols[col], '']
+
+    def render(self, variable):
+        """Return the path pattern of a variable"""
+        parts = self.parts
+        return ''.join([parts[0]] + [getattr(variable, a) + t for a, t in zip(parts[1::2], parts[2::2])])
 
 
 class ECMWF(Base):
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local copy of the WDCC and ES-DOC documents
+
+``clef docs-sync`` downloads the citations and documentation of the
+simulations in the local catalogue (see :func:`clef.esdoc.sync_docs`) to a
+SQLite database in the cache directory (see :mod:`clef.cache`). The
+functions in :mod:`clef.esdoc` look for a document in the store before
+requesting it from the web services.
+
+Documents are JSON values, stored by kind and key::
+
+    >>> store = DocStore(':memory:')
+    >>> store.put('citation', 'CMIP6.CMIP.CSIRO.ACCESS-ESM1-5.historical', 'Ziehn, Tilo ...')
+    >>> store.get('citation', 'CMIP6.CMIP.CSIRO.ACCESS-ESM1-5.historical')
+    'Ziehn, Tilo ...'
+    >>> store.keys('citation')
+    {'CMIP6.CMIP.CSIRO.ACCESS-ESM1-5.historical'}
+"""
+
+import os
+import json
+import time
+import sqlite3
+
+from .cache import cache_dir
+
+
+class DocStore(object):
+    """Documents saved in a SQLite database
+
+    Args:
+        path (str): database file, created if it doesn't exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS documents ("
+                          "kind TEXT, key TEXT, doc TEXT, retrieved REAL, "
+                          "PRIMARY KEY (kind, key)) WITHOUT ROWID")
+
+    def get(self, kind, key):
+        """Return a document or None if it isn't stored"""
+        row = self.conn.execute("SELECT doc FROM documents WHERE kind = ? AND key = ?",
+                                (kind, key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_many(self, kind, keys):
+        """Return the stored documents for a list of keys as a dict {key: document}"""
+        docs = {}
+        keys = list(keys)
+        # stay under the SQLite limit on the number of parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start+500]
+            rows = self.conn.execute("SELECT key, doc FROM documents WHERE kind = ? AND key IN "
+                                     f"({','.join('?' * len(chunk))})", [kind] + chunk)
+            docs.update((k, json.loads(d)) for k, d in rows)
+        return docs
+
+    def put(self, kind, key, doc):
+        """Store a document, replacing the previous one"""
+        self.put_many(kind, {key: doc})
+
+    def put_many(self, kind, docs):
+        """Store the documents of a dict {key: document} in a single transaction"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                                  [(kind, k, json.dumps(d), now) for k, d in docs.items()])
+
+    def keys(self, kind):
+        """Keys of the stored documents of a kind"""
+        return set(r[0] for r in self.conn.execute("SELECT key FROM documents WHERE kind = ?", (kind,)))
+
+    def close(self):
+        self.conn.close()
+
+
+def store_file():
+    """Default location of the store, None if the cache is disabled"""
+    path = cache_dir()
+    if path is None:
+        return None
+    return os.path.join(path, 'docs.db')
+
+
+# Store opened by doc_store, by file name
+_stores = {}
+
+
+def doc_store(create=False):
+    """Return the default :class:`DocStore`
+
+    Args:
+        create (bool): create the store if it doesn't exist yet
+
+    Returns:
+        :class:`DocStore`, or None if the cache is disabled or docs-sync wasn't run
+    """
+    fname = store_file()
+    if fname is None or (not create and not os.path.exists(fname)):
+        return None
+    if fname not in _stores:
+        _stores[fname] = DocStore(fname)
+    return _stores[fname]
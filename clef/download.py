@@ -20,86 +20,309 @@ import os
 import itertools
 import csv
 import platform
+import time
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+import numpy as np
 
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from datetime import datetime
 
+from .cache import cache_dir
+
+
+# Directory of the download queue tables
+queue_dir = "/g/data/hh5/clef/tables/"
+
+# Queue tables already opened, {project: QueueTable}
+_queues = {}
+
+# Requests are sent by e-mail to the NCI helpdesk
+smtp_host = 'localhost'
+helpdesk_address = 'help@nf.nci.org.au'
+
+# Seconds a :class:`RequestSpooler` collects requests before sending them
+request_window = 300
+
+
+def _new_file(outdir, name):
+    """Create a file that doesn't exist yet, adding a counter to the name if needed"""
+    for n in itertools.count():
+        fpath = os.path.join(outdir or os.getcwd(), name + (f'_{n}' if n else '') + '.txt')
+        try:
+            return open(fpath, 'x'), fpath
+        except FileExistsError:
+            continue
+
+
+def request_files(project, user, missing, outdir=None):
+    """Write missing dataset_ids to request files for synda
+
+    The variables of a synda request file apply to all its dataset_ids, so
+    CMIP5 datasets missing different sets of variables are written to
+    separate files.
 
-def write_request(project, missing):
-    """Write missing dataset_ids to file to create download request for synda
- 
     Args:
         project (string): project, i.e. CMIP5/CMIP6
-        missing (list): dataset_id not yet on local db or in the download queue 
-    """
+        user (string): NCI user id
+        missing (list): dataset_ids, "dataset_id variable" for CMIP5
+        outdir (string): directory of the files, default current directory
 
-    user = os.environ.get('USER', 'unknown')
+    Returns:
+        fpaths (list): paths of the request files
+    """
     tstamp = datetime.now().strftime("%Y%m%dT%H%M%S")
-    # open file and write missing dataset_ids
-    fname = "_".join([project,user,tstamp])+".txt"
-    fpath = os.path.join(os.getcwd(),fname)
-    f = open(fpath, 'w')
     # with CMIP5 variable/s have to be specified too
-    variables=set()
+    variables = {}
     for m in missing:
         if project == 'CMIP5':
             did,var = m.split(" ")
-            variables.add(var)
+            variables.setdefault(did, []).append(var)
         else:
-            did = m
-        f.write('dataset_id='+did+'\n')
-    if len(variables) > 0:
-        f.write(" ".join(['variable='] + list(variables)))
-    f.close()
+            variables.setdefault(m, [])
+    requests = {}
+    for did, var in variables.items():
+        requests.setdefault(tuple(sorted(set(var))), []).append(did)
+    fpaths = []
+    for var, dids in requests.items():
+        f, fpath = _new_file(outdir, "_".join([project,user,tstamp]))
+        with f:
+            for did in dids:
+                f.write('dataset_id='+did+'\n')
+            if len(var) > 0:
+                f.write(" ".join(['variable='] + list(var)))
+        fpaths.append(fpath)
+    return fpaths
+
+
+def write_request(project, missing):
+    """Write missing dataset_ids to file to create download request for synda
+ 
+    Args:
+        project (string): project, i.e. CMIP5/CMIP6
+        missing (list): dataset_id not yet on local db or in the download queue 
+    """
+
+    user = os.environ.get('USER', 'unknown')
+    fpaths = request_files(project, user, missing)
 
     # print('\nFinished writing file: '+fname)
     if platform.node()[0:3] == 'vdi':
         answer = input('Do you want to proceed with request for missing files? (N/Y)\n No is default\n')
         if answer  in ['Y','y','yes','YES']:
-            helpdesk(user, fpath, project)
+            for fpath in fpaths:
+                helpdesk(user, fpath, project)
             return
-    print(f'Your request has been saved in \n {fpath}')
+    print('Your request has been saved in \n ' + '\n '.join(fpaths))
     print('You can use this file to request the data via the NCI helpdesk: help@nci.org.au  or https://help.nci.org.au.')
     return
 
 
-def helpdesk(user, fpath, project):
-    """Send e-mail and synda request to helpdesk
- 
+def request_message(user, fpath, project):
+    """E-mail to the helpdesk with a request file attached
+
     Args:
         user (string): NCI user id
         fpath (string): path of request file
         project (string): project, i.e. CMIP5/CMIP6
+
+    Returns:
+        msg (MIMEMultipart): the message
     """
     fname = os.path.basename(fpath)
     msg = MIMEMultipart()
     msg['From'] = user+'@nci.org.au'
-    msg['To'] = 'help@nf.nci.org.au'
+    msg['To'] = helpdesk_address
     msg['Subject'] = 'Synda request: ' + fname
     message = project + " synda download requested from user: " + user
     msg.attach(MIMEText(message, 'plain'))
-    f = open(fpath)
-    attachment=MIMEText(f.read())
-    f.close()
+    with open(fpath) as f:
+        attachment=MIMEText(f.read())
     attachment.add_header('Content-Disposition','attachment', filename=fname)
     msg.attach(attachment)
+    return msg
+
+
+def helpdesk(user, fpath, project, smtp=None):
+    """Send e-mail and synda request to helpdesk
+ 
+    Args:
+        user (string): NCI user id
+        fpath (string): path of request file
+        project (string): project, i.e. CMIP5/CMIP6
+        smtp (smtplib.SMTP): open connection to use, by default a new
+            connection to localhost
+
+    Returns:
+        True if the e-mail was sent
+    """
+    msg = request_message(user, fpath, project)
     try:
-       smtpObj = smtplib.SMTP('localhost')
+       smtpObj = smtp if smtp is not None else smtplib.SMTP(smtp_host)
        smtpObj.sendmail(msg['From'],msg['To'],msg.as_string())
        print( "Your request was successfully sent to the NCI helpdesk")
-       print(f'A copy of your request has been saved in \n {f.name}')
+       print(f'A copy of your request has been saved in \n {fpath}')
+       return True
     except smtplib.SMTPException:
        print("Error: unable to send email")
-       print(f'Your request has been saved in \n {f.name}')
+       print(f'Your request has been saved in \n {fpath}')
        print('You can use this file to request the data via the NCI helpdesk:\n'+
              ' help@nci.org.au  or https://help.nci.org.au.')
-    return
+    return False
 
-def read_queue(project):
-    """Read queue csv file
+
+class RequestSpooler(object):
+    """Collect download requests and send them to the helpdesk in batches
+
+    Meant for workflow tools making many requests. Dataset_ids already in
+    the download queue (see :func:`load_queue`) or already requested through
+    the spooler are dropped. The others are held until ``window`` seconds
+    have passed since the first pending one, then the requests of each
+    project are written to request files (one per set of CMIP5 variables)
+    and each file is sent in an e-mail. All e-mails go through the same SMTP
+    connection.
+
+    There is no timer, the window is only checked when :meth:`add` is
+    called. Requests still pending when no more are added are sent by
+    :meth:`flush` or :meth:`close`, which is called at the end of a ``with``
+    block.
+
+    Example::
+
+        with RequestSpooler() as spooler:
+            for missing in results:
+                spooler.add('CMIP6', missing)
 
     Args:
+        user (string): NCI user id, default $USER
+        window (float): seconds requests are collected before being sent
+        outdir (string): directory of the request files, default current directory
+        host (string): SMTP server
+        port (int): SMTP server port, 0 for the default
+        send (bool): e-mail the requests, if False only write the files
+    """
+
+    def __init__(self, user=None, window=request_window, outdir=None,
+                 host=None, port=0, send=True):
+        self.user = user or os.environ.get('USER', 'unknown')
+        self.window = window
+        self.outdir = outdir
+        self.host = host or smtp_host
+        self.port = port
+        self.send = send
+        self.pending = {}
+        self.requested = set()
+        self.files = []
+        self._started = None
+        self._smtp = None
+
+    @staticmethod
+    def _queued(table, project, request):
+        did = request.split(" ")[0].replace('output.','output1.')
+        entry = table.get(did)
+        if entry is None:
+            return False
+        if project == 'CMIP5':
+            return request.split(" ")[1] in entry
+        return True
+
+    def add(self, project, missing):
+        """Add requests, sending the pending ones if the time window has passed
+
+        Args:
+            project (string): project, i.e. CMIP5/CMIP6
+            missing (list): dataset_ids, "dataset_id variable" for CMIP5
+
+        Returns:
+            list of the requests added, without duplicates and queued datasets
+        """
+        table = load_queue(project)
+        added = []
+        for m in missing:
+            key = (project, m)
+            if key in self.requested or self._queued(table, project, m):
+                continue
+            self.requested.add(key)
+            self.pending.setdefault(project, []).append(m)
+            added.append(m)
+        if added and self._started is None:
+            self._started = time.monotonic()
+        if self.due():
+            self.flush()
+        return added
+
+    def due(self):
+        """True if the pending requests have waited for the whole time window"""
+        return self._started is not None and time.monotonic() - self._started >= self.window
+
+    def flush(self):
+        """Write and send the pending requests now
+
+        Returns:
+            list of the request files written
+        """
+        files = []
+        for project, missing in sorted(self.pending.items()):
+            for fpath in request_files(project, self.user, missing, self.outdir):
+                files.append(fpath)
+                if self.send:
+                    self._sendmail(fpath, project)
+        self.pending = {}
+        self._started = None
+        self.files.extend(files)
+        return files
+
+    def _connection(self):
+        if self._smtp is not None:
+            # the server may have closed an idle connection
+            try:
+                self._smtp.noop()
+            except (OSError, smtplib.SMTPException):
+                self._smtp = None
+        if self._smtp is None:
+            self._smtp = smtplib.SMTP(self.host, self.port)
+        return self._smtp
+
+    def _sendmail(self, fpath, project):
+        try:
+            smtp = self._connection()
+        except (OSError, smtplib.SMTPException):
+            print("Error: unable to connect to the mail server")
+            print(f'Your request has been saved in \n {fpath}')
+            return False
+        return helpdesk(self.user, fpath, project, smtp=smtp)
+
+    def close(self):
+        """Send the pending requests and close the SMTP connection"""
+        self.flush()
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (OSError, smtplib.SMTPException):
+                pass
+            self._smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def queue_file(project):
+    """Path of the download queue csv file of a project"""
+    return os.path.join(queue_dir, project + "_clef_table.csv")
+
+
+def parse_queue(fname, project):
+    """Parse a queue csv file
+
+    Args:
+        fname (string): queue csv file
         project (string): project, i.e. CMIP5/CMIP6
 
     Returns:
@@ -109,47 +332,272 @@ def read_queue(project):
     rows={}
     dids=set()
     # open csv file and read data in dictionary with dataset_id as key
+    with open(fname,"r") as csvfile:
+        table_read = csv.reader(csvfile)
+    # for each row save did-var (to distinguish CMIP5) and separate set of unique dids
+        for row in table_read:
+            if project == 'CMIP5':
+                rows[(row[1],row[0])] = row[2]
+                dids.add(row[1])
+            elif project == 'CMIP6':
+                rows[(row[0])] = row[1]
+                dids.add(row[0])
+    return rows, dids
+
+
+def read_queue(project):
+    """Read queue csv file
+
+    Args:
+        project (string): project, i.e. CMIP5/CMIP6
+
+    Returns:
+        rows (dict): - prsenting each record stored in the file
+        dids (set): dataset_ids stored in the file
+    """
     try:
-        with open("/g/data/hh5/clef/tables/" + project + "_clef_table.csv","r") as csvfile:
-            table_read = csv.reader(csvfile)
-        # for each row save did-var (to distinguish CMIP5) and separate set of unique dids
-            for row in table_read:
-                if project == 'CMIP5':
-                    rows[(row[1],row[0])] = row[2]
-                    dids.add(row[1])
-                elif project == 'CMIP6':
-                    rows[(row[0])] = row[1]
-                    dids.add(row[0])
+        return parse_queue(queue_file(project), project)
     except FileNotFoundError:
         # Queue not available
-        pass
-    return rows, dids
- 
+        return {}, set()
 
-def find_dids(qm, rows, dids, project, varlist):
+
+class QueueTable(object):
+    """Binary copy of a queue csv file, searched without loading it
+
+    The file has a header with the modification time and size of the csv
+    file it was made from, the status and variable names, then one record
+    per row sorted on a 64 bit hash of the dataset_id, and last the
+    dataset_ids themselves. Opening it memory maps the records, so processes
+    reading the same file share it through the page cache, and a dataset is
+    found with a binary search on the hashes. The records found are checked
+    against their dataset_id, so two datasets with the same hash aren't
+    confused.
+
+    >>> table = QueueTable(QueueTable.pack({('ds1', 'tas'): 'done', ('ds1', 'pr'): 'queued'},
+    ...                                    'CMIP5', (0, 0)))
+    >>> table.get('ds1')
+    {'pr': 'queued', 'tas': 'done'}
+    >>> 'ds2' in table
+    False
+    """
+    magic = b'CLEFQ002'
+    header = struct.Struct('<8sqqqq')
+    dtype = np.dtype([('hash', '<u8'), ('offset', '<u4'), ('length', '<u4'),
+                      ('variable', '<u4'), ('status', '<u4')])
+
+    def __init__(self, buf):
+        magic, mtime, size, n, tlen = self.header.unpack_from(buf, 0)
+        if magic != self.magic:
+            raise ValueError('Not a clef queue table')
+        self.stamp = (mtime, size)
+        names = json.loads(bytes(buf[self.header.size:self.header.size + tlen]))
+        self.project = names['project']
+        self.statuses = names['status']
+        self.variables = names['variable']
+        self.entries = np.frombuffer(buf, self.dtype, count=n,
+                                     offset=self._offset(tlen))
+        self._hashes = self.entries['hash']
+        self._buf = buf
+        self._dids = self._offset(tlen) + n * self.dtype.itemsize
+
+    @classmethod
+    def _offset(cls, tlen):
+        # records start on an 8 byte boundary
+        return -(-(cls.header.size + tlen) // 8) * 8
+
+    @staticmethod
+    def did_hash(did):
+        """64 bit hash of a dataset_id"""
+        return np.uint64(int.from_bytes(hashlib.blake2b(did.encode(), digest_size=8).digest(),
+                                        'little'))
+
+    @classmethod
+    def pack(cls, rows, project, stamp):
+        """Create the table from the rows of a queue csv file
+
+        Args:
+            rows (dict): queue records as returned by :func:`read_queue`
+            project (string): project, i.e. CMIP5/CMIP6
+            stamp (tuple): modification time in ns and size of the csv file
+
+        Returns:
+            table contents (bytes)
+        """
+        index = queue_index(rows, project)
+        statuses = sorted(set(rows.values()))
+        if project == 'CMIP5':
+            variables = sorted(set(k[1] for k in rows))
+            items = [(did, var, status) for did, v in index.items() for var, status in v.items()]
+        else:
+            variables = ['']
+            items = [(did, '', status) for did, status in index.items()]
+        scode = {x: i for i, x in enumerate(statuses)}
+        vcode = {x: i for i, x in enumerate(variables)}
+        # each dataset_id is stored once, after the records
+        dids = {}
+        blob = bytearray()
+        for did in index:
+            encoded = did.encode()
+            dids[did] = (len(blob), len(encoded))
+            blob += encoded
+        entries = np.array([(cls.did_hash(did), *dids[did], vcode[var], scode[status])
+                            for did, var, status in items], dtype=cls.dtype)
+        entries.sort(order=['hash', 'offset', 'variable'])
+
+        names = json.dumps({'project': project, 'status': statuses,
+                            'variable': variables}).encode()
+        head = cls.header.pack(cls.magic, stamp[0], stamp[1], len(entries), len(names))
+        padding = b'\0' * (cls._offset(len(names)) - len(head) - len(names))
+        return head + names + padding + entries.tobytes() + bytes(blob)
+
+    @classmethod
+    def open(cls, fname):
+        """Memory map a table file, returns None if it can't be read"""
+        try:
+            with open(fname, 'rb') as f:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def _find(self, did):
+        h = self.did_hash(did)
+        lo = np.searchsorted(self._hashes, h, side='left')
+        hi = np.searchsorted(self._hashes, h, side='right')
+        found = self.entries[lo:hi]
+        start = self._dids
+        encoded = did.encode()
+        same = [self._buf[start + o:start + o + n] == encoded
+                for o, n in zip(found['offset'], found['length'])]
+        return found[np.array(same, dtype=bool)]
+
+    def __contains__(self, did):
+        return len(self._find(did)) > 0
+
+    def get(self, did, default=None):
+        """Queue status of a dataset, as in :func:`queue_index`"""
+        found = self._find(did)
+        if len(found) == 0:
+            return default
+        if self.project == 'CMIP5':
+            return {self.variables[v]: self.statuses[s] for v, s in zip(found['variable'], found['status'])}
+        return self.statuses[found['status'][0]]
+
+
+def _table_files(project):
+    """Possible locations of the binary queue table, shared one first"""
+    name = f'.{project}_clef_table.bin'
+    files = [os.path.join(queue_dir, name)]
+    path = cache_dir()
+    if path is not None:
+        files.append(os.path.join(path, 'queue', name))
+    return files
+
+
+def load_queue(project):
+    """Return the queue of a project as a :class:`QueueTable`
+
+    The binary table next to the csv file is used if it matches the csv
+    modification time and size, otherwise the csv is read and the table
+    written again, in the user cache if the queue directory isn't writable.
+
+    Args:
+        project (string): project, i.e. CMIP5/CMIP6
+
+    Returns:
+        :class:`QueueTable`, or an empty dict if the queue is not available
+    """
+    try:
+        st = os.stat(queue_file(project))
+        stamp = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        # Queue not available
+        return {}
+    cached = _queues.get(project)
+    if cached is not None and cached.stamp == stamp:
+        return cached
+
+    files = _table_files(project)
+    for fname in files:
+        table = QueueTable.open(fname)
+        if table is not None and table.stamp == stamp:
+            _queues[project] = table
+            return table
+
+    rows, dids = read_queue(project)
+    data = QueueTable.pack(rows, project, stamp)
+    table = QueueTable(data)
+    for fname in files:
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            # the directory can be shared between hosts, where process ids
+            # aren't unique, so let tempfile pick the name
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(fname), suffix='.tmp',
+                                             delete=False) as f:
+                tmp = f.name
+                f.write(data)
+            # tempfile creates it readable only by the owner
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, fname)
+            table = QueueTable.open(fname) or table
+            break
+        except OSError:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            continue
+    _queues[project] = table
+    return table
+
+
+def queue_index(rows, project):
+    """Group the queue rows by dataset_id
+
+    Args:
+        rows (dict): queue records as returned by :func:`read_queue`
+        project (string): project, i.e. CMIP5/CMIP6
+
+    Returns:
+        index (dict): {dataset_id: {variable: status}} for CMIP5,
+                      {dataset_id: status} for CMIP6
+    """
+    index = {}
+    if project == 'CMIP5':
+        for (did, var), status in rows.items():
+            index.setdefault(did, {})[var] = status
+    elif project == 'CMIP6':
+        index = dict(rows)
+    return index
+
+
+def find_dids(qm, rows, dids, project, varlist, index=None):
     """ Retrieve missing dataset ids from dictionary representing queue table
     :input: qm - query results
     :input: rows - a dictionary representing each record stored in the file
     :input: dids - a set of unique dataset_ids stored in the file
     :input: project - CMIP5 or CMIP6 currently
     :input: varlist - optional list of requested variables for CMIP5
+    :input: index - optional rows grouped by dataset_id, from :func:`queue_index`
+                    or a :class:`QueueTable`, used instead of rows and dids
     :return: queued - a dictionary with (did+var,status) for CMIP5 and (did,status) for CMIP6
              filtered based on query results
     """
+    if index is None:
+        index = queue_index(rows, project)
+        index = {k: v for k, v in index.items() if k in dids}
     queued={}
-    for q in qm:
-        did = q[0].replace('output.','output1.')
-        if did in dids:
+    # in the order of the query results, so the list printed is the same every time
+    for did in dict.fromkeys(q[0].replace('output.','output1.') for q in qm):
+        entry = index.get(did)
+        if entry is None:
+            continue
         # when CMIP5 you need to match also the variable
-            if project == "CMIP5":
-                if varlist != []:
-                    queued.update({k[0]+" "+k[1]: v for k,v in rows.items() if k[0]==did and k[1] in varlist})
-                else:
-                    queued.update({k[0]+" "+k[1]: v for k,v in rows.items() if k[0]==did})
-            elif project == "CMIP6":
-                queued.update({k: v for k,v in rows.items() if k==did})
-            else:
-                 pass
+        if project == "CMIP5":
+            for var, status in entry.items():
+                if varlist == [] or var in varlist:
+                    queued[did+" "+var] = status
+        elif project == "CMIP6":
+            queued[did] = entry
     return queued
 
 def search_queue_csv(qm, project, varlist):
@@ -165,10 +613,10 @@ def search_queue_csv(qm, project, varlist):
     """
 
     # read queue file
-    rows, dids = read_queue(project)
+    table = load_queue(project)
     
     # retrieve from table the missing dataset_ids
-    queued = find_dids(qm, rows, dids, project, varlist)
+    queued = find_dids(qm, {}, set(), project, varlist, table)
     if len(queued) > 0:
         print("\nThe following datasets are not yet available in the database," +
               "\nbut they have been requested or recently downloaded\n")
@@ -15,14 +15,42 @@
 # limitations under the License.
 
 
+import os
+import time
+import logging
 import requests
-import pandas as pd
 import pkg_resources
 import json
 
-from bs4 import BeautifulSoup
+from lxml import etree, html
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
 
+from .cache import cache_dir
+from .docstore import doc_store
+from .exception import ClefException
+
+
+# Number of citation pages retrieved at the same time
+citation_workers = 8
+
+# Seconds a retrieved citation is reused for
+citation_ttl = 30 * 24 * 3600
+
+# Tracking ids resolved by each request to the errata service
+errata_batch = 100
+
+# Number of errata issues retrieved at the same time
+errata_workers = 8
+
+# Seconds a retrieved errata issue is reused for, issues change status more often than citations
+errata_ttl = 24 * 3600
+
+# Documents retrieved by docs-sync before they are written to the store
+sync_batch = 500
+
+log = logging.getLogger(__name__)
+
 
 def esdoc_urls(dataset_ids):
     """
@@ -41,12 +69,8 @@ def esdoc_urls(dataset_ids):
         esdoc_urls.append(urls)
     return esdoc_urls
 
-def get_wdcc(dataset_id):
-    '''Retrieve metadata documentation from WDCC site, this is less detailed than esdoc but often more readable
-        :input: dataset_id (str) the simulation dataset_id
-        :return: wdcc_url (str) the wdcc_url for the document
-        :return: r.json() (dict) the web response as json
-    '''
+def get_wdcc_url(dataset_id):
+    '''Return the WDCC url for the documentation of a dataset, None for projects without it'''
     wdcc_root = 'https://cera-www.dkrz.de/WDCC/ui/cerasearch/'
     settings = 'select?rows=1&wt=json'
     project=dataset_id.split(".")[0]
@@ -58,52 +82,148 @@ def get_wdcc(dataset_id):
         #wdcc_url = wdcc_root + f'cerarest/exportcmip6?input={entry}'
         wdcc_url = wdcc_root + f'cerarest/cmip6?input={entry}'
     else:
+        wdcc_url = None
+    return wdcc_url
+
+
+def get_wdcc(dataset_id):
+    '''Retrieve metadata documentation from WDCC site, this is less detailed than esdoc but often more readable
+        :input: dataset_id (str) the simulation dataset_id
+        :return: wdcc_url (str) the wdcc_url for the document
+        :return: r.json() (dict) the web response as json
+    '''
+    wdcc_url = get_wdcc_url(dataset_id)
+    if wdcc_url is None:
         print('No wdcc documents available for this project')
         return None, None
+    store = doc_store()
+    doc = store.get('wdcc', wdcc_url) if store is not None else None
+    if doc is not None:
+        return wdcc_url, StoredResponse(doc)
     r = requests.get(wdcc_url)
     return wdcc_url, r
 
 
+class StoredResponse(object):
+    """Document read from the :mod:`clef.docstore`, in place of a web response"""
+
+    def __init__(self, doc):
+        self.doc = doc
+
+    def json(self):
+        return self.doc
+
+
+# Parts of the web pages used, the XPath expressions are compiled once
+_citation_path = etree.XPath('//dt[normalize-space()="Citation"]/following-sibling::*[1]')
+_tables_path = etree.XPath('//table')
+_rows_path = etree.XPath('./thead/tr | ./tbody/tr | ./tr')
+_cells_path = etree.XPath('./th | ./td')
+
+
+def parse_html(content):
+    """Parse a web page with lxml
+
+    Args:
+        content (bytes or str): the page
+
+    Returns:
+        root element of the page
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return html.fromstring(content)
+
+
+def cell_text(el):
+    """Text of an element with the whitespace collapsed, as pandas.read_html returns it"""
+    return ' '.join(el.text_content().split())
+
+
+def html_tables(doc):
+    """Cell texts of the tables of a page, without the header rows
+
+    >>> html_tables(parse_html('<table><tr><th>Name</th><th>Value</th></tr>'
+    ...                        '<tr><td>Keywords</td><td>a,  b</td></tr></table>'))
+    [[['Keywords', 'a, b']]]
+
+    Args:
+        doc: page parsed with :func:`parse_html`
+
+    Returns:
+        list of tables, each a list of rows, each a list of cell texts
+    """
+    tables = []
+    for table in _tables_path(doc):
+        rows = []
+        for tr in _rows_path(table):
+            cells = _cells_path(tr)
+            # header rows, either in thead or th only rows at the start
+            if tr.getparent().tag == 'thead' or (not rows and all(c.tag == 'th' for c in cells)):
+                continue
+            rows.append([cell_text(c) for c in cells])
+        tables.append(rows)
+    return tables
+
+
+def citation_text(doc):
+    """Citation from a WDCC page, None if the page has none
+
+    Args:
+        doc: page parsed with :func:`parse_html`
+    """
+    found = _citation_path(doc)
+    if not found:
+        return None
+    return found[0].text_content().replace(" BibTeX  RIS","")
+
+
 def print_model(tables):
     ''' Print out esdoc CIM2 model document
-        :input: tables (str) html tables downloaded from web interface
+        :input: tables (list) html tables downloaded from web interface, see html_tables
     '''
-    dfs = pd.read_html(str(tables[0]))
-    df = dfs[0]
-    for i in range(0, df.shape[0]):
-        print(df.iloc[i,0] +' > ' + df.iloc[i,1])
+    for row in tables[0]:
+        print(row[0] +' > ' + row[1])
     for table in tables[1:]:
-        dfs = pd.read_html(str(table))
-        df = dfs[0]
-        print(f'{df.iloc[0,0].replace(">","-")} > {df.iloc[2,1]}')
+        print(f'{table[0][0].replace(">","-")} > {table[2][1]}')
     return
 
 def print_doc(tables, dtype):
     ''' Print out esdoc document, all types except model
-        :input: tables (str?) html tables downloaded from web interface
+        :input: tables (list) html tables downloaded from web interface, see html_tables
         :input: dtype (str) - the kind of document (i.e. experiment, mip)
     '''
     for table in tables:
-        dfs = pd.read_html(str(table))
-        df = dfs[0]
-        for i in range(0, df.shape[0]):
-           if df.iloc[i,0] != 'Keywords' and df.iloc[i,1] != '--':
-               print(df.iloc[i,0] +' > ' + df.iloc[i,1])
+        for row in table:
+           if len(row) > 1 and row[0] != 'Keywords' and row[1] != '--':
+               print(row[0] +' > ' + row[1])
     return
 
+def doc_service(dtype, name, project='CMIP6'):
+    '''Return the url of an esdoc document, see get_doc for the arguments'''
+    stype = {'model': 'CIM.2.SCIENCE.MODEL', 'mip': 'cim.2.designing.Project',
+             'experiment': 'cim.2.designing.NumericalExperiment'}
+    return ('https://api.es-doc.org/2/document/search-name?client=ESDOC-VIEWER-DEMO&encoding=html'+
+            f'&project={project}&name={name}&type={stype[dtype]}')
+
+
+def doc_tables(service):
+    '''Retrieve an esdoc document and return its tables, see html_tables'''
+    r = requests.get(service, timeout=60)
+    return html_tables(parse_html(r.content))
+
+
 def get_doc(dtype, name, project='CMIP6'):
     '''Retrieve esdoc document and then call function to print it to screen
         :input: project (str) - ESGF project
         :input: dtype (str) - the kind of document (i.e. experiment, mip)
         :input: name (str) - the canonical name of the related document, usually model/experiment/mip name works
     '''
-    stype = {'model': 'CIM.2.SCIENCE.MODEL', 'mip': 'cim.2.designing.Project',
-             'experiment': 'cim.2.designing.NumericalExperiment'}
-    service = ('https://api.es-doc.org/2/document/search-name?client=ESDOC-VIEWER-DEMO&encoding=html'+
-              f'&project={project}&name={name}&type={stype[dtype]}')
-    r = requests.get(service)
-    soup = BeautifulSoup(r.text,'lxml')
-    tables = soup.findAll("table")
+    service = doc_service(dtype, name, project)
+    store = doc_store()
+    tables = store.get('doc', service) if store is not None else None
+    if tables is None:
+        tables = doc_tables(service)
     if dtype == 'model':
         print_model(tables)
     else:
@@ -114,28 +234,129 @@ def get_doc(dtype, name, project='CMIP6'):
 def errata(tracking_id):
     '''Return errata uids connected to a tracking id
     '''
-    service = 'https://errata.es-doc.org/1/resolve/pid?pids='
-    r = requests.get(service + tracking_id.split(":")[1])
-    try:
-        uids = r.json()['errata'][0][1][0][0]
-        if uids:
-            return [x for x in uids.split(';')]
-        else:
-            return None
-    except KeyError:
-        print(f'Issue with handle: {tracking_id}')
-        print(r.json()["errorMessage"])
-        return None
+    return resolve_pids([tracking_id]).get(tracking_id)
+
+
+def resolve_pids(tracking_ids, batch=errata_batch):
+    """Errata uids connected to many tracking ids
+
+    The tracking ids are sent to the errata service :data:`errata_batch`
+    at a time, as a list in a single `pids` parameter.
+
+    Args:
+        tracking_ids (list): file or dataset tracking ids, i.e. hdl:21.14100/...
+        batch (int): maximum number of tracking ids in a request
+
+    Returns:
+        dict {tracking_id: list of errata uids}, only for the tracking ids with errata.
+        Batches the service fails to resolve are reported and skipped.
+    """
+    service = 'https://errata.es-doc.org/1/resolve/pid'
+    # the service wants the handles without the hdl: prefix
+    handles = {tid.split(":")[-1]: tid for tid in set(tracking_ids)}
+    keys = sorted(handles)
+    found = {}
+    for start in range(0, len(keys), batch):
+        chunk = keys[start:start+batch]
+        try:
+            r = requests.get(service, params={'pids': ','.join(chunk)}, timeout=60)
+            r.raise_for_status()
+            response = r.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f'Issue with handles: {", ".join(handles[k] for k in chunk)}')
+            print(e)
+            continue
+        if 'errata' not in response:
+            print(f'Issue with handles: {", ".join(handles[k] for k in chunk)}')
+            print(response.get("errorMessage"))
+            continue
+        for pid, result in response['errata']:
+            uids = result[0][0] if result and result[0] else None
+            if uids:
+                found[handles.get(pid.split(":")[-1], pid)] = uids.split(';')
+    return found
+
+
+def retrieve_issue(uid):
+    """Retrieve one errata issue from the errata service"""
+    service = 'https://errata.es-doc.org/1/issue/retrieve?uid='
+    r = requests.get(service + uid, timeout=60)
+    r.raise_for_status()
+    return r.json()['issue']
 
 
 def retrieve_error(uid):
     ''' Accept error uid and return errata as json plus webpage to view error '''
     view = 'https://errata.es-doc.org/static/view.html?uid='
-    service = 'https://errata.es-doc.org/1/issue/retrieve?uid='
-    r = requests.get(service + uid)
-    error = {view+uid: r.json()['issue']}
+    error = {view+uid: retrieve_issue(uid)}
     return error
 
+
+def retrieve_issues(uids, workers=errata_workers):
+    """Retrieve errata issues, several at a time, reusing the ones saved in the user cache
+
+    Issues that can't be retrieved are reported and left out, the ones
+    retrieved are still saved.
+
+    Args:
+        uids (list): errata uids
+        workers (int): maximum number of issues retrieved at the same time
+
+    Returns:
+        dict {uid: issue}
+    """
+    saved = load_cache('errata.json', errata_ttl)
+    missing = sorted(set(u for u in uids if u not in saved))
+    failed = {}
+    if missing:
+        def retrieve(uid):
+            try:
+                return retrieve_issue(uid), None
+            except (requests.RequestException, ValueError, KeyError) as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+            now = time.time()
+            for uid, (issue, error) in zip(missing, pool.map(retrieve, missing)):
+                if error is None:
+                    saved[uid] = [issue, now]
+                else:
+                    failed[uid] = error
+        save_cache('errata.json', saved)
+    for uid, error in failed.items():
+        print(f'Errata issue {uid} not available: {error!r}')
+    return {u: saved[u][0] for u in uids if u in saved}
+
+
+def check_errata(tracking_ids):
+    """Errata issues affecting a list of files or datasets
+
+    Args:
+        tracking_ids (list): file or dataset tracking ids
+
+    Returns:
+        dict {tracking_id: list of issues}, only for the tracking ids with errata
+    """
+    found = resolve_pids(tracking_ids)
+    issues = retrieve_issues(sorted(set(u for uids in found.values() for u in uids)))
+    return {tid: [issues[u] for u in uids if u in issues] for tid, uids in found.items()}
+
+
+def print_path_errata(paths, tracking_ids):
+    """Print paths followed by the errata issues affecting their files
+
+    Args:
+        paths (list): directory paths, as returned by a local query
+        tracking_ids (dict): {path: tracking ids of the files in the path}
+    """
+    view = 'https://errata.es-doc.org/static/view.html?uid='
+    found = check_errata([t for tids in tracking_ids.values() for t in tids])
+    for p in paths:
+        print(p)
+        issues = {i['uid']: i for t in tracking_ids.get(p, []) for i in found.get(t, [])}
+        for uid, issue in sorted(issues.items()):
+            print(f'    errata ({issue["severity"]}, {issue["status"]}): {issue["title"]} {view}{uid}')
+
 def print_error(uid):
     error = retrieve_error(uid)
     for k in error.keys():
@@ -144,22 +365,121 @@ def print_error(uid):
         print(f'Status: {error[k]["status"]}')
         print(f'Description: {error[k]["description"]}')
 
-def citation(dids):
-    '''Retrieve citations for a list of CMIP6 dataset ids'''
-    citations = []
+def citation_page(prefix):
+    """Retrieve the citation of a CMIP6 simulation from the WDCC website
+
+    Args:
+        prefix (str): first five components of the dataset_id, i.e. CMIP6.CMIP.NCC.NorESM2-LM.historical
+
+    Returns:
+        cite (str): the citation, with a YYYYMMDD placeholder for the version
+    """
     url = 'https://cera-www.dkrz.de/WDCC/ui/cerasearch/cmip6?input=' 
+    response = requests.get(url+prefix, headers={"User-Agent": "Requests"}, timeout=60)
+    cite = citation_text(parse_html(response.content))
+    if cite is None:
+        raise ClefException(f'No citation found for {prefix}')
+    return cite
+
+
+def _cache_file(name):
+    path = cache_dir()
+    if path is None:
+        return None
+    return os.path.join(path, name)
+
+
+def load_cache(name, ttl):
+    """Documents saved in the user cache, still within ttl
+
+    Args:
+        name (str): cache file name
+        ttl (int): seconds a document is reused for
+
+    Returns:
+        dict {key: [document, time retrieved]}
+    """
+    fname = _cache_file(name)
+    if fname is None:
+        return {}
+    try:
+        with open(fname) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    oldest = time.time() - ttl
+    return {k: v for k, v in saved.items() if v[1] > oldest}
+
+
+def save_cache(name, docs):
+    """Save documents in the user cache, see :func:`load_cache`"""
+    fname = _cache_file(name)
+    if fname is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        tmp = f'{fname}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(docs, f)
+        os.replace(tmp, fname)
+    except OSError:
+        # caching is best effort
+        pass
+
+
+def citation(dids, workers=citation_workers):
+    """Retrieve citations for a list of CMIP6 dataset ids
+
+    Datasets of the same simulation share a citation, the page of each
+    simulation is retrieved only once, several at a time, and saved in the
+    user cache for the next calls. Simulations whose page can't be retrieved
+    are reported and left out, the citations retrieved are still saved.
+
+    Args:
+        dids (list): CMIP6 dataset_ids
+        workers (int): maximum number of pages retrieved at the same time
+
+    Returns:
+        citations (list): one citation per dataset_id, except the ones that failed
+    """
+    citations = []
     #fexp = pkg_resources.resource_filename(__name__, 'data/CMIP6_exp_act.json')
     #with open(fexp, 'r') as f:
     #     data = json.loads(f.read())
-    for did in dids:
-# get facets from did to build correct url
-        did_bits = did.split(".")
-        version = did_bits[9]
-        newdid = ".".join(did_bits[0:5])
-        response = requests.get(url+newdid, headers={"User-Agent": "Requests"})
-        soup = BeautifulSoup(response.content, 'lxml')
-        el = soup.find('dt', text="Citation")
-        cite = el.next_sibling.text.replace(" BibTeX  RIS","")
+    # get facets from did to build correct url
+    prefixes = [".".join(did.split(".")[0:5]) for did in dids]
+    cites = load_cache('citations.json', citation_ttl)
+    missing = sorted(set(p for p in prefixes if p not in cites))
+    store = doc_store()
+    if missing and store is not None:
+        now = time.time()
+        for prefix, cite in store.get_many('citation', missing).items():
+            cites[prefix] = [cite, now]
+        missing = [p for p in missing if p not in cites]
+    failed = {}
+    if missing:
+        def retrieve(prefix):
+            try:
+                return citation_page(prefix), None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+            now = time.time()
+            for prefix, (cite, error) in zip(missing, pool.map(retrieve, missing)):
+                if error is None:
+                    cites[prefix] = [cite, now]
+                else:
+                    failed[prefix] = error
+        save_cache('citations.json', cites)
+    for prefix, error in failed.items():
+        print(f'Citation not available for {prefix}: {error}')
+
+    for did, newdid in zip(dids, prefixes):
+        if newdid in failed:
+            continue
+        version = did.split(".")[9]
+        cite = cites[newdid][0]
         if version == 'none':
             now = date.today()
             citations.append(cite.replace("Version YYYYMMDD[1]",f'Accessed on {now}'))
@@ -167,6 +487,72 @@ def citation(dids):
             citations.append(cite.replace("YYYYMMDD[1].",f"{version}. "))
     return citations
 
+def sync_docs(sims, refresh=False, workers=citation_workers):
+    """Save the documents of CMIP6 simulations to the document store
+
+    Downloads the WDCC citation and metadata of every simulation and the
+    ES-DOC documents of the models, experiments and MIPs, several at a time,
+    see :mod:`clef.docstore`. Documents are written to the store every
+    :data:`sync_batch` retrieved, so an interrupted sync keeps them.
+
+    Args:
+        sims (list): (activity_id, institution_id, source_id, experiment_id)
+            of each simulation
+        refresh (bool): download again the documents already stored
+        workers (int): maximum number of documents retrieved at the same time
+
+    Returns:
+        (number of documents saved, number of documents that couldn't be retrieved)
+    """
+    store = doc_store(create=True)
+    if store is None:
+        raise ClefException("The document store is in the cache directory, set CLEF_CACHE to use it")
+    sims = [tuple(x) for x in sims]
+    prefixes = sorted(set('.'.join(['CMIP6'] + list(x)) for x in sims))
+    # (kind, key, function retrieving the document, its argument)
+    tasks = [('citation', p, citation_page, p) for p in prefixes]
+    tasks += [('wdcc', u, lambda url: requests.get(url, timeout=60).json(), u)
+              for u in sorted(set(get_wdcc_url(p) for p in prefixes))]
+    for dtype, col in [('model', 2), ('experiment', 3), ('mip', 0)]:
+        tasks += [('doc', u, doc_tables, u)
+                  for u in sorted(set(doc_service(dtype, x[col]) for x in sims))]
+    if not refresh:
+        stored = {kind: store.keys(kind) for kind in set(t[0] for t in tasks)}
+        tasks = [t for t in tasks if t[1] not in stored[t[0]]]
+
+    def retrieve(task):
+        try:
+            return task[2](task[3])
+        except Exception as e:
+            log.warning(f'Failed to retrieve {task[0]} {task[1]}: {e}')
+            return None
+
+    docs = {}
+    saved = 0
+    failed = 0
+
+    def save():
+        for kind, found in docs.items():
+            store.put_many(kind, found)
+        docs.clear()
+
+    if tasks:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+            futures = {pool.submit(retrieve, task): task for task in tasks}
+            for future in as_completed(futures):
+                task = futures.pop(future)
+                doc = future.result()
+                if doc is None:
+                    failed += 1
+                    continue
+                docs.setdefault(task[0], {})[task[1]] = doc
+                saved += 1
+                if saved % sync_batch == 0:
+                    save()
+    save()
+    return saved, failed
+
+
 def write_cite(citations):
     """Write citations to file
     """
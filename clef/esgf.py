@@ -33,7 +33,7 @@ import sqlalchemy as sa
 import pandas as pd
 
 from sqlalchemy.sql import column
-from sqlalchemy import String, Float, Integer, or_, func
+from sqlalchemy import String, Float, Integer, or_, and_, func
 
 from .pgvalues import values
 from .model import Path, Checksum
@@ -222,17 +222,26 @@ def match_query(session, query, latest=None, **kwargs):
     """
     values = find_checksum_id(query, latest=latest, **kwargs)
 
+    # only look at the files of the project's CMIP era, so the search can
+    # skip the other era's partition of esgf_paths
+    era = {'CMIP5': 5, 'CMIP6': 6}.get(str(kwargs.get('project', '')).upper())
+
     if latest is True:
         # Exact match on checksum
+        on_path = Path.id == Checksum.id
+        if era is not None:
+            on_path = and_(on_path, Path.cmip_era == era)
         return (values
                 .outerjoin(Checksum,
                     or_(Checksum.md5 == values.c.checksum,
                         Checksum.sha256 == values.c.checksum))
-                .outerjoin(Path))
+                .outerjoin(Path, on_path))
     else:
-        # Match on file name
-        #return values.outerjoin(Path, Path.path.like('%/'+values.c.title))
-        return values.outerjoin(Path, func.regexp_replace(Path.path, '^.*/', '') == values.c.title)
+        # Match on file name, using the indexed basename column
+        on_path = Path.basename == values.c.title
+        if era is not None:
+            on_path = and_(on_path, Path.cmip_era == era)
+        return values.outerjoin(Path, on_path)
 
 def find_local_path(session, subq):
     """Find the filesystem paths of ESGF matches
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Facet counts over the local datasets
+
+:class:`FacetIndex` holds the facets of every dataset of a project as
+dictionary encoded columns, one small integer code per dataset and facet.
+Constraints select the matching datasets and counting the codes of the
+selected datasets gives the number of datasets for every value of every
+facet, like the ``facet_counts`` returned by an ESGF search, without another
+query to the database.
+
+The index of a project is built from the dataset views the first time it is
+needed and saved in the cache directory (see :mod:`clef.cache`), keyed on
+the catalogue generation, so it is only built again after the catalogue has
+been refreshed.
+
+Example::
+
+    >>> from clef.facets import facet_counts
+    >>> counts = facet_counts(session, 'CMIP6', experiment_id='historical') # doctest: +SKIP
+    >>> counts['source_id']['ACCESS-CM2'] # doctest: +SKIP
+    42
+"""
+
+import os
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import inspect
+
+from .model import C5Dataset, C6Dataset, CordexDataset, C5File, C6File, CordexFile
+from .cache import cache_dir, catalogue_generation
+from .exception import ClefException
+
+
+# Dataset views the facets are read from
+dataset_models = {
+    'CMIP5': C5Dataset,
+    'CMIP6': C6Dataset,
+    'CORDEX': CordexDataset,
+    }
+
+# Per-file search views, used for the constraints the index can't count
+file_models = {
+    'CMIP5': C5File,
+    'CMIP6': C6File,
+    'CORDEX': CordexFile,
+    }
+
+# Constraints the local search doesn't match exactly, e.g. activity_id with LIKE
+inexact = {
+    'CMIP6': ['activity_id'],
+    }
+
+# Dataset columns that are not facets
+not_facets = ['dataset_id', 'r', 'i', 'p', 'f']
+
+# Indexes already loaded, by catalogue generation and project
+_indexes = {}
+
+
+class FacetIndex(object):
+    """Facet values of the datasets of a project
+
+    Args:
+        codes (dict): {facet: numpy array with the value code of each dataset, -1 if not set}
+        values (dict): {facet: list of values, in code order}
+
+    >>> index = FacetIndex.from_frame(pd.DataFrame({
+    ...     'source_id': ['ACCESS-CM2', 'ACCESS-CM2', 'MIROC6'],
+    ...     'member_id': ['r1i1p1f1', 'r2i1p1f1', 'r1i1p1f1']}))
+    >>> index.counts(member_id='r1i1p1f1')['source_id']
+    {'ACCESS-CM2': 1, 'MIROC6': 1}
+    >>> index.count(source_id=['ACCESS-CM2', 'MIROC6'], member_id='r2i1p1f1')
+    1
+    """
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+        self._lookup = {f: {v: i for i, v in enumerate(vals)} for f, vals in values.items()}
+
+    @property
+    def size(self):
+        """Number of datasets"""
+        return len(next(iter(self.codes.values()))) if self.codes else 0
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the index from a table with one column per facet and one row per dataset"""
+        codes = {}
+        values = {}
+        for facet in df.columns:
+            c, v = pd.factorize(df[facet], sort=True)
+            # the codes fit in two bytes for every facet but the dataset names
+            codes[facet] = c.astype(np.int16 if len(v) < 2**15 else np.int32)
+            values[facet] = list(v)
+        return cls(codes, values)
+
+    def _check(self, constraints):
+        unknown = [k for k in constraints if k not in self.codes]
+        if unknown:
+            raise ClefException(f"Can't count facets for constraints on {', '.join(unknown)}, "
+                                f"available facets are: {', '.join(self.codes)}")
+
+    def match(self, **constraints):
+        """Select the datasets matching the constraints
+
+        Values of the same facet are combined with OR, different facets with
+        AND, as in a local search.
+
+        Args:
+            constraints: {facet: value or list of values}
+
+        Returns:
+            boolean numpy array, True for the matching datasets
+        """
+        self._check(constraints)
+        selected = np.ones(self.size, dtype=bool)
+        for facet, value in constraints.items():
+            if isinstance(value, str) or not hasattr(value, '__iter__'):
+                value = [value]
+            lookup = self._lookup[facet]
+            wanted = [lookup[v] for v in value if v in lookup]
+            selected &= np.isin(self.codes[facet], wanted)
+        return selected
+
+    def count(self, **constraints):
+        """Number of datasets matching the constraints"""
+        return int(np.count_nonzero(self.match(**constraints)))
+
+    def counts(self, **constraints):
+        """Count the datasets matching the constraints for every facet value
+
+        Args:
+            constraints: {facet: value or list of values}
+
+        Returns:
+            dict {facet: {value: number of datasets}}, values without
+            datasets are left out
+        """
+        rows = np.flatnonzero(self.match(**constraints))
+        result = {}
+        for facet, codes in self.codes.items():
+            selected = codes[rows]
+            n = np.bincount(selected[selected >= 0], minlength=len(self.values[facet]))
+            result[facet] = {self.values[facet][i]: int(n[i]) for i in np.flatnonzero(n)}
+        return result
+
+    def save(self, path):
+        """Save the index to a compressed numpy file"""
+        arrays = {}
+        for facet in self.codes:
+            arrays[f'codes:{facet}'] = self.codes[facet]
+            arrays[f'values:{facet}'] = np.array(self.values[facet], dtype=str)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with :meth:`save`"""
+        codes = {}
+        values = {}
+        with np.load(path) as data:
+            for name in data.files:
+                kind, facet = name.split(':', 1)
+                if kind == 'codes':
+                    codes[facet] = data[name]
+                else:
+                    values[facet] = data[name].tolist()
+        return cls(codes, values)
+
+
+def build_index(session, project):
+    """Read the facets of every dataset of a project from the database
+
+    Args:
+        session: database or snapshot session
+        project (str): CMIP5, CMIP6 or CORDEX
+
+    Returns:
+        :class:`FacetIndex`
+    """
+    model = dataset_models[project]
+    facets = [a.key for a in inspect(model).column_attrs if a.key not in not_facets]
+    q = session.query(*[getattr(model, f).label(f) for f in facets])
+    df = pd.read_sql(q.statement, con=session.connection())
+    return FacetIndex.from_frame(df)
+
+
+def _index_file(generation, project):
+    """Cache file for the index of a catalogue generation, None if the cache is disabled"""
+    path = cache_dir()
+    if path is None or generation is None:
+        return None
+    key = hashlib.sha256(generation.encode()).hexdigest()[:16]
+    return os.path.join(path, 'facets', f'{project}-{key}.npz')
+
+
+def facet_index(session, project):
+    """Return the facet index of a project, building it if needed
+
+    Args:
+        session: database or snapshot session
+        project (str): CMIP5, CMIP6 or CORDEX
+
+    Returns:
+        :class:`FacetIndex`
+    """
+    project = project.upper()
+    if project not in dataset_models:
+        raise ClefException(f"Facet counts not available for project: {project}")
+    generation = catalogue_generation(session)
+    index = _indexes.get((generation, project))
+    if index is not None:
+        return index
+
+    fname = _index_file(generation, project)
+    if fname is not None and os.path.exists(fname):
+        try:
+            index = FacetIndex.load(fname)
+        except Exception:
+            index = None
+    if index is None:
+        index = build_index(session, project)
+        if fname is not None:
+            try:
+                os.makedirs(os.path.dirname(fname), exist_ok=True)
+                index.save(fname)
+            except OSError:
+                # caching is best effort
+                pass
+    # without a generation there's no way to tell if the index is current
+    if generation is not None:
+        _indexes[(generation, project)] = index
+    return index
+
+
+def search_datasets(session, project, **constraints):
+    """Facets of the datasets returned by a local search
+
+    The constraints are applied with the filters of the local search, see
+    :func:`clef.code.build_query`, one query for each combination of values.
+
+    Args:
+        session: database or snapshot session
+        project (str): CMIP5, CMIP6 or CORDEX
+        constraints: {search option: value or list of values}
+
+    Returns:
+        :class:`pandas.DataFrame` with one row per dataset and one column per facet
+    """
+    from .code import build_query
+
+    project = project.upper()
+    files = file_models[project]
+    facets = [a.key for a in inspect(dataset_models[project]).column_attrs if a.key not in not_facets]
+    values = [[v] if isinstance(v, str) or not hasattr(v, '__iter__') else list(v)
+              for v in constraints.values()]
+    frames = []
+    for c in itertools.product(*values):
+        q = (build_query(session, project, **dict(zip(constraints, c)))
+             .with_entities(*[getattr(files, f).label(f) for f in ['dataset_id'] + facets])
+             .distinct())
+        frames.append(pd.read_sql(q.statement, con=session.connection()))
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(subset='dataset_id')
+    return df.drop(columns='dataset_id')
+
+
+def facet_counts(session, project, **constraints):
+    """Count the datasets matching the constraints for every facet value
+
+    Constraints on dataset facets are counted with the project's
+    :class:`FacetIndex`. Any other search option, e.g. the CMIP5 variable or
+    experiment_family, or a constraint the search doesn't match exactly, is
+    applied with the local search filters (see :func:`search_datasets`), so
+    the counts agree with the search results.
+
+    Args:
+        session: database or snapshot session
+        project (str): CMIP5, CMIP6 or CORDEX
+        constraints: {search option: value or list of values}
+
+    Returns:
+        dict {facet: {value: number of datasets}}
+    """
+    project = project.upper()
+    index = facet_index(session, project)
+    if all(k in index.codes and k not in inexact.get(project, []) for k in constraints):
+        return index.counts(**constraints)
+    return FacetIndex.from_frame(search_datasets(session, project, **constraints)).counts()
@@ -18,11 +18,14 @@
 import json
 import re
 import pkg_resources
+from functools import lru_cache
 
 from calendar import monthrange
 from datetime import datetime, timedelta
+from psycopg2.extras import NumericRange
 
 from .exception import ClefException
+from .model import ModelAlias
 from .cordex import get_esgf_facets
 
 
@@ -84,6 +87,28 @@ def convert_periods(nranges):
     return periods
 
 
+def parse_range(value):
+    """Convert a range stored as text, i.e. in a catalogue snapshot, to a NumericRange
+
+    >>> parse_range('[185001,185101)')
+    NumericRange(185001, 185101, '[)')
+
+    Args:
+        value (str): range in the postgres text format, other types are returned unchanged
+
+    Returns:
+        NumericRange or the original value
+
+    """
+    if not isinstance(value, str):
+        return value
+    if value == 'empty':
+        return NumericRange(empty=True)
+    lower, upper = value[1:-1].split(',')
+    return NumericRange(int(lower) if lower else None, int(upper) if upper else None,
+                        value[0] + value[-1])
+
+
 def get_range(periods):
     """Find from-date,to-date for simulation from list of file periods
 
@@ -269,7 +294,45 @@ def load_vocabularies(project):
     return vocab
 
 
-def fix_model(project, models, invert=False):
+@lru_cache()
+def _file_aliases(project):
+    """Model aliases from the package data, see :func:`model_aliases`"""
+    try:
+        mfile = pkg_resources.resource_filename(__name__, 'data/'+project+'_model_fix.json')
+        with open(mfile, 'r') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return {}
+
+
+# Model aliases read from a database, by database url and project
+_db_aliases = {}
+
+
+def model_aliases(project, session=None):
+    """Return the model names that differ between file attributes and ESGF facets
+
+    The aliases are read once from the ``model_alias`` table if a database
+    session is passed, otherwise from the copy in the package data
+
+    Args:
+        project (str): data project
+        session (SQLAlchemy obj): optional database session
+
+    Returns:
+        dict {file attribute value: facet value}
+    """
+    project = project.upper().split('-')[0]
+    if session is not None and session.get_bind().dialect.name == 'postgresql':
+        key = (str(session.get_bind().url), project)
+        if key not in _db_aliases:
+            _db_aliases[key] = {a.model: a.alias for a in
+                                session.query(ModelAlias).filter(ModelAlias.project == project)}
+        return _db_aliases[key]
+    return _file_aliases(project)
+
+
+def fix_model(project, models, invert=False, session=None):
     """Fix model name where file attribute is different from values accepted by facets
 
     >>> fix_model('CMIP5', ['CESM1(BGC)', 'CESM1-BGC'])
@@ -278,23 +341,21 @@ def fix_model(project, models, invert=False):
     >>> fix_model('CMIP5', ['CESM1(BGC)', 'CESM1-BGC'], invert=True)
     ['CESM1-BGC', 'CESM1-BGC']
 
+    >>> fix_model('CMIP6', ['ACCESS-CM2'])
+    ['ACCESS-CM2']
+
     Args:
 
         project (str): data project
         models (list) models to convert
         invert (bool): Invert the conversion (so go from ``CESM1(BGC)`` to ``CESM1-BGC``)
+        session (SQLAlchemy obj): optional database session, see :func:`model_aliases`
 
     """
-    project = project.upper().split('-')[0]
-    if project  in ['CMIP5', 'CORDEX']:
-        mfile = pkg_resources.resource_filename(__name__, 'data/'+project+'_model_fix.json')
-        with open(mfile, 'r') as f:
-            mdict = json.loads(f.read())
-        if invert:
-            mfix = {v: k for k, v in mdict.items()}
-        else:
-            mfix = mdict
-    return  [mfix[m] if m in mfix.keys() else m for m in models]
+    mfix = model_aliases(project, session)
+    if invert:
+        mfix = {v: k for k, v in mfix.items()}
+    return  [mfix.get(m, m) for m in models]
 
 
 def fix_path(path, latest):
@@ -35,9 +35,9 @@ group paths on the filesystem into datasets.
 """
 
 
-from sqlalchemy import Column, ForeignKey, Text, Integer, String, Table
-from sqlalchemy.dialects.postgresql import UUID, JSONB, INT4RANGE
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, ForeignKey, Text, Integer, BigInteger, Boolean, String, Table
+from sqlalchemy.dialects.postgresql import UUID, JSONB, INT4RANGE, TSVECTOR
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.ext.indexable import index_property
 from sqlalchemy.orm import relationship, column_property
 from sqlalchemy import func as f
@@ -91,6 +91,12 @@ class Path(Base):
     #: File path at NCI
     path = Column('path', Text)
 
+    #: File name, indexed for matching against ESGF results
+    basename = Column('basename', Text)
+
+    #: CMIP era of the file, 5 or 6
+    cmip_era = Column('cmip_era', Integer)
+
     #: :class:`C5Dataset`:
     c5dataset = relationship('C5Dataset', secondary=c5_metadata_dataset_link, viewonly=True)
 
@@ -194,18 +200,11 @@ class ExtendedMetadata(Base):
     period = Column(INT4RANGE)
 
 
-class C5Dataset(Base):
-    """A CMIP5-era ESGF dataset
-
-    This class only has access to attributes from the file itself, so version
-    information is not present.
+class C5Facets(object):
+    """CMIP5 dataset attributes, shared by :class:`C5Dataset` and :class:`C5File`
 
     See the CMIP documentation for descriptions of the attributes
     """
-    __tablename__ = 'cmip5_dataset'
-
-    dataset_id = Column(Text, primary_key=True)
-
     #:
     project = Column(Text)
 
@@ -235,18 +234,24 @@ class C5Dataset(Base):
     cmor_table = Column(Text)
 
 
-class C6Dataset(Base):
-    """A CMIP6-era ESGF dataset
+class C5Dataset(C5Facets, Base):
+    """A CMIP5-era ESGF dataset
 
     This class only has access to attributes from the file itself, so version
     information is not present.
 
     See the CMIP documentation for descriptions of the attributes
     """
-    __tablename__ = 'cmip6_dataset'
+    __tablename__ = 'cmip5_dataset'
 
     dataset_id = Column(Text, primary_key=True)
 
+
+class C6Facets(object):
+    """CMIP6 dataset attributes, shared by :class:`C6Dataset` and :class:`C6File`
+
+    See the CMIP documentation for descriptions of the attributes
+    """
     #:
     project = Column(Text)
 
@@ -298,10 +303,22 @@ class C6Dataset(Base):
     table_id = Column('table_id', Text)
 
 
-class CordexDataset(Base):
-    __tablename__ = 'cordex_dataset'
+class C6Dataset(C6Facets, Base):
+    """A CMIP6-era ESGF dataset
 
-    dataset_id = Column(UUID, primary_key=True)
+    This class only has access to attributes from the file itself, so version
+    information is not present.
+
+    See the CMIP documentation for descriptions of the attributes
+    """
+    __tablename__ = 'cmip6_dataset'
+
+    dataset_id = Column(Text, primary_key=True)
+
+
+class CordexFacets(object):
+    """CORDEX dataset attributes, shared by :class:`CordexDataset` and :class:`CordexFile`
+    """
     model_id = Column('model_id', Text)
     time_frequency = Column('frequency', Text)
     #institute = Column('institute_id', Text)
@@ -318,7 +335,141 @@ class CordexDataset(Base):
     #ensemble = Column('driving_model_ensemble_member', Text)
     ensemble = Column('ensemble', Text)
 
-    rcm_name = column_property(f.substr(model_id, f.char_length(institute) + 2))
+    @declared_attr
+    def rcm_name(cls):
+        return column_property(f.substr(cls.model_id, f.char_length(cls.institute) + 2))
+
+
+class CordexDataset(CordexFacets, Base):
+    __tablename__ = 'cordex_dataset'
+
+    dataset_id = Column(UUID, primary_key=True)
+
+
+class FileColumns(object):
+    """Path and :class:`ExtendedMetadata` columns of the denormalised file views
+    """
+    file_id = Column(UUID, primary_key=True)
+
+    #: File path at NCI
+    path = Column(Text)
+
+    version = Column(Text)
+    variable = Column(Text)
+    period = Column(INT4RANGE)
+
+
+class C5File(FileColumns, C5Facets, Base):
+    """A CMIP5 file with its dataset attributes
+
+    One row per file of ``esgf_paths``, joined with ``extended_metadata`` and
+    ``cmip5_dataset`` so searches don't need to join the tables
+    """
+    __tablename__ = 'cmip5_files'
+
+    dataset_id = Column(Text)
+
+
+class C6File(FileColumns, C6Facets, Base):
+    """A CMIP6 file with its dataset attributes
+
+    One row per file of ``esgf_paths``, joined with ``extended_metadata`` and
+    ``cmip6_dataset`` so searches don't need to join the tables
+    """
+    __tablename__ = 'cmip6_files'
+
+    dataset_id = Column(Text)
+
+
+class CordexFile(FileColumns, CordexFacets, Base):
+    """A CORDEX file with its dataset attributes
+
+    One row per file of ``esgf_paths``, joined with ``extended_metadata`` and
+    ``cordex_dataset`` so searches don't need to join the tables
+    """
+    __tablename__ = 'cordex_files'
+
+    dataset_id = Column(UUID)
+
+
+class SummaryColumns(object):
+    """Columns of the dataset summary views, one row per dataset version directory
+    """
+    #: Directory holding the files
+    path = Column(Text, primary_key=True)
+
+    version = Column(Text)
+    variable = Column(Text)
+
+    #: Number of files
+    file_count = Column(Integer)
+
+    #: Total size of the files in bytes
+    total_size = Column(BigInteger)
+
+    #: Period covered by the files
+    period = Column(INT4RANGE)
+
+    #: True if the file periods are contiguous
+    time_complete = Column(Boolean)
+
+    #: True for the most recent version of the dataset
+    latest = Column(Boolean)
+
+
+class C5Summary(SummaryColumns, C5Facets, Base):
+    """Summary of a CMIP5 dataset version, see :func:`clef.code.summary_query`
+    """
+    __tablename__ = 'cmip5_summary'
+
+    dataset_id = Column(Text, primary_key=True)
+
+
+class C6Summary(SummaryColumns, C6Facets, Base):
+    """Summary of a CMIP6 dataset version, see :func:`clef.code.summary_query`
+    """
+    __tablename__ = 'cmip6_summary'
+
+    dataset_id = Column(Text, primary_key=True)
+
+
+class CordexSummary(SummaryColumns, CordexFacets, Base):
+    """Summary of a CORDEX dataset version, see :func:`clef.code.summary_query`
+    """
+    __tablename__ = 'cordex_summary'
+
+    dataset_id = Column(UUID, primary_key=True)
+
+
+class FileSearch(Base):
+    """Full text search document of a file
+
+    Built from the path and the title, source and description attributes, see
+    :func:`clef.code.build_query`
+    """
+    __tablename__ = 'file_search'
+
+    file_id = Column(UUID,
+                     ForeignKey('esgf_paths.file_id'),
+                     primary_key=True)
+
+    document = Column(TSVECTOR)
+
+
+class ModelAlias(Base):
+    """Model names in the file attributes that differ from the ESGF facet values
+
+    Used by the dataset views and :func:`clef.helpers.fix_model`
+    """
+    __tablename__ = 'model_alias'
+
+    project = Column('ma_project', Text, primary_key=True)
+
+    #: Name in the file attributes
+    model = Column('ma_model', Text, primary_key=True)
+
+    #: ESGF facet value
+    alias = Column('ma_alias', Text)
 
 
 class Info(Base):
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Refresh of the catalogue views and tables
+
+While the catalogue uses the materialized views from ``db/tables.sql``,
+:func:`refresh_views` refreshes them following the dependency graph read from
+``pg_depend``, views that don't depend on each other are refreshed at the
+same time on separate connections.
+
+Once ``db/incremental.sql`` has turned the materialized views into tables,
+:func:`refresh` keeps them up to date instead. Each run finds the files
+ingested since the last one from the ``md_ingested`` and ``pa_ingested``
+timestamps, plus files no longer on disk, and recomputes only their rows from
+the ``<table>_v`` views, table by table in dependency order. Everything is
+done in a single transaction so searches see the new files all at once.
+
+Either way the time taken by each view or table is saved in ``refresh_log``,
+and a new ``catalogue_generation`` is published so clients can invalidate
+their cached results (see :mod:`clef.cache`).
+
+Run it from cron with::
+
+    python -m clef.refresh --user <admin user>
+"""
+
+import logging
+import time
+
+import click
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import text
+
+from .db import connect, default_url
+
+
+log = logging.getLogger(__name__)
+
+# Files ingested this long before the last run are processed again, in case
+# their ingestion was committed after the last run started
+overlap = '1 hour'
+
+# Keys of the rows to update in each table, selected from the temporary
+# tables filled by :func:`find_changes`
+_changed_files = 'SELECT file_id FROM refresh_files'
+_changed_datasets = ('SELECT dataset_id FROM refresh_datasets '
+                     'UNION SELECT dataset_id FROM {link} '
+                     'WHERE file_id IN (SELECT file_id FROM refresh_files)')
+_changed_dataset_files = ('SELECT file_id FROM refresh_files '
+                          'UNION SELECT file_id FROM {link} '
+                          'WHERE dataset_id IN (SELECT dataset_id FROM refresh_keys_{dataset})')
+# summaries are recomputed for the whole dataset, so a new version also
+# updates the latest flag of the older ones
+_changed_summaries = 'SELECT dataset_id FROM refresh_keys_{dataset}'
+
+# Catalogue tables in dependency order: (table, key column, keys to update)
+refresh_order = [
+    ('esgf_paths', 'file_id', _changed_files),
+    ('checksums', 'ch_hash', _changed_files),
+    ('c5_metadata_dataset_link', 'file_id', _changed_files),
+    ('c6_metadata_dataset_link', 'file_id', _changed_files),
+    ('cordex_metadata_dataset_link', 'file_id', _changed_files),
+    ('cmip5_dataset', 'dataset_id', _changed_datasets.format(link='c5_metadata_dataset_link')),
+    ('cmip6_dataset', 'dataset_id', _changed_datasets.format(link='c6_metadata_dataset_link')),
+    ('cordex_dataset', 'dataset_id', _changed_datasets.format(link='cordex_metadata_dataset_link')),
+    ('extended_metadata', 'file_id', _changed_files),
+    ('file_search', 'file_id', _changed_files),
+    ('cmip5_files', 'file_id', _changed_dataset_files.format(link='c5_metadata_dataset_link',
+                                                             dataset='cmip5_dataset')),
+    ('cmip6_files', 'file_id', _changed_dataset_files.format(link='c6_metadata_dataset_link',
+                                                             dataset='cmip6_dataset')),
+    ('cordex_files', 'file_id', _changed_dataset_files.format(link='cordex_metadata_dataset_link',
+                                                              dataset='cordex_dataset')),
+    ('cmip5_summary', 'dataset_id', _changed_summaries.format(dataset='cmip5_dataset')),
+    ('cmip6_summary', 'dataset_id', _changed_summaries.format(dataset='cmip6_dataset')),
+    ('cordex_summary', 'dataset_id', _changed_summaries.format(dataset='cordex_dataset')),
+    ]
+
+_link_tables = ['c5_metadata_dataset_link', 'c6_metadata_dataset_link', 'cordex_metadata_dataset_link']
+
+
+# Number of views refreshed at the same time
+workers = 4
+
+
+def publish_generation(conn, durations):
+    """Add a new catalogue generation and record how long the refresh took
+
+    Args:
+        conn: database connection
+        durations (dict): {name: (started, duration)}
+
+    Returns:
+        the new generation number
+    """
+    generation = conn.execute(text("INSERT INTO catalogue_generation DEFAULT VALUES "
+                                   "RETURNING generation")).scalar()
+    if durations:
+        conn.execute(text("INSERT INTO refresh_log (generation, name, started, duration) "
+                          "VALUES (:generation, :name, :started, :duration)"),
+                     [{'generation': generation, 'name': name, 'started': started,
+                       'duration': duration} for name, (started, duration) in durations.items()])
+    return generation
+
+
+def view_dependencies(conn):
+    """Read the view dependencies from the database catalogue
+
+    Returns:
+        (edges, materialized): edges is a list of (view, dependency) for
+        every view and materialized view in the current schema, materialized
+        the set of materialized view names
+    """
+    q = text("""
+        SELECT DISTINCT v.relname, d.relname
+        FROM pg_depend AS dep
+        JOIN pg_rewrite AS r ON dep.objid = r.oid
+        JOIN pg_class AS v ON r.ev_class = v.oid
+        JOIN pg_class AS d ON dep.refobjid = d.oid
+        WHERE dep.classid = 'pg_rewrite'::regclass
+        AND dep.refclassid = 'pg_class'::regclass
+        AND v.oid <> d.oid
+        AND v.relkind IN ('v', 'm')
+        AND v.relnamespace = current_schema()::regnamespace
+        """)
+    edges = [tuple(x) for x in conn.execute(q)]
+    q = text("SELECT relname FROM pg_class WHERE relkind = 'm' "
+             "AND relnamespace = current_schema()::regnamespace")
+    materialized = set(x[0] for x in conn.execute(q))
+    return edges, materialized
+
+
+def refresh_graph(edges, materialized):
+    """Dependencies between materialized views
+
+    Plain views are followed through, so a materialized view built on a view
+    that reads another materialized view depends on the latter.
+
+    Args:
+        edges: list of (view, dependency)
+        materialized: set of materialized view names
+
+    Returns:
+        dict {materialized view: set of materialized views it depends on}
+    """
+    direct = {}
+    for view, dep in edges:
+        direct.setdefault(view, set()).add(dep)
+
+    def find(name, seen):
+        found = set()
+        for dep in direct.get(name, ()):
+            if dep in seen:
+                continue
+            seen.add(dep)
+            if dep in materialized:
+                found.add(dep)
+            else:
+                found |= find(dep, seen)
+        return found
+
+    return {m: find(m, set()) for m in materialized}
+
+
+def schedule(graph, run, workers=workers):
+    """Run a task for every node of a dependency graph
+
+    A node is started once all its dependencies have finished, up to
+    ``workers`` nodes run at the same time.
+
+    Args:
+        graph (dict): {node: set of nodes it depends on}
+        run: function called with a node name
+        workers (int): maximum number of nodes running at once
+
+    Returns:
+        dict {node: (started, duration)}
+    """
+    durations = {}
+    done = set()
+    pending = dict(graph)
+
+    def timed(node):
+        started = datetime.now(timezone.utc)
+        t0 = time.monotonic()
+        run(node)
+        return started, timedelta(seconds=time.monotonic() - t0)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            for node in sorted(n for n, deps in pending.items() if deps <= done):
+                del pending[node]
+                running[pool.submit(timed, node)] = node
+            if not running:
+                raise ValueError(f'Dependency cycle between {sorted(pending)}')
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                # re-raises the error if the refresh failed
+                durations[node] = future.result()
+                done.add(node)
+                log.info(f'{node}: {durations[node][1].total_seconds():.1f}s')
+    return durations
+
+
+def refresh_views(engine, workers=workers):
+    """Refresh the catalogue materialized views
+
+    Views are refreshed concurrently with ``REFRESH MATERIALIZED VIEW
+    CONCURRENTLY``, so searches can continue while they are updated.
+
+    Every worker holds a connection for as long as its view takes to
+    refresh, so the engine's pool needs at least ``workers`` connections
+    (see the ``pool_size`` argument of :func:`clef.db.connect`).
+
+    Args:
+        engine: :class:`sqlalchemy.engine.Engine` connected as the owner of the views
+        workers (int): number of views refreshed at the same time
+
+    Returns:
+        (generation, durations)
+    """
+    with engine.connect() as conn:
+        graph = refresh_graph(*view_dependencies(conn))
+
+    def run(view):
+        with engine.begin() as conn:
+            conn.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {view}'))
+
+    durations = schedule(graph, run, workers)
+    with engine.begin() as conn:
+        generation = publish_generation(conn, durations)
+    return generation, durations
+
+
+def table_columns(conn, table):
+    """Column names of a table, in order"""
+    q = text("SELECT column_name FROM information_schema.columns "
+             "WHERE table_name = :table ORDER BY ordinal_position")
+    return [x[0] for x in conn.execute(q, {'table': table})]
+
+
+def unique_key(conn, table, key):
+    """Columns of the unique index used to upsert rows of a table
+
+    This is normally just ``key``, partitioned tables need the partition
+    columns in their unique indexes as well (see ``db/partitions.sql``)
+
+    Returns:
+        list of column names
+    """
+    q = text("""
+        SELECT array_agg(a.attname::text ORDER BY k.ord)
+        FROM pg_index AS i
+        CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute AS a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indrelid = CAST(:table AS regclass)
+        AND i.indisunique
+        AND i.indpred IS NULL
+        AND 0 <> ALL (i.indkey::int2[])
+        GROUP BY i.indexrelid
+        """)
+    candidates = [x[0] for x in conn.execute(q, {'table': table}) if key in x[0]]
+    if not candidates:
+        return [key]
+    return min(candidates, key=len)
+
+
+def upsert_sql(table, key, columns, unique=None):
+    """SQL statements bringing the rows listed in ``refresh_keys_<table>`` up to date
+
+    Rows no longer returned by the ``<table>_v`` view are deleted, the others
+    are inserted or updated. Rows that haven't changed are left alone.
+
+    Args:
+        table (str): catalogue table
+        key (str): column listed in ``refresh_keys_<table>``
+        columns (list): table columns
+        unique (list): columns of the unique index, by default just key
+
+    Returns:
+        (delete, upsert) SQL strings
+    """
+    if unique is None:
+        unique = [key]
+    keys = f'SELECT {key} FROM refresh_keys_{table}'
+    ucols = ', '.join(unique)
+    row = ucols if len(unique) == 1 else f'({ucols})'
+    delete = (f'DELETE FROM {table} WHERE {key} IN ({keys}) '
+              f'AND {row} NOT IN (SELECT {ucols} FROM {table}_v WHERE {key} IN ({keys}))')
+
+    cols = ', '.join(columns)
+    upsert = f'INSERT INTO {table} ({cols}) SELECT {cols} FROM {table}_v WHERE {key} IN ({keys}) '
+    values = [c for c in columns if c not in unique]
+    if values:
+        new = ', '.join(f'EXCLUDED.{c}' for c in values)
+        old = ', '.join(f'{table}.{c}' for c in values)
+        upsert += (f'ON CONFLICT ({ucols}) DO UPDATE SET ({", ".join(values)}) = ROW({new}) '
+                   f'WHERE ROW({old}) IS DISTINCT FROM ROW({new})')
+    else:
+        upsert += f'ON CONFLICT ({ucols}) DO NOTHING'
+    return delete, upsert
+
+
+def find_changes(conn, since):
+    """Fill the temporary tables listing the files and datasets to update
+
+    ``refresh_files`` gets the files ingested after ``since`` and the files
+    removed from the filesystem, ``refresh_datasets`` the datasets these files
+    currently belong to.
+
+    New and changed files are found from the ``md_ingested`` and
+    ``pa_ingested`` watermarks, but a file removed by the ingest just loses
+    its ``paths`` row and leaves no timestamp behind. Finding them needs the
+    anti-join of all of ``esgf_paths`` against ``paths``. It only reads the
+    file_id and pa_hash columns, which the planner can take from their
+    unique indexes in a single pass. That is small next to the full refresh
+    of the views it replaces, so it is done on every run rather than missing
+    deleted files.
+
+    Returns:
+        number of files to update
+    """
+    conn.execute(text(
+        "CREATE TEMPORARY TABLE refresh_files ON COMMIT DROP AS "
+        "SELECT md_hash AS file_id FROM metadata WHERE md_ingested > :since "
+        "UNION SELECT pa_hash FROM paths WHERE pa_ingested > :since "
+        "UNION SELECT file_id FROM esgf_paths AS e "
+        "WHERE NOT EXISTS (SELECT 1 FROM paths WHERE pa_hash = e.file_id)"),
+        {'since': since})
+    conn.execute(text(
+        "CREATE TEMPORARY TABLE refresh_datasets ON COMMIT DROP AS " +
+        " UNION ".join(f"SELECT dataset_id FROM {link} "
+                       "WHERE file_id IN (SELECT file_id FROM refresh_files)"
+                       for link in _link_tables)))
+    conn.execute(text("ANALYZE refresh_files"))
+    conn.execute(text("ANALYZE refresh_datasets"))
+    return conn.execute(text("SELECT count(*) FROM refresh_files")).scalar()
+
+
+def refresh_table(conn, table, key, keys, full=False):
+    """Update one catalogue table from its ``<table>_v`` view
+
+    Args:
+        conn: database connection, in a transaction
+        table (str): catalogue table
+        key (str): key column, unique except in partitioned tables
+        keys (str): SQL query returning the keys to update
+        full (bool): recompute the whole table
+
+    Returns:
+        number of rows changed
+
+    Raises:
+        ValueError: if a key of a partitioned table is no longer unique, the
+            refresh transaction is then rolled back
+    """
+    columns = table_columns(conn, table)
+    if full:
+        # Every key in the view or the table goes through the upsert, rather
+        # than a TRUNCATE whose ACCESS EXCLUSIVE lock would block searches
+        # until the whole table has been rebuilt
+        keys = f'SELECT {key} FROM {table}_v UNION SELECT {key} FROM {table}'
+
+    conn.execute(text(f'CREATE TEMPORARY TABLE refresh_keys_{table} ON COMMIT DROP AS {keys}'))
+    conn.execute(text(f'ANALYZE refresh_keys_{table}'))
+    unique = unique_key(conn, table, key)
+    delete, upsert = upsert_sql(table, key, columns, unique)
+    changed = conn.execute(text(delete)).rowcount + conn.execute(text(upsert)).rowcount
+    if unique != [key]:
+        # the unique index of a partitioned table includes the partition
+        # columns, so the database no longer stops a key being repeated
+        duplicate = conn.execute(text(
+            f'SELECT {key} FROM {table} WHERE {key} IN (SELECT {key} FROM refresh_keys_{table}) '
+            f'GROUP BY {key} HAVING count(*) > 1 LIMIT 1')).scalar()
+        if duplicate is not None:
+            raise ValueError(f'{key} {duplicate} is in more than one row of {table}')
+    return changed
+
+
+def refresh(engine, full=False):
+    """Bring the catalogue tables up to date
+
+    Args:
+        engine: :class:`sqlalchemy.engine.Engine` connected as a user that
+            can write to the catalogue tables
+        full (bool): recompute all the tables, e.g. after changes to
+            ``extended_metadata_manual``
+
+    Returns:
+        (generation, changes): the new catalogue generation, or None if
+        nothing changed, and a dict {table: rows changed}
+    """
+    changes = {}
+    durations = {}
+    generation = None
+    with engine.begin() as conn:
+        # locking the state row stops two refreshes running at the same time
+        since = conn.execute(text("SELECT value - CAST(:overlap AS interval) FROM refresh_state "
+                                  "WHERE key = 'ingested' FOR UPDATE"),
+                             {'overlap': overlap}).scalar()
+        started = conn.execute(text("SELECT now()")).scalar()
+
+        if not full:
+            n = find_changes(conn, since)
+            log.info(f'{n} files changed since {since}')
+
+        for table, key, keys in refresh_order:
+            t0 = time.monotonic()
+            table_started = datetime.now(timezone.utc)
+            changes[table] = refresh_table(conn, table, key, keys, full)
+            durations[table] = (table_started, timedelta(seconds=time.monotonic() - t0))
+            log.info(f'{table}: {changes[table]} rows in {durations[table][1].total_seconds():.1f}s')
+
+        conn.execute(text("UPDATE refresh_state SET value = :started WHERE key = 'ingested'"),
+                     {'started': started})
+        if any(changes.values()):
+            generation = publish_generation(conn, durations)
+    return generation, changes
+
+
+def incremental(engine):
+    """Check if the catalogue has been switched to incremental maintenance"""
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass('refresh_state')")).scalar() is not None
+
+
+@click.command()
+@click.option('--url', default=default_url, help='Database url')
+@click.option('--user', default=None, help='Database user, needs write access to the catalogue')
+@click.option('--full', is_flag=True, default=False, help='Recompute the tables from scratch')
+@click.option('--workers', default=workers, show_default=True,
+              help='Number of views refreshed at the same time')
+@click.option('--debug', is_flag=True, default=False, help='Show the SQL statements')
+def main(url, user, full, workers, debug):
+    """Refresh the catalogue views, or update the catalogue tables with the
+    files ingested since the last run"""
+    logging.basicConfig(level=logging.INFO)
+    # one connection per worker, a worker waiting on the pool would time out
+    # before a long refresh frees a connection
+    engine = connect(url=url, user=user, debug=debug, application_name='clef-refresh',
+                     pool_size=workers)
+    if incremental(engine):
+        generation, changes = refresh(engine, full=full)
+        click.echo(f'{sum(changes.values())} rows updated')
+    else:
+        generation, durations = refresh_views(engine, workers=workers)
+        click.echo(f'{len(durations)} views refreshed')
+    if generation is not None:
+        click.echo(f'Catalogue generation {generation}')
+
+
+if __name__ == '__main__':
+    main()
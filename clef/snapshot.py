@@ -0,0 +1,559 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local SQLite snapshot of the clef catalogue
+
+:func:`create_snapshot` copies the materialized views used by
+:func:`clef.code.local_query` from the clef.nci.org.au database into a SQLite
+file, with an index on every facet column. The per-file search views are
+created as SQLite views over the copied tables. :func:`connect` opens the snapshot
+as a session that can be passed to :func:`clef.code.local_query` and
+:func:`clef.code.search` in place of a database session, so local searches
+work without a connection to the database server.
+
+:func:`sync` brings an existing snapshot up to date, copying only the files
+ingested since the last update and removing deleted files.
+"""
+
+import os
+import uuid
+import hashlib
+
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, event, select, text, MetaData, Table, Column, Index, Text, Integer
+from sqlalchemy.orm import sessionmaker
+
+from .model import Path, ExtendedMetadata, C5Dataset, C6Dataset, CordexDataset, \
+                   C5File, C6File, CordexFile, \
+                   c5_metadata_dataset_link, c6_metadata_dataset_link, cordex_metadata_dataset_link
+from .exception import ClefException
+
+
+# Default snapshot location, can be changed with the CLEF_SNAPSHOT environment variable
+default_snapshot = os.path.join(os.path.expanduser('~'), '.clef', 'catalogue.db')
+
+# Tables copied to the snapshot, in the order they are exported
+snapshot_tables = [
+    Path.__table__,
+    ExtendedMetadata.__table__,
+    c5_metadata_dataset_link,
+    c6_metadata_dataset_link,
+    cordex_metadata_dataset_link,
+    C5Dataset.__table__,
+    C6Dataset.__table__,
+    CordexDataset.__table__,
+    ]
+
+# Dataset tables and the link tables joining them to the files
+dataset_links = {
+    C5Dataset.__table__: c5_metadata_dataset_link,
+    C6Dataset.__table__: c6_metadata_dataset_link,
+    CordexDataset.__table__: cordex_metadata_dataset_link,
+    }
+
+# Per-file search views and the dataset tables they are built from. The
+# snapshot has plain views in their place, they use the snapshot indexes
+file_views = {
+    C5File.__table__: C5Dataset.__table__,
+    C6File.__table__: C6Dataset.__table__,
+    CordexFile.__table__: CordexDataset.__table__,
+    }
+
+# Tables with one row per file
+file_tables = [t for t in snapshot_tables if t not in dataset_links]
+
+# Rows fetched from the server and inserted in the snapshot at a time
+chunk_size = 50000
+
+# Number of ids in each IN (...) list when updating a snapshot
+id_chunk_size = 1000
+
+# Age in days after which searches warn that the snapshot should be updated
+stale_days = 7
+
+# Number of leading file_id hex digits used to partition the files when
+# looking for deleted files
+partition_digits = 2
+
+_engines = {}
+
+
+def snapshot_path(path=None):
+    """Return the snapshot file path
+
+    Args:
+        path (str): snapshot path, if None use $CLEF_SNAPSHOT or the default
+
+    Returns:
+        path (str): snapshot file path
+    """
+    if path is None:
+        path = os.environ.get('CLEF_SNAPSHOT', default_snapshot)
+    return path
+
+
+def available(path=None):
+    """Check if a snapshot has been created
+
+    Args:
+        path (str): snapshot path, if None use $CLEF_SNAPSHOT or the default
+
+    Returns:
+        True if the snapshot file exists
+    """
+    return os.path.exists(snapshot_path(path))
+
+
+def last_updated(path=None):
+    """Return when a snapshot was created or last updated
+
+    This is the time on the clef database when its files were copied, see
+    :func:`sync`.
+
+    Args:
+        path (str): snapshot path, if None use $CLEF_SNAPSHOT or the default
+
+    Returns:
+        :class:`datetime.datetime`, None if the snapshot doesn't record it
+    """
+    session = connect(path)
+    try:
+        value = session.execute(text("SELECT max(value) FROM snapshot_info "
+                                     "WHERE key IN ('created', 'synced')")).scalar()
+    finally:
+        session.close()
+    if value is None:
+        return None
+    updated = datetime.fromisoformat(value)
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=timezone.utc)
+    return updated
+
+
+def _sqlite_setup(dbapi_connection, connection_record):
+    """Make SQLite behave like postgres for the functions used by the model"""
+    dbapi_connection.create_function('char_length', 1,
+            lambda x: None if x is None else len(x), deterministic=True)
+    dbapi_connection.execute('PRAGMA case_sensitive_like = ON')
+
+
+def _engine(path):
+    """Return a cached engine for the snapshot at path"""
+    engine = _engines.get(path)
+    if engine is None:
+        engine = create_engine('sqlite:///' + path)
+        event.listen(engine, 'connect', _sqlite_setup)
+        _engines[path] = engine
+    return engine
+
+
+def connect(path=None):
+    """Open a snapshot
+
+    Example::
+    >>> from clef import snapshot
+    >>> session = snapshot.connect() # doctest: +SKIP
+    >>> results = local_query(session, 'CMIP6', variable_id='tas') # doctest: +SKIP
+
+    Args:
+        path (str): snapshot path, if None use $CLEF_SNAPSHOT or the default
+
+    Returns:
+        :class:`sqlalchemy.orm.session.Session` bound to the snapshot
+    """
+    path = snapshot_path(path)
+    if not os.path.exists(path):
+        raise ClefException(f'No catalogue snapshot found at {path}, create one with "clef snapshot"')
+    return sessionmaker(bind=_engine(path))()
+
+
+def snapshot_metadata():
+    """Return the snapshot schema
+
+    Tables and columns have the same names as on the server, so the
+    :mod:`clef.model` classes can be used to query them. Postgres-only column
+    types are stored as text.
+
+    Returns:
+        :class:`sqlalchemy.MetaData`
+    """
+    meta = MetaData()
+    Table('snapshot_info', meta,
+          Column('key', Text, primary_key=True),
+          Column('value', Text))
+    for table in snapshot_tables:
+        columns = [Column(c.name, Integer if isinstance(c.type, Integer) else Text,
+                          primary_key=c.primary_key)
+                   for c in table.columns]
+        t = Table(table.name, meta, *columns)
+        for c in t.columns:
+            if c.primary_key:
+                continue
+            # index every facet column, the link tables get a unique file_id
+            # index as the server does
+            unique = (c.name == 'file_id')
+            Index(f'{t.name}_{c.name}_idx', c, unique=unique)
+    return meta
+
+
+def create_views(conn, meta):
+    """Create the per-file search views in a snapshot if they don't exist
+
+    Args:
+        conn: snapshot connection
+        meta: snapshot schema
+    """
+    paths = meta.tables[Path.__table__.name]
+    extended = meta.tables[ExtendedMetadata.__table__.name]
+    for view, dataset in file_views.items():
+        d = meta.tables[dataset.name]
+        link = meta.tables[dataset_links[dataset].name]
+        columns = {c.name: c for c in [*d.columns, *extended.columns, *paths.columns]}
+        q = (select([columns[c.name].label(c.name) for c in view.columns])
+             .select_from(paths
+                          .join(extended, extended.c.file_id == paths.c.file_id)
+                          .join(link, link.c.file_id == paths.c.file_id)
+                          .join(d, d.c.dataset_id == link.c.dataset_id)))
+        sql = q.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True})
+        conn.execute(f'CREATE VIEW IF NOT EXISTS {view.name} AS {sql}')
+
+
+def upgrade_schema(conn, meta):
+    """Add the columns missing from a snapshot made by an older version
+
+    The search views are dropped when a table changes, so that
+    :func:`create_views` makes them again with the new columns.
+
+    Args:
+        conn: snapshot connection
+        meta: snapshot schema
+
+    Returns:
+        names of the tables that gained columns, their rows need to be copied
+        again to fill them
+    """
+    upgraded = []
+    for table in meta.sorted_tables:
+        existing = set(x[1] for x in conn.execute(f'PRAGMA table_info({table.name})'))
+        missing = [c for c in table.columns if c.name not in existing]
+        if not existing or not missing:
+            continue
+        for c in missing:
+            conn.execute(f'ALTER TABLE {table.name} ADD COLUMN {c.name} '
+                         f'{c.type.compile(dialect=conn.dialect)}')
+        for index in table.indexes:
+            if any(c in missing for c in index.columns):
+                index.create(conn)
+        upgraded.append(table.name)
+    if upgraded:
+        for view in file_views:
+            conn.execute(f'DROP VIEW IF EXISTS {view.name}')
+    return upgraded
+
+
+def format_value(value):
+    """Convert a database value to something that can be stored in SQLite
+
+    Ranges are stored using the postgres text format
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if hasattr(value, 'lower') and hasattr(value, 'upper'):
+        if value.isempty:
+            return 'empty'
+        return (('[' if value.lower_inc else '(') + f'{value.lower},{value.upper}' +
+                (']' if value.upper_inc else ')'))
+    return str(value)
+
+
+def copy_table(session, table, target, conn):
+    """Copy all rows of a server table to the snapshot
+
+    Args:
+        session: database session
+        table: :class:`sqlalchemy.Table` to copy
+        target: matching snapshot table
+        conn: snapshot connection
+    """
+    result = (session.connection()
+              .execution_options(stream_results=True)
+              .execute(table.select()))
+    names = [c.name for c in table.columns]
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        conn.execute(target.insert(),
+                     [{k: format_value(v) for k, v in zip(names, row)} for row in rows])
+
+
+def create_snapshot(session, path=None):
+    """Export the catalogue to a local SQLite snapshot
+
+    The snapshot is written to a temporary file which then replaces any
+    existing snapshot, so sessions reading the old snapshot are not affected.
+
+    Args:
+        session: database session connected to the clef database
+        path (str): snapshot path, if None use $CLEF_SNAPSHOT or the default
+
+    Returns:
+        path (str): the snapshot path
+    """
+    path = snapshot_path(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    engine = create_engine('sqlite:///' + tmp)
+    meta = snapshot_metadata()
+    started = datetime.now(timezone.utc).isoformat()
+    watermark = refresh_time(session)
+    try:
+        # create the indexes after loading the data, it's quicker than
+        # updating them on every insert
+        indexes = [i for t in meta.tables.values() for i in t.indexes]
+        for t in meta.tables.values():
+            t.indexes = set()
+        meta.create_all(engine)
+        with engine.begin() as conn:
+            for table in snapshot_tables:
+                copy_table(session, table, meta.tables[table.name], conn)
+            info = [{'key': 'created', 'value': started},
+                    {'key': 'synced', 'value': started}]
+            if watermark is not None:
+                info.append({'key': 'watermark', 'value': watermark})
+            conn.execute(meta.tables['snapshot_info'].insert(), info)
+        for i in indexes:
+            i.create(engine)
+        with engine.connect() as conn:
+            create_views(conn, meta)
+            conn.execute('ANALYZE')
+    except Exception:
+        engine.dispose()
+        os.remove(tmp)
+        raise
+    engine.dispose()
+
+    os.replace(tmp, path)
+    _engines.pop(path, None)
+    return path
+
+
+def _dialect(connectable):
+    """Name of the database backend of a session, engine or connection"""
+    if hasattr(connectable, 'get_bind'):
+        return connectable.get_bind().dialect.name
+    return connectable.dialect.name
+
+
+def _chunks(items, size=id_chunk_size):
+    items = sorted(items)
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+def refresh_time(session):
+    """Time the catalogue views were last refreshed from
+
+    Every file ingested before this time is in the views. It is when the
+    refresh of the latest catalogue generation started, from
+    ``refresh_log``, or if that wasn't recorded when the previous generation
+    was published, as the refresh can only have started after that.
+
+    Args:
+        session: database session
+
+    Returns:
+        ISO formatted time, None if the catalogue doesn't record its refreshes
+    """
+    if _dialect(session) != 'postgresql':
+        return None
+    if session.execute(text("SELECT to_regclass('catalogue_generation')")).scalar() is None:
+        return None
+    started = session.execute(text(
+        "SELECT min(started) FROM refresh_log WHERE generation = "
+        "(SELECT max(generation) FROM catalogue_generation)")).scalar()
+    if started is None:
+        started = session.execute(text(
+            "SELECT refreshed_on FROM catalogue_generation "
+            "ORDER BY generation DESC OFFSET 1 LIMIT 1")).scalar()
+    return None if started is None else started.isoformat()
+
+
+def changed_files(session, since):
+    """Find the files ingested since a given time
+
+    Uses the ``md_ingested`` and ``pa_ingested`` timestamps of the base
+    ``metadata`` and ``paths`` tables
+
+    Args:
+        session: database session
+        since (str): ISO formatted time
+
+    Returns:
+        set of file_ids
+    """
+    q = text("SELECT md_hash FROM metadata WHERE md_ingested > :since "
+             "UNION SELECT pa_hash FROM paths WHERE pa_ingested > :since")
+    return set(str(x[0]) for x in session.execute(q, {'since': since}))
+
+
+def partition_hashes(connectable):
+    """Count and checksum the file_ids of ``esgf_paths`` in partitions
+
+    Files are partitioned on the first :data:`partition_digits` digits of
+    their id, two catalogues list the same files in a partition if both count
+    and checksum match.
+
+    Returns:
+        dict {partition: (count, md5 of the sorted file_ids)}
+    """
+    if _dialect(connectable) == 'postgresql':
+        q = text("SELECT left(file_id::text, :n), count(*), "
+                 "md5(string_agg(file_id::text, '' ORDER BY file_id)) "
+                 "FROM esgf_paths GROUP BY 1")
+        return {p: (n, h) for p, n, h in connectable.execute(q, {'n': partition_digits})}
+    parts = {}
+    file_id = Path.__table__.c.file_id
+    for (fid,) in connectable.execute(select([file_id]).order_by(file_id)):
+        part = parts.setdefault(str(fid)[:partition_digits], [0, hashlib.md5()])
+        part[0] += 1
+        part[1].update(str(fid).encode())
+    return {p: (n, h.hexdigest()) for p, (n, h) in parts.items()}
+
+
+def partition_ids(connectable, part):
+    """Return all the file_ids of ``esgf_paths`` in a partition
+
+    The partition is selected as a range of ids, so the server can use the
+    file_id index
+    """
+    file_id = Path.__table__.c.file_id
+    lower = str(uuid.UUID(part.ljust(32, '0')))
+    upper = str(uuid.UUID(part.ljust(32, 'f')))
+    q = select([file_id]).where(file_id >= lower).where(file_id <= upper)
+    return set(str(x[0]) for x in connectable.execute(q))
+
+
+def apply_files(session, conn, meta, file_ids):
+    """Copy the current server rows for a set of files to the snapshot
+
+    Rows for the files and the datasets they belong to are replaced
+
+    Args:
+        session: database session
+        conn: snapshot connection
+        meta: snapshot schema
+        file_ids: files to update
+    """
+    datasets = {t: set() for t in dataset_links}
+    for chunk in _chunks(file_ids):
+        for table in file_tables:
+            target = meta.tables[table.name]
+            conn.execute(target.delete().where(target.c.file_id.in_(chunk)))
+            rows = session.execute(table.select().where(table.c.file_id.in_(chunk))).fetchall()
+            if rows:
+                conn.execute(target.insert(), [{k: format_value(v) for k, v in row.items()}
+                                               for row in rows])
+        for table, link in dataset_links.items():
+            datasets[table].update(str(x[0]) for x in session.execute(
+                select([link.c.dataset_id]).where(link.c.file_id.in_(chunk))))
+    for table, dataset_ids in datasets.items():
+        target = meta.tables[table.name]
+        for chunk in _chunks(dataset_ids):
+            conn.execute(target.delete().where(target.c.dataset_id.in_(chunk)))
+            rows = session.execute(table.select().where(table.c.dataset_id.in_(chunk))).fetchall()
+            if rows:
+                conn.execute(target.insert(), [{k: format_value(v) for k, v in row.items()}
+                                               for row in rows])
+
+
+def remove_files(conn, meta, file_ids):
+    """Remove files from the snapshot, along with datasets left without files"""
+    for chunk in _chunks(file_ids):
+        for table in file_tables:
+            target = meta.tables[table.name]
+            conn.execute(target.delete().where(target.c.file_id.in_(chunk)))
+    for table, link in dataset_links.items():
+        target = meta.tables[table.name]
+        linked = select([meta.tables[link.name].c.dataset_id])
+        conn.execute(target.delete().where(target.c.dataset_id.notin_(linked)))
+
+
+def sync(session, path=None):
+    """Update a snapshot with the changes made since it was last updated
+
+    Files ingested since the views the snapshot was copied from were
+    refreshed (see :func:`refresh_time`) are copied from the server. Then the
+    file lists are compared partition by partition with
+    :func:`partition_hashes`, only the ids of partitions that differ are
+    fetched to find files that were deleted, or that were added to the views
+    after the last update.
+
+    A snapshot made before some columns were added to the catalogue gets
+    them with :func:`upgrade_schema`, and all its files are copied again.
+
+    Args:
+        session: database session connected to the clef database
+        path (str): snapshot path, if None use $CLEF_SNAPSHOT or the default
+
+    Returns:
+        (added, removed): number of files updated and removed
+    """
+    snapshot = connect(path)
+    engine = snapshot.get_bind()
+    snapshot.close()
+    meta = snapshot_metadata()
+    info = meta.tables['snapshot_info']
+
+    with engine.begin() as conn:
+        upgraded = upgrade_schema(conn, meta)
+
+    saved = dict(engine.execute(select([info.c.key, info.c.value])).fetchall())
+    # snapshots made by older versions only recorded the time of the last sync
+    since = saved.get('watermark', saved.get('synced'))
+    started = datetime.now(timezone.utc).isoformat()
+    # without a refresh time keep the old watermark, so no file is missed
+    watermark = refresh_time(session) or since
+    changed = changed_files(session, since) if since is not None else set()
+    if upgraded:
+        # fill the new columns of the files already in the snapshot
+        paths = meta.tables[Path.__table__.name]
+        changed |= set(str(x[0]) for x in engine.execute(select([paths.c.file_id])))
+
+    local = partition_hashes(engine)
+    remote = partition_hashes(session)
+    removed = set()
+    for part in set(local) | set(remote):
+        if local.get(part) != remote.get(part):
+            remote_ids = partition_ids(session, part)
+            local_ids = partition_ids(engine, part)
+            changed |= remote_ids - local_ids
+            removed |= local_ids - remote_ids
+
+    with engine.begin() as conn:
+        # snapshots made by older versions don't have the search views, or
+        # had them dropped by upgrade_schema
+        create_views(conn, meta)
+        apply_files(session, conn, meta, changed)
+        remove_files(conn, meta, removed)
+        conn.execute(info.delete().where(info.c.key.in_(['synced', 'watermark'])))
+        conn.execute(info.insert(), [{'key': 'synced', 'value': started}] +
+                     ([{'key': 'watermark', 'value': watermark}] if watermark is not None else []))
+    return len(changed), len(removed)
@@ -44,7 +44,9 @@ def insert_unique(db, klass, **kwargs):
         item = klass(**kwargs)
         db.add(item)
         new=True
-        db.commit()
+        # get the id without committing, the caller commits once for all the items
+        db.flush()
+    return item.id, new
 
 def add_bulk_items(db, klass, rows):
     """Batched INSERT statements via the ORM "bulk", using dictionaries.
@@ -53,6 +55,13 @@ def add_bulk_items(db, klass, rows):
     db.commit()
     return
 
+def update_bulk_items(db, klass, rows):
+    """Batched UPDATE statements via the ORM "bulk", using dictionaries.
+       input: rows is a list of dictionaries, each including the primary key "id" """
+    db.bulk_update_mappings(klass,rows)
+    db.commit()
+    return
+
 def update_item(db, klass, item_id, newvalues):
     '''Update database item
        :argument: db database SQLalchemy connection session
@@ -93,6 +102,7 @@ def add_dataset(name, version, fformat, **kwargs):
             kwargs['fileformat'] = fformat 
             kwargs['version'] = version
             insert_unique(clefdb, Dataset, **kwargs)
+            clefdb.commit()
             print(f'Dataset $name v$version ($fformat) added to collection.')
             return 
 
@@ -114,6 +124,22 @@ def add_ecmwf_table(table):
     return
 
 
+def ecmwf_lookup(db, codes):
+    '''
+    Return the ECMWF table rows for a set of parameter codes
+    :input: db database SQLalchemy connection session
+    :input: codes the parameter codes
+    :return: dictionary {code: ECMWF row}
+    '''
+    codes = list(codes)
+    lookup = {}
+    # stay under the SQLite limit on the number of parameters
+    for start in range(0, len(codes), 500):
+        for row in db.query(ECMWF).filter(ECMWF.code.in_(codes[start:start+500])):
+            lookup[row.code] = row
+    return lookup
+
+
 def add_variable_table(rows,dname,fformat,version):
     ''' 
     Add an Variable table as a bulk transaction
@@ -131,9 +157,11 @@ def add_variable_table(rows,dname,fformat,version):
     # find missing information for each parameter code from ECMWF table
     #if dname in ['ERAI', 'MACC', 'ERA5', 'YOTC']:
     if dname in [ 'MACC', 'ERA5', 'YOTC']:
+        # load all the codes used at once instead of querying the table for each row
+        ecmwf = ecmwf_lookup(clefdb, set(row['code'] for row in rows))
         for row in rows:
             code = row.pop('code')
-            vals = clefdb.query(ECMWF).filter(ECMWF.code == code).one_or_none()
+            vals = ecmwf.get(code)
             if vals:
                 row['varname'] = vals.name
                 row['standard_name'] = vals.standard_name
@@ -164,18 +192,23 @@ def update_variable_table(rows,identifiers,dname,fformat,version):
     # find the dataset_id
     dsid = clefdb.query(Dataset.id).filter_by(**{'name': dname, 'fileformat': fformat, 'version': version}).one_or_none()
     assert dsid
-    # add dataset_id to arguments to search
+    # load the ids of all the dataset variables by identifiers, instead of searching each row
+    cols = [getattr(Variable, key) for key in identifiers]
+    vids = {tuple(v[1:]): v[0] for v in
+            clefdb.query(Variable.id, *cols).filter(Variable.dataset_id == dsid[0])}
     # transfer row dict item which are identifiers to kwargs dict
+    updates = []
     for row in rows:
         kwargs={}
-        kwargs['dataset_id'] = dsid[0]
         for key in identifiers:
             kwargs[key] = row.pop(key)
-        # search row in db and update
-        vid = clefdb.query(Variable).filter_by(**kwargs).one_or_none()
+        vid = vids.get(tuple(kwargs.values()))
         if vid:
            row['id'] = vid
-           update_item(clefdb, Variable, row)
+           updates.append(row)
         else:
+           kwargs['dataset_id'] = dsid[0]
            print(f'Warning could not find a variable with constraints:\n   {kwargs}')
+    # update all the rows found in one transaction
+    update_bulk_items(clefdb, Variable, updates)
     return
@@ -0,0 +1,29 @@
+/*
+ * Add the stored basename column to esgf_paths
+ *
+ * match_query joins ESGF results to esgf_paths on the file name, a plain
+ * indexed column replaces the regexp_replace() expression index.
+ *
+ * Tables from incremental.sql get the new column in place. A materialized
+ * esgf_paths has to be created again, along with all the views depending on
+ * it, which is done by including tables.sql
+ */
+
+BEGIN;
+
+DROP INDEX IF EXISTS esgf_paths_basename_idx;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'esgf_paths'::regclass) = 'm' THEN
+        DROP MATERIALIZED VIEW esgf_paths CASCADE;
+    ELSE
+        ALTER TABLE esgf_paths ADD COLUMN IF NOT EXISTS basename TEXT;
+        UPDATE esgf_paths SET basename = regexp_replace(path, '^.*/', '');
+    END IF;
+END $$;
+
+\ir tables.sql
+\ir indexes.sql
+
+COMMIT;
@@ -0,0 +1,89 @@
+/*
+ * Switch the catalogue to incremental maintenance
+ *
+ * Replaces the materialized views from tables.sql with plain tables holding
+ * the same rows. The tables are then kept up to date by `python -m
+ * clef.refresh`, which only recomputes the rows of files ingested since the
+ * last run from the `*_v` views, instead of `refresh.sql` re-reading the
+ * whole metadata table.
+ *
+ * Run refresh.sql just before this script so the views are current, then:
+ *
+ *     psql -f db/incremental.sql
+ *
+ * The dependent views are dropped with the materialized views and created
+ * again by including tables.sql, which skips the materialized views as
+ * tables with the same names now exist.
+ */
+
+BEGIN;
+
+CREATE TABLE esgf_paths_t AS SELECT * FROM esgf_paths;
+CREATE TABLE checksums_t AS SELECT * FROM checksums;
+CREATE TABLE c5_metadata_dataset_link_t AS SELECT * FROM c5_metadata_dataset_link;
+CREATE TABLE c6_metadata_dataset_link_t AS SELECT * FROM c6_metadata_dataset_link;
+CREATE TABLE cordex_metadata_dataset_link_t AS SELECT * FROM cordex_metadata_dataset_link;
+CREATE TABLE cmip5_dataset_t AS SELECT * FROM cmip5_dataset;
+CREATE TABLE cmip6_dataset_t AS SELECT * FROM cmip6_dataset;
+CREATE TABLE cordex_dataset_t AS SELECT * FROM cordex_dataset;
+CREATE TABLE extended_metadata_t AS SELECT * FROM extended_metadata;
+CREATE TABLE cmip5_files_t AS SELECT * FROM cmip5_files;
+CREATE TABLE cmip6_files_t AS SELECT * FROM cmip6_files;
+CREATE TABLE cordex_files_t AS SELECT * FROM cordex_files;
+CREATE TABLE file_search_t AS SELECT * FROM file_search;
+CREATE TABLE cmip5_summary_t AS SELECT * FROM cmip5_summary;
+CREATE TABLE cmip6_summary_t AS SELECT * FROM cmip6_summary;
+CREATE TABLE cordex_summary_t AS SELECT * FROM cordex_summary;
+
+DROP MATERIALIZED VIEW
+    cmip5_summary,
+    cmip6_summary,
+    cordex_summary,
+    file_search,
+    cmip5_files,
+    cmip6_files,
+    cordex_files,
+    extended_metadata,
+    cmip5_dataset,
+    cmip6_dataset,
+    cordex_dataset,
+    c5_metadata_dataset_link,
+    c6_metadata_dataset_link,
+    cordex_metadata_dataset_link,
+    checksums,
+    esgf_paths
+    CASCADE;
+
+ALTER TABLE esgf_paths_t RENAME TO esgf_paths;
+ALTER TABLE checksums_t RENAME TO checksums;
+ALTER TABLE c5_metadata_dataset_link_t RENAME TO c5_metadata_dataset_link;
+ALTER TABLE c6_metadata_dataset_link_t RENAME TO c6_metadata_dataset_link;
+ALTER TABLE cordex_metadata_dataset_link_t RENAME TO cordex_metadata_dataset_link;
+ALTER TABLE cmip5_dataset_t RENAME TO cmip5_dataset;
+ALTER TABLE cmip6_dataset_t RENAME TO cmip6_dataset;
+ALTER TABLE cordex_dataset_t RENAME TO cordex_dataset;
+ALTER TABLE extended_metadata_t RENAME TO extended_metadata;
+ALTER TABLE cmip5_files_t RENAME TO cmip5_files;
+ALTER TABLE cmip6_files_t RENAME TO cmip6_files;
+ALTER TABLE cordex_files_t RENAME TO cordex_files;
+ALTER TABLE file_search_t RENAME TO file_search;
+ALTER TABLE cmip5_summary_t RENAME TO cmip5_summary;
+ALTER TABLE cmip6_summary_t RENAME TO cmip6_summary;
+ALTER TABLE cordex_summary_t RENAME TO cordex_summary;
+
+/* Views, unique keys, grants and search indexes */
+\ir tables.sql
+\ir indexes.sql
+
+/* Last ingestion time processed by clef.refresh. The views were current
+ * when this script started, files ingested in the last day are processed
+ * again to be safe
+ */
+CREATE TABLE IF NOT EXISTS refresh_state (
+    key TEXT PRIMARY KEY,
+    value TIMESTAMP WITH TIME ZONE
+);
+INSERT INTO refresh_state VALUES ('ingested', now() - interval '1 day')
+    ON CONFLICT (key) DO NOTHING;
+
+COMMIT;
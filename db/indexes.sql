@@ -0,0 +1,66 @@
+/*
+ * Search indexes on the per-file search views
+ *
+ * `build_query` filters the cmip5_files, cmip6_files and cordex_files views
+ * on the facets passed on the command line, the column order of the
+ * multi-column indexes follows the facet combinations found most often in the
+ * clef query log (see `query_log_facets.py`), most selective facet first. Partial indexes cover
+ * the tables/frequencies most users ask for, they are smaller and stay in
+ * memory.
+ *
+ * Indexes on materialized views survive a REFRESH, this script only needs
+ * to be run again when a view is re-created. It is safe to run more than
+ * once and it is included at the end of `refresh.sql`.
+ */
+
+/* CMIP5 */
+CREATE INDEX IF NOT EXISTS cmip5_files_model_experiment_idx
+    ON cmip5_files (model, experiment, cmor_table, ensemble);
+CREATE INDEX IF NOT EXISTS cmip5_files_experiment_table_idx
+    ON cmip5_files (experiment, cmor_table, frequency);
+CREATE INDEX IF NOT EXISTS cmip5_files_ensemble_idx
+    ON cmip5_files (ensemble);
+/* experiment families are searched with LIKE 'prefix%' */
+CREATE INDEX IF NOT EXISTS cmip5_files_experiment_pattern_idx
+    ON cmip5_files (experiment text_pattern_ops);
+CREATE INDEX IF NOT EXISTS cmip5_files_monthly_idx
+    ON cmip5_files (experiment, model, ensemble)
+    WHERE cmor_table IN ('Amon', 'Omon', 'Lmon', 'OImon');
+
+/* CMIP6 */
+CREATE INDEX IF NOT EXISTS cmip6_files_variable_table_idx
+    ON cmip6_files (variable_id, table_id, experiment_id, source_id);
+CREATE INDEX IF NOT EXISTS cmip6_files_source_experiment_idx
+    ON cmip6_files (source_id, experiment_id, member_id);
+CREATE INDEX IF NOT EXISTS cmip6_files_experiment_frequency_idx
+    ON cmip6_files (experiment_id, frequency, realm);
+CREATE INDEX IF NOT EXISTS cmip6_files_member_idx
+    ON cmip6_files (member_id);
+CREATE INDEX IF NOT EXISTS cmip6_files_monthly_idx
+    ON cmip6_files (variable_id, experiment_id, source_id, member_id)
+    WHERE table_id IN ('Amon', 'Omon', 'Lmon', 'SImon');
+CREATE INDEX IF NOT EXISTS cmip6_files_daily_idx
+    ON cmip6_files (variable_id, experiment_id, source_id, member_id)
+    WHERE table_id = 'day';
+
+/* CORDEX */
+CREATE INDEX IF NOT EXISTS cordex_files_domain_experiment_idx
+    ON cordex_files (domain, experiment, frequency, driving_model);
+CREATE INDEX IF NOT EXISTS cordex_files_model_idx
+    ON cordex_files (model_id, driving_model, ensemble);
+CREATE INDEX IF NOT EXISTS cordex_files_experiment_pattern_idx
+    ON cordex_files (experiment text_pattern_ops);
+
+/* CMIP5 and CORDEX variables come from the file name */
+CREATE INDEX IF NOT EXISTS cmip5_files_variable_idx
+    ON cmip5_files (variable, cmor_table, experiment);
+CREATE INDEX IF NOT EXISTS cordex_files_variable_idx
+    ON cordex_files (variable, domain, frequency);
+
+/* needed to refresh cordex_dataset concurrently */
+CREATE UNIQUE INDEX IF NOT EXISTS cordex_dataset_dataset_id
+    ON cordex_dataset (dataset_id);
+
+ANALYZE cmip5_files;
+ANALYZE cmip6_files;
+ANALYZE cordex_files;
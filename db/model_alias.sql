@@ -0,0 +1,23 @@
+/*
+ * Model name aliases, file attribute value -> ESGF facet value
+ *
+ * Keep in sync with clef/data/<project>_model_fix.json, used by
+ * clef.helpers.fix_model when there is no database connection
+ */
+INSERT INTO model_alias (ma_project, ma_model, ma_alias) VALUES
+    ('CMIP5', 'ACCESS1-0', 'ACCESS1.0'),
+    ('CMIP5', 'ACCESS1-3', 'ACCESS1.3'),
+    ('CMIP5', 'CESM1-BGC', 'CESM1(BGC)'),
+    ('CMIP5', 'CESM1-CAM5', 'CESM1(CAM5)'),
+    ('CMIP5', 'CESM1-CAM5-1-FV2', 'CESM1(CAM5.1,FV2)'),
+    ('CMIP5', 'CESM1-FASTCHEM', 'CESM1(FASTCHEM)'),
+    ('CMIP5', 'CESM1-WACCM', 'CESM1(WACCM)'),
+    ('CMIP5', 'CSIRO-Mk3-6-0', 'CSIRO-Mk3.6.0'),
+    ('CMIP5', 'GFDL-CM2p1', 'GFDL-CM2.1'),
+    ('CMIP5', 'MRI-AGCM3-2H', 'MRI-AGCM3.2H'),
+    ('CMIP5', 'MRI-AGCM3-2S', 'MRI-AGCM3.2S'),
+    ('CMIP5', 'bcc-csm1-1', 'BCC-CSM1.1'),
+    ('CMIP5', 'bcc-csm1-1-m', 'BCC-CSM1.1(m)'),
+    ('CMIP5', 'inmcm4', 'INM-CM4'),
+    ('CORDEX', 'CCAM-1391M', 'CSIRO-CCAM')
+    ON CONFLICT (ma_project, ma_model) DO UPDATE SET ma_alias = EXCLUDED.ma_alias;
@@ -0,0 +1,92 @@
+/*
+ * Partition esgf_paths by CMIP era and NCI project
+ *
+ * esgf_paths becomes a partitioned table, first by cmip_era, then by the
+ * NCI project directory the files are in (rr3 and al33 for CMIP5, oi10 and
+ * fs38 for CMIP6). Queries on esgf_paths filtering on the era, like the
+ * cN_dataset_metadata views read by the refresh, only read the matching
+ * partitions, and each partition is a separate table for autovacuum and
+ * for the upserts done by `python -m clef.refresh`. The --local searches
+ * read the cmip5/cmip6/cordex_files tables, not esgf_paths, so they don't
+ * gain from the partitions.
+ *
+ * The unique index has to include the partition keys, so file_id is no
+ * longer unique on its own in the database, `python -m clef.refresh` checks
+ * it after updating esgf_paths and rolls back if a file_id is repeated.
+ *
+ * The base metadata and paths tables belong to the NCI ingest and can't be
+ * partitioned here, their views are already split by era (md_cmip_era and
+ * pa_cmip_era) so the same filters skip the other schema.
+ *
+ * Needs PostgreSQL 11 or later, for DEFAULT partitions and unique indexes
+ * on partitioned tables (the docker-compose test database is 9.6, so this
+ * migration is not applied there), and the tables from incremental.sql:
+ *
+ *     psql -f db/partitions.sql
+ */
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF current_setting('server_version_num')::int < 110000 THEN
+        RAISE EXCEPTION 'partitions.sql needs PostgreSQL 11 or later, the server is %',
+            current_setting('server_version');
+    END IF;
+    IF (SELECT relkind FROM pg_class WHERE oid = 'esgf_paths'::regclass) <> 'r' THEN
+        RAISE EXCEPTION 'esgf_paths is not a plain table, run incremental.sql first';
+    END IF;
+END $$;
+
+ALTER TABLE esgf_paths RENAME TO esgf_paths_old;
+ALTER INDEX IF EXISTS esgf_path_file_id_idx RENAME TO esgf_paths_old_file_id_idx;
+ALTER INDEX IF EXISTS esgf_paths_basename_idx RENAME TO esgf_paths_old_basename_idx;
+
+CREATE TABLE esgf_paths (
+    file_id UUID NOT NULL,
+    cmip_era INTEGER NOT NULL,
+    path TEXT,
+    basename TEXT,
+    project_root TEXT NOT NULL
+) PARTITION BY LIST (cmip_era);
+
+CREATE TABLE esgf_paths_cmip5 PARTITION OF esgf_paths
+    FOR VALUES IN (5) PARTITION BY LIST (project_root);
+CREATE TABLE esgf_paths_cmip5_rr3 PARTITION OF esgf_paths_cmip5 FOR VALUES IN ('rr3');
+CREATE TABLE esgf_paths_cmip5_al33 PARTITION OF esgf_paths_cmip5 FOR VALUES IN ('al33');
+CREATE TABLE esgf_paths_cmip5_other PARTITION OF esgf_paths_cmip5 DEFAULT;
+
+CREATE TABLE esgf_paths_cmip6 PARTITION OF esgf_paths
+    FOR VALUES IN (6) PARTITION BY LIST (project_root);
+CREATE TABLE esgf_paths_cmip6_oi10 PARTITION OF esgf_paths_cmip6 FOR VALUES IN ('oi10');
+CREATE TABLE esgf_paths_cmip6_fs38 PARTITION OF esgf_paths_cmip6 FOR VALUES IN ('fs38');
+CREATE TABLE esgf_paths_cmip6_other PARTITION OF esgf_paths_cmip6 DEFAULT;
+
+CREATE TABLE esgf_paths_other PARTITION OF esgf_paths DEFAULT;
+
+/* Unique indexes on a partitioned table must include the partition keys.
+ * Using the name from tables.sql means it won't try to create the file_id
+ * only index when it is run again
+ */
+CREATE UNIQUE INDEX esgf_path_file_id_idx ON esgf_paths (file_id, cmip_era, project_root);
+
+INSERT INTO esgf_paths (file_id, cmip_era, path, basename, project_root)
+    SELECT
+        file_id,
+        cmip_era,
+        path,
+        regexp_replace(path, '^.*/', ''),
+        split_part(path, '/', 4)
+    FROM esgf_paths_old;
+
+/* The views still point to the old table, drop them with it and create
+ * them again on the partitioned table
+ */
+DROP TABLE esgf_paths_old CASCADE;
+\ir tables.sql
+
+GRANT SELECT ON esgf_paths TO PUBLIC;
+
+COMMIT;
+
+ANALYZE esgf_paths;
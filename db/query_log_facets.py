@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Count the facet combinations used in the clef query logs
+
+Used to choose the column order of the search indexes in `indexes.sql`::
+
+    python db/query_log_facets.py /g/data/hh5/tmp/clef/logs/clef_log_*.txt
+"""
+
+import re
+import sys
+import argparse
+from collections import Counter
+
+# log lines look like
+# 2020-03-01 10:00:00; user  ;  CMIP6  ;  local  ;  variable_id=('tas',) table_id=()
+constraint_re = re.compile(r"(\w+)=(\(.*?\)|\S+)")
+
+
+def parse_line(line):
+    """Return (project, flow, facets) for a log line or None"""
+    parts = [p.strip() for p in line.split(';')]
+    if len(parts) < 5:
+        return None
+    project, flow = parts[2], parts[3]
+    facets = []
+    for key, value in constraint_re.findall(';'.join(parts[4:])):
+        if value not in ('()', 'None', "''", ''):
+            facets.append(key)
+    return project, flow, tuple(sorted(facets))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('logs', nargs='+', help='clef log files')
+    parser.add_argument('--flow', default='local', help='only count queries for this flow')
+    parser.add_argument('--top', type=int, default=20, help='number of combinations to show')
+    args = parser.parse_args()
+
+    combinations = Counter()
+    single = Counter()
+    for log in args.logs:
+        with open(log, errors='replace') as f:
+            for line in f:
+                parsed = parse_line(line)
+                if parsed is None or parsed[1] != args.flow:
+                    continue
+                project, _, facets = parsed
+                combinations[(project, facets)] += 1
+                single.update((project, facet) for facet in facets)
+
+    print('Facet combinations')
+    for (project, facets), count in combinations.most_common(args.top):
+        print(f'{count:8d}  {project:12s} {", ".join(facets)}')
+    print('\nSingle facets')
+    for (project, facet), count in single.most_common(args.top):
+        print(f'{count:8d}  {project:12s} {facet}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,23 @@
+/*
+ * Full refresh of the catalogue materialized views
+ *
+ * `python -m clef.refresh` does the same refreshing independent views in
+ * parallel, and also handles databases switched to incremental maintenance
+ * with incremental.sql
+ */
 REFRESH MATERIALIZED VIEW CONCURRENTLY esgf_paths;
+REFRESH MATERIALIZED VIEW CONCURRENTLY checksums;
 REFRESH MATERIALIZED VIEW CONCURRENTLY c5_metadata_dataset_link;
 REFRESH MATERIALIZED VIEW CONCURRENTLY c6_metadata_dataset_link;
 REFRESH MATERIALIZED VIEW CONCURRENTLY cmip5_dataset;
 REFRESH MATERIALIZED VIEW CONCURRENTLY cmip6_dataset;
 REFRESH MATERIALIZED VIEW CONCURRENTLY extended_metadata;
-REFRESH MATERIALIZED VIEW CONCURRENTLY checksums;
+REFRESH MATERIALIZED VIEW CONCURRENTLY cmip5_files;
+REFRESH MATERIALIZED VIEW CONCURRENTLY cmip6_files;
+REFRESH MATERIALIZED VIEW CONCURRENTLY cordex_files;
+REFRESH MATERIALIZED VIEW CONCURRENTLY cmip5_summary;
+REFRESH MATERIALIZED VIEW CONCURRENTLY cmip6_summary;
+REFRESH MATERIALIZED VIEW CONCURRENTLY cordex_summary;
+REFRESH MATERIALIZED VIEW CONCURRENTLY file_search;
+\ir indexes.sql
+INSERT INTO catalogue_generation DEFAULT VALUES;
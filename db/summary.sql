@@ -0,0 +1,34 @@
+/*
+ * Add the dataset summary tables to a catalogue already switched to
+ * incremental maintenance with incremental.sql
+ *
+ * Including tables.sql creates the summaries as materialized views, they are
+ * then replaced by tables with the same rows like in incremental.sql, and
+ * `python -m clef.refresh` keeps them up to date from then on:
+ *
+ *     psql -f db/summary.sql
+ *
+ * Catalogues still using materialized views only need tables.sql.
+ */
+
+BEGIN;
+
+\ir tables.sql
+
+CREATE TABLE cmip5_summary_t AS SELECT * FROM cmip5_summary;
+CREATE TABLE cmip6_summary_t AS SELECT * FROM cmip6_summary;
+CREATE TABLE cordex_summary_t AS SELECT * FROM cordex_summary;
+
+DROP MATERIALIZED VIEW
+    cmip5_summary,
+    cmip6_summary,
+    cordex_summary;
+
+ALTER TABLE cmip5_summary_t RENAME TO cmip5_summary;
+ALTER TABLE cmip6_summary_t RENAME TO cmip6_summary;
+ALTER TABLE cordex_summary_t RENAME TO cordex_summary;
+
+/* unique keys and grants */
+\ir tables.sql
+
+COMMIT;
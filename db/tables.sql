@@ -1,16 +1,21 @@
+/* The base tables are split by CMIP era, filtering the views on
+ * md_cmip_era/pa_cmip_era only reads the matching schema
+ */
 CREATE OR REPLACE VIEW metadata AS
     SELECT
         md_hash,
         md_ingested,
         md_type,
-        md_json
+        md_json,
+        5 AS md_cmip_era
     FROM dataset_cmip5.metadata
     UNION ALL
     SELECT
         md_hash,
         md_ingested,
         md_type,
-        md_json
+        md_json,
+        6 AS md_cmip_era
     FROM dataset_cmip6.metadata;
 
 CREATE OR REPLACE VIEW paths AS
@@ -18,14 +23,18 @@ CREATE OR REPLACE VIEW paths AS
         pa_hash,
         pa_type::path_type,
         pa_path,
-        pa_parents
+        pa_parents,
+        pa_ingested,
+        5 AS pa_cmip_era
     FROM dataset_cmip5.paths
     UNION ALL
     SELECT
         pa_hash,
         pa_type::path_type,
         pa_path,
-        pa_parents
+        pa_parents,
+        pa_ingested,
+        6 AS pa_cmip_era
     FROM dataset_cmip6.paths;
 
 /*
@@ -56,7 +65,9 @@ CREATE OR REPLACE VIEW esgf_filter AS
     SELECT
         pa_hash AS file_id,
         5 AS cmip_era,
-        pa_path AS path
+        pa_path AS path,
+        regexp_replace(pa_path, '^.*/', '') AS basename,
+        split_part(pa_path, '/', 4) AS project_root
     FROM dataset_cmip5.paths
     WHERE
         pa_type in ('file', 'link')
@@ -65,7 +76,9 @@ CREATE OR REPLACE VIEW esgf_filter AS
     SELECT
         pa_hash AS file_id,
         6 AS cmip_era,
-        pa_path AS path
+        pa_path AS path,
+        regexp_replace(pa_path, '^.*/', '') AS basename,
+        split_part(pa_path, '/', 4) AS project_root
     FROM dataset_cmip6.paths
     WHERE
         pa_type in ('file', 'link')
@@ -74,16 +87,20 @@ CREATE OR REPLACE VIEW esgf_filter AS
 
 /* Materialize the filter
  */
-CREATE MATERIALIZED VIEW IF NOT EXISTS esgf_paths AS
+CREATE OR REPLACE VIEW esgf_paths_v AS
     SELECT
         file_id,
         cmip_era,
-        path
+        path,
+        basename,
+        project_root
     FROM esgf_filter;
+CREATE MATERIALIZED VIEW IF NOT EXISTS esgf_paths AS
+    SELECT * FROM esgf_paths_v;
 CREATE UNIQUE INDEX IF NOT EXISTS esgf_path_file_id_idx ON esgf_paths(file_id);
-CREATE INDEX IF NOT EXISTS esgf_paths_basename_idx ON esgf_paths (regexp_replace(path, '^.*/', ''));
+CREATE INDEX IF NOT EXISTS esgf_paths_basename_idx ON esgf_paths(basename);
 
-CREATE MATERIALIZED VIEW IF NOT EXISTS checksums AS
+CREATE OR REPLACE VIEW checksums_v AS
     SELECT
         md_hash as ch_hash,
         md_json->>'md5' as ch_md5,
@@ -91,10 +108,25 @@ CREATE MATERIALIZED VIEW IF NOT EXISTS checksums AS
     FROM metadata
     JOIN esgf_paths ON md_hash = file_id
     WHERE md_type = 'checksum';
+CREATE MATERIALIZED VIEW IF NOT EXISTS checksums AS
+    SELECT * FROM checksums_v;
 CREATE UNIQUE INDEX IF NOT EXISTS checksums_hash_idx ON checksums(ch_hash);
 CREATE INDEX IF NOT EXISTS checksums_md5_idx ON checksums(ch_md5);
 CREATE INDEX IF NOT EXISTS checksums_sha256_idx ON checksums(ch_sha256);
 
+/* Model names used in the file attributes that differ from the ESGF facet
+ * values, the dataset views return the facet value. Rows are added by
+ * model_alias.sql, after changing them refresh the dataset views
+ */
+CREATE TABLE IF NOT EXISTS model_alias (
+    ma_project TEXT,
+    ma_model TEXT,
+    ma_alias TEXT NOT NULL,
+    PRIMARY KEY (ma_project, ma_model)
+    );
+GRANT SELECT ON model_alias TO PUBLIC;
+\ir model_alias.sql
+
 /* modified this so it works with both cmip5 and cmip6 using attributes_map.json */
 CREATE OR REPLACE VIEW c5_dataset_metadata AS
     SELECT
@@ -113,6 +145,7 @@ CREATE OR REPLACE VIEW c5_dataset_metadata AS
     FROM metadata
     JOIN esgf_paths ON md_hash = file_id
     WHERE md_type = 'netcdf'
+    AND md_cmip_era = 5
     AND cmip_era = 5;
 
 /* modified this so it works with both cmip5 and cmip6 using attributes_map.json */
@@ -140,6 +173,7 @@ CREATE OR REPLACE VIEW c6_dataset_metadata AS
     FROM metadata
     JOIN esgf_paths ON md_hash = file_id
     WHERE md_type = 'netcdf'
+    AND md_cmip_era = 6
     AND cmip_era = 6;
 
 CREATE OR REPLACE VIEW cordex_dataset_metadata AS
@@ -174,16 +208,18 @@ CREATE OR REPLACE VIEW cordex_dataset_metadata AS
         )::uuid AS dataset_id
     FROM x;
 
-CREATE MATERIALIZED VIEW IF NOT EXISTS cordex_metadata_dataset_link AS
+CREATE OR REPLACE VIEW cordex_metadata_dataset_link_v AS
     SELECT
         file_id,
         dataset_id
     FROM cordex_dataset_metadata;
+CREATE MATERIALIZED VIEW IF NOT EXISTS cordex_metadata_dataset_link AS
+    SELECT * FROM cordex_metadata_dataset_link_v;
 CREATE UNIQUE INDEX IF NOT EXISTS cordex_metadata_dataset_link_file_id ON cordex_metadata_dataset_link(file_id);
 CREATE INDEX IF NOT EXISTS cordex_metadata_dataset_link_dataset_id ON cordex_metadata_dataset_link(dataset_id);
 GRANT SELECT ON cordex_metadata_dataset_link TO PUBLIC;
 
-CREATE MATERIALIZED VIEW cordex_dataset AS
+CREATE OR REPLACE VIEW cordex_dataset_v AS
     WITH x AS (
         SELECT DISTINCT ON (dataset_id)
             dataset_id,
@@ -193,9 +229,7 @@ CREATE MATERIALIZED VIEW cordex_dataset AS
     )
     SELECT
         x.dataset_id,
-        CASE WHEN model_id = 'CCAM-1391M' THEN 'CSIRO-CCAM' 
-            ELSE model_id END
-            AS model_id,
+        COALESCE(ma_alias, model_id) AS model_id,
         frequency,
         institute,
         domain,
@@ -205,11 +239,14 @@ CREATE MATERIALIZED VIEW cordex_dataset AS
         driving_experiment,
         ensemble
     FROM cordex_dataset_metadata
-    JOIN x USING (file_id);
+    JOIN x USING (file_id)
+    LEFT JOIN model_alias ON ma_project = 'CORDEX' AND ma_model = model_id;
+CREATE MATERIALIZED VIEW IF NOT EXISTS cordex_dataset AS
+    SELECT * FROM cordex_dataset_v;
 GRANT SELECT ON cordex_dataset TO PUBLIC;
 
 
-CREATE MATERIALIZED VIEW IF NOT EXISTS c5_metadata_dataset_link AS
+CREATE OR REPLACE VIEW c5_metadata_dataset_link_v AS
     SELECT
         file_id,
         md5(
@@ -225,12 +262,14 @@ CREATE MATERIALIZED VIEW IF NOT EXISTS c5_metadata_dataset_link AS
         )::uuid as dataset_id
     FROM c5_dataset_metadata
     NATURAL JOIN esgf_paths;
+CREATE MATERIALIZED VIEW IF NOT EXISTS c5_metadata_dataset_link AS
+    SELECT * FROM c5_metadata_dataset_link_v;
 CREATE UNIQUE INDEX IF NOT EXISTS c5_metadata_dataset_link_file_id ON c5_metadata_dataset_link(file_id);
 CREATE INDEX IF NOT EXISTS c5_metadata_dataset_link_dataset_id ON c5_metadata_dataset_link(dataset_id);
 GRANT SELECT ON c5_metadata_dataset_link TO PUBLIC;
 
 /* we probably can eliminate coalesce for institution-id , activity and variant_label since they should always be there */
-CREATE MATERIALIZED VIEW IF NOT EXISTS c6_metadata_dataset_link AS
+CREATE OR REPLACE VIEW c6_metadata_dataset_link_v AS
     SELECT
         file_id,
         md5(
@@ -246,32 +285,20 @@ CREATE MATERIALIZED VIEW IF NOT EXISTS c6_metadata_dataset_link AS
             COALESCE(grid_label,'') ||'.'
         )::uuid as dataset_id
     FROM c6_dataset_metadata;
+CREATE MATERIALIZED VIEW IF NOT EXISTS c6_metadata_dataset_link AS
+    SELECT * FROM c6_metadata_dataset_link_v;
 CREATE UNIQUE INDEX IF NOT EXISTS c6_metadata_dataset_link_file_id ON c6_metadata_dataset_link(file_id);
 CREATE INDEX IF NOT EXISTS c6_metadata_dataset_link_dataset_id ON c6_metadata_dataset_link(dataset_id);
 GRANT SELECT ON c6_metadata_dataset_link TO PUBLIC;
 
 
-CREATE MATERIALIZED VIEW IF NOT EXISTS cmip5_dataset AS
+CREATE OR REPLACE VIEW cmip5_dataset_v AS
     SELECT DISTINCT ON (dataset_id)
         dataset_id,
         project,
         product,
         institute,
-        CASE WHEN model = 'ACCESS1-0' THEN 'ACCESS1.0'
-            WHEN model = 'ACCESS1-3' THEN 'ACCESS1.3'
-            WHEN model = 'CSIRO-Mk3-6-0' THEN 'CSIRO-Mk3.6.0'
-            WHEN model = 'CESM1-WACCM' THEN 'CESM1(WACCM)'
-            WHEN model = 'MRI-AGCM3-2H' THEN 'MRI-AGCM3.2H'
-            WHEN model = 'MRI-AGCM3-2S' THEN 'MRI-AGCM3.2S'
-            WHEN model = 'bcc-csm1-1-m' THEN 'BCC-CSM1.1(m)'
-            WHEN model = 'bcc-csm1-1' THEN 'BCC-CSM1.1'
-            WHEN model = 'inmcm4' THEN 'INM-CM4'
-            WHEN model = 'CESM1-CAM5' THEN 'CESM1(CAM5)'
-            WHEN model = 'CESM1-BGC' THEN 'CESM1(BGC)'
-            WHEN model = 'CESM1-CAM5-1-FV2' THEN 'CESM1(CAM5.1,FV2)'
-            WHEN model = 'CESM1-FASTCHEM' THEN 'CESM1(FASTCHEM)'
-            ELSE model END
-            AS model,
+        COALESCE(ma_alias, model) AS model,
         experiment,
         frequency,
         realm,
@@ -281,11 +308,14 @@ CREATE MATERIALIZED VIEW IF NOT EXISTS cmip5_dataset AS
         p,
         'r'||r||'i'||i||'p'||p AS ensemble
     FROM c5_dataset_metadata
-    NATURAL JOIN c5_metadata_dataset_link;
+    NATURAL JOIN c5_metadata_dataset_link
+    LEFT JOIN model_alias ON ma_project = 'CMIP5' AND ma_model = model;
+CREATE MATERIALIZED VIEW IF NOT EXISTS cmip5_dataset AS
+    SELECT * FROM cmip5_dataset_v;
 CREATE UNIQUE INDEX IF NOT EXISTS cmip5_dataset_dataset_id ON cmip5_dataset(dataset_id);
 GRANT SELECT ON cmip5_dataset TO PUBLIC;
     
-CREATE MATERIALIZED VIEW IF NOT EXISTS cmip6_dataset AS
+CREATE OR REPLACE VIEW cmip6_dataset_v AS
     SELECT DISTINCT ON (dataset_id)
         dataset_id,
         project,
@@ -313,6 +343,8 @@ CREATE MATERIALIZED VIEW IF NOT EXISTS cmip6_dataset AS
         table_id     /** instead of cmor_table **/
     FROM c6_dataset_metadata
     NATURAL JOIN c6_metadata_dataset_link;
+CREATE MATERIALIZED VIEW IF NOT EXISTS cmip6_dataset AS
+    SELECT * FROM cmip6_dataset_v;
 CREATE UNIQUE INDEX IF NOT EXISTS cmip6_dataset_dataset_id ON cmip6_dataset(dataset_id);
 GRANT SELECT ON cmip6_dataset TO PUBLIC;
 /* Extra metadata not stored in the file itself. This table stores manually
@@ -357,38 +389,28 @@ GRANT INSERT (errata_id, file_id) ON file_errata_link TO PUBLIC;
  * a row in `extended_metadata_manual` and refreshing `extended_metadata`
  */
 CREATE OR REPLACE VIEW extended_metadata_path AS
-    WITH x AS (
-        SELECT file_id, string_to_array(path,'/') AS path_parts
-        FROM esgf_paths),
-    y AS (
-        SELECT file_id, path_parts[array_length(path_parts,1)-2] AS version
-        FROM x),
-    versions AS (
-        SELECT file_id, SUBSTRING(version, '^v?(\d+)$') AS version  FROM y WHERE version ~* '^v?\d+$'),
-    variables AS (
-        SELECT file_id, split_part(path_parts[array_length(path_parts,1)],'_',1) AS variable
-        FROM x),
-    b AS (
-        SELECT file_id, substring(path,'\d+-\d+(?=\.nc$)') AS dates
-        FROM esgf_paths),
-    c AS (
-        SELECT file_id, substr(split_part(dates,'-',1),1,6)::int AS l, substr(split_part(dates,'-',2),1,6)::int AS h
-        FROM b),
-    d AS (
-        SELECT file_id, int4range(l,h,'[]') AS period
-        FROM c WHERE l <= h),
-    access_versions AS (
-        SELECT file_id, split_part(path_parts[array_length(path_parts,1)-1],'_',2) as access_version
-        FROM x WHERE path_parts[5] = 'authoritative'
-        )
-
-    SELECT file_id, COALESCE(access_version, version) AS version, variable, period
-    FROM variables
-    NATURAL LEFT JOIN versions
-    NATURAL LEFT JOIN access_versions
-    NATURAL LEFT JOIN d;
+    /* Plain subqueries rather than CTEs, a CTE referenced more than once is
+     * materialized so a filter on file_id, e.g. from an incremental refresh,
+     * couldn't be pushed down to esgf_paths
+     */
+    SELECT file_id,
+        COALESCE(
+            CASE WHEN path_parts[5] = 'authoritative'
+                THEN split_part(path_parts[n-1],'_',2) END,
+            SUBSTRING(path_parts[n-2], '^v?(\d+)$')) AS version,
+        split_part(path_parts[n],'_',1) AS variable,
+        CASE WHEN l <= h THEN int4range(l,h,'[]') END AS period
+    FROM (
+        SELECT file_id, path_parts, array_length(path_parts,1) AS n,
+            substr(split_part(dates,'-',1),1,6)::int AS l,
+            substr(split_part(dates,'-',2),1,6)::int AS h
+        FROM (
+            SELECT file_id, string_to_array(path,'/') AS path_parts,
+                substring(path,'\d+-\d+(?=\.nc$)') AS dates
+            FROM esgf_paths) AS x
+        ) AS y;
 
-CREATE MATERIALIZED VIEW IF NOT EXISTS extended_metadata AS
+CREATE OR REPLACE VIEW extended_metadata_v AS
     SELECT
         file_id, 
         COALESCE(m.version, p.version) AS version,
@@ -396,9 +418,196 @@ CREATE MATERIALIZED VIEW IF NOT EXISTS extended_metadata AS
         COALESCE(m.period, p.period) AS period
     FROM extended_metadata_path AS p
     NATURAL LEFT JOIN extended_metadata_manual AS m;
+CREATE MATERIALIZED VIEW IF NOT EXISTS extended_metadata AS
+    SELECT * FROM extended_metadata_v;
 GRANT SELECT ON extended_metadata TO PUBLIC;
 CREATE UNIQUE INDEX IF NOT EXISTS extended_metadata_file_id ON extended_metadata(file_id);
 
+/* Denormalised search views, one row per file with the path, the dataset
+ * attributes and the extended metadata, so local searches don't need to join
+ * esgf_paths, extended_metadata, the link table and the dataset view.
+ * Search indexes are in indexes.sql
+ */
+CREATE OR REPLACE VIEW cmip5_files_v AS
+    SELECT
+        file_id,
+        path,
+        d.*,
+        e.version,
+        e.variable,
+        e.period
+    FROM esgf_paths
+    JOIN extended_metadata AS e USING (file_id)
+    JOIN c5_metadata_dataset_link USING (file_id)
+    JOIN cmip5_dataset AS d USING (dataset_id);
+CREATE MATERIALIZED VIEW IF NOT EXISTS cmip5_files AS
+    SELECT * FROM cmip5_files_v;
+CREATE UNIQUE INDEX IF NOT EXISTS cmip5_files_file_id ON cmip5_files(file_id);
+CREATE INDEX IF NOT EXISTS cmip5_files_dataset_id ON cmip5_files(dataset_id);
+GRANT SELECT ON cmip5_files TO PUBLIC;
+
+CREATE OR REPLACE VIEW cmip6_files_v AS
+    SELECT
+        file_id,
+        path,
+        d.*,
+        e.version,
+        e.variable,
+        e.period
+    FROM esgf_paths
+    JOIN extended_metadata AS e USING (file_id)
+    JOIN c6_metadata_dataset_link USING (file_id)
+    JOIN cmip6_dataset AS d USING (dataset_id);
+CREATE MATERIALIZED VIEW IF NOT EXISTS cmip6_files AS
+    SELECT * FROM cmip6_files_v;
+CREATE UNIQUE INDEX IF NOT EXISTS cmip6_files_file_id ON cmip6_files(file_id);
+CREATE INDEX IF NOT EXISTS cmip6_files_dataset_id ON cmip6_files(dataset_id);
+GRANT SELECT ON cmip6_files TO PUBLIC;
+
+CREATE OR REPLACE VIEW cordex_files_v AS
+    SELECT
+        file_id,
+        path,
+        d.*,
+        e.version,
+        e.variable,
+        e.period
+    FROM esgf_paths
+    JOIN extended_metadata AS e USING (file_id)
+    JOIN cordex_metadata_dataset_link USING (file_id)
+    JOIN cordex_dataset AS d USING (dataset_id);
+CREATE MATERIALIZED VIEW IF NOT EXISTS cordex_files AS
+    SELECT * FROM cordex_files_v;
+CREATE UNIQUE INDEX IF NOT EXISTS cordex_files_file_id ON cordex_files(file_id);
+CREATE INDEX IF NOT EXISTS cordex_files_dataset_id ON cordex_files(dataset_id);
+GRANT SELECT ON cordex_files TO PUBLIC;
+
+/* File sizes from the posix metadata */
+CREATE OR REPLACE VIEW file_size AS
+    SELECT
+        md_hash AS file_id,
+        (md_json->>'size')::bigint AS size
+    FROM metadata
+    WHERE md_type = 'posix';
+
+/* Dataset summaries, one row per dataset version directory with the number
+ * and total size of its files, the period covered and whether the files
+ * make a contiguous time axis. `latest` marks the most recent version of
+ * each dataset and variable. Used by `summary_query` for --stats, --and and
+ * local searches so they don't need to read every file.
+ *
+ * Periods are month ranges, a file ending in December is followed by one
+ * starting in January of the next year: [198001,198013) then [198101,...)
+ *
+ * The aggregation is done once in dataset_summary_v over the files of every
+ * project, the per-project views pick their rows and add the dataset
+ * attributes. Subqueries rather than CTEs so the project and dataset_id
+ * filters are pushed down to the files views.
+ */
+CREATE OR REPLACE VIEW dataset_summary_v AS
+    SELECT
+        s.*,
+        s.version IS NOT DISTINCT FROM
+            max(s.version) OVER (PARTITION BY s.project, s.dataset_id, s.variable) AS latest
+    FROM (
+        SELECT
+            project,
+            dataset_id,
+            path,
+            max(version) AS version,
+            min(variable) AS variable,
+            count(*) AS file_count,
+            sum(size) AS total_size,
+            int4range(min(lower(period)), max(upper(period))) AS period,
+            CASE WHEN count(period) > 0
+                THEN bool_and(expected IS NULL OR lower(period) = expected) END AS time_complete
+        FROM (
+            SELECT
+                f.*,
+                lag(CASE WHEN upper(period) % 100 = 13 THEN upper(period) + 88 ELSE upper(period) END)
+                    OVER (PARTITION BY project, dataset_id, path ORDER BY lower(period)) AS expected
+            FROM (
+                SELECT
+                    project,
+                    dataset_id,
+                    regexp_replace(path, '/[^/]*$', '') AS path,
+                    version,
+                    variable,
+                    period,
+                    size
+                FROM (
+                    SELECT 'CMIP5'::text AS project, dataset_id, path, version, variable, period, file_id
+                    FROM cmip5_files
+                    UNION ALL
+                    SELECT 'CMIP6', dataset_id, path, version, variable, period, file_id
+                    FROM cmip6_files
+                    UNION ALL
+                    SELECT 'CORDEX', dataset_id, path, version, variable, period, file_id
+                    FROM cordex_files
+                    ) AS u
+                LEFT JOIN file_size USING (file_id)
+                ) AS f
+            ) AS g
+        GROUP BY project, dataset_id, path
+        ) AS s;
+
+CREATE OR REPLACE VIEW cmip5_summary_v AS
+    SELECT
+        s.path,
+        d.*,
+        s.version,
+        s.variable,
+        s.file_count,
+        s.total_size,
+        s.period,
+        s.time_complete,
+        s.latest
+    FROM dataset_summary_v AS s
+    JOIN cmip5_dataset AS d USING (dataset_id)
+    WHERE s.project = 'CMIP5';
+CREATE MATERIALIZED VIEW IF NOT EXISTS cmip5_summary AS
+    SELECT * FROM cmip5_summary_v;
+CREATE UNIQUE INDEX IF NOT EXISTS cmip5_summary_dataset_path ON cmip5_summary(dataset_id, path);
+GRANT SELECT ON cmip5_summary TO PUBLIC;
+
+CREATE OR REPLACE VIEW cmip6_summary_v AS
+    SELECT
+        s.path,
+        d.*,
+        s.version,
+        s.variable,
+        s.file_count,
+        s.total_size,
+        s.period,
+        s.time_complete,
+        s.latest
+    FROM dataset_summary_v AS s
+    JOIN cmip6_dataset AS d USING (dataset_id)
+    WHERE s.project = 'CMIP6';
+CREATE MATERIALIZED VIEW IF NOT EXISTS cmip6_summary AS
+    SELECT * FROM cmip6_summary_v;
+CREATE UNIQUE INDEX IF NOT EXISTS cmip6_summary_dataset_path ON cmip6_summary(dataset_id, path);
+GRANT SELECT ON cmip6_summary TO PUBLIC;
+
+CREATE OR REPLACE VIEW cordex_summary_v AS
+    SELECT
+        s.path,
+        d.*,
+        s.version,
+        s.variable,
+        s.file_count,
+        s.total_size,
+        s.period,
+        s.time_complete,
+        s.latest
+    FROM dataset_summary_v AS s
+    JOIN cordex_dataset AS d USING (dataset_id)
+    WHERE s.project = 'CORDEX';
+CREATE MATERIALIZED VIEW IF NOT EXISTS cordex_summary AS
+    SELECT * FROM cordex_summary_v;
+CREATE UNIQUE INDEX IF NOT EXISTS cordex_summary_dataset_path ON cordex_summary(dataset_id, path);
+GRANT SELECT ON cordex_summary TO PUBLIC;
+
 /*
  * Information-only attributes that are useful to know but won't be searched on
  */
@@ -416,3 +625,40 @@ CREATE OR REPLACE VIEW info_attributes AS
     md_json->'attributes'->>'tracking_id' as tracking_id
     FROM metadata
     WHERE md_type = 'netcdf';
+
+/* Free text search over the file paths and the descriptive netCDF
+ * attributes, used by local searches with a query string. Words are not
+ * stemmed as most are model or experiment names
+ */
+CREATE OR REPLACE VIEW file_search_v AS
+    SELECT
+        file_id,
+        to_tsvector('simple', translate(path, '/_.-', '    ')) ||
+        to_tsvector('simple', concat_ws(' ', i.title, i.source, i.description))
+            AS document
+    FROM esgf_paths
+    LEFT JOIN info_attributes AS i USING (file_id);
+CREATE MATERIALIZED VIEW IF NOT EXISTS file_search AS
+    SELECT * FROM file_search_v;
+CREATE UNIQUE INDEX IF NOT EXISTS file_search_file_id ON file_search(file_id);
+CREATE INDEX IF NOT EXISTS file_search_document_idx ON file_search USING GIN (document);
+GRANT SELECT ON file_search TO PUBLIC;
+
+/* A new generation is added every time the views are refreshed, clients use
+ * it to invalidate cached query results
+ */
+CREATE TABLE IF NOT EXISTS catalogue_generation (
+    generation SERIAL PRIMARY KEY,
+    refreshed_on TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+GRANT SELECT ON catalogue_generation TO PUBLIC;
+
+/* Time taken to refresh each view or table, by catalogue generation */
+CREATE TABLE IF NOT EXISTS refresh_log (
+    generation INTEGER REFERENCES catalogue_generation,
+    name TEXT,
+    started TIMESTAMP WITH TIME ZONE,
+    duration INTERVAL,
+    PRIMARY KEY (generation, name)
+    );
+GRANT SELECT ON refresh_log TO PUBLIC;
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the page parsing in clef.esdoc with BeautifulSoup and pandas.read_html
+on the pages in test/pages:
+
+    python test/bench_esdoc.py [repeat]
+
+The pages are small hand-written copies of the structure of the WDCC and
+ES-DOC pages, made for the tests, not saved copies of the real pages. The
+timings and memory use are only indicative, real pages are larger and the
+difference between the two approaches may not be the same.
+
+BeautifulSoup is only needed to run the comparison.
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+from clef import esdoc
+
+pages = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+def soup_citation(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'lxml')
+    el = soup.find('dt', string="Citation")
+    return el.next_sibling.text.replace(" BibTeX  RIS","")
+
+
+def soup_tables(content):
+    from io import StringIO
+    import pandas as pd
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'lxml')
+    return [pd.read_html(StringIO(str(t)))[0] for t in soup.find_all("table")]
+
+
+def lxml_citation(content):
+    return esdoc.citation_text(esdoc.parse_html(content))
+
+
+def lxml_tables(content):
+    return esdoc.html_tables(esdoc.parse_html(content))
+
+
+def measure(func, content, repeat):
+    """Time per call in ms and peak memory in kB"""
+    seconds = min(timeit.repeat(lambda: func(content), number=repeat, repeat=3)) / repeat
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds * 1000, peak / 1024
+
+
+def main(repeat=200):
+    cases = [('wdcc_citation.html', soup_citation, lxml_citation),
+             ('esdoc_experiment.html', soup_tables, lxml_tables),
+             ('esdoc_model.html', soup_tables, lxml_tables)]
+    print(f'{"page":24} {"parser":8} {"ms/page":>9} {"peak kB":>9}')
+    for fname, old, new in cases:
+        with open(os.path.join(pages, fname), 'rb') as f:
+            content = f.read()
+        for name, func in [('bs4', old), ('lxml', new)]:
+            ms, kb = measure(func, content, repeat)
+            print(f'{fname:24} {name:8} {ms:9.3f} {kb:9.1f}')
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
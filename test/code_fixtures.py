@@ -227,3 +227,21 @@ def results5():
               'model': 'MIROC5', 'experiment': 'historical', 'time_frequency': 'day',
               'realm': 'atmos', 'cmor_table': 'day', 'ensemble': 'r2i1p1',
               'version': 'v20120101'}])
+
+
+@pytest.fixture
+def summary_rows():
+    '''Rows of cmip5_summary, two versions of a CSIRO-BOM simulation share the
+       same 'latest' directory
+    '''
+    root = '/g/data/rr3/publications/CMIP5/output1/CSIRO-BOM/ACCESS1-0/historical/mon/atmos/Amon/r1i1p1'
+    row = {'project': 'CMIP5', 'institute': 'CSIRO-BOM', 'model': 'ACCESS1.0',
+           'experiment': 'historical', 'frequency': 'mon', 'realm': 'atmos',
+           'r': 1, 'i': 1, 'p': 1, 'ensemble': 'r1i1p1', 'cmor_table': 'Amon',
+           'variable': 'tas', 'time_complete': True}
+    return pandas.DataFrame([
+        dict(row, path=f'{root}/files/tas_20120115', version='20120115', file_count=2,
+             total_size=200, period=NumericRange(185001, 200513, '[)'), latest=False),
+        dict(row, path=f'{root}/files/tas_20130201', version='20130201', file_count=1,
+             total_size=100, period='[185001,200613)', latest=True),
+        ])
@@ -35,3 +35,10 @@ def session(pytestconfig):
     session = Session()
     yield session
     session.rollback()
+
+
+@pytest.fixture(autouse=True)
+def clef_cache(tmp_path, monkeypatch):
+    """Keep cached results from the tests out of the user cache"""
+    monkeypatch.setenv('CLEF_CACHE', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
@@ -17,6 +17,8 @@
 import pytest
 import py
 import os
+import socketserver
+import threading
 
 _dir = os.path.dirname(os.path.realpath(__file__))
 FIXTURE_DIR = py.path.local(_dir) / '/home/581/pxp581/clef'
@@ -55,3 +57,41 @@ def rows5():
               ('dataset6','pr'): 'done', ('dataset2','pr'): 'queued',
               ('dataset7','tas'): 'done', ('dataset8','tas'): 'queued'}
     return rows5
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to receive messages from smtplib"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost test server')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'DATA':
+                self.reply('354 end with .')
+                data = []
+                for l in iter(self.rfile.readline, b'.\r\n'):
+                    data.append(l.decode())
+                self.server.messages.append(''.join(data))
+            self.reply('250 ok')
+
+
+@pytest.fixture
+def smtp_server():
+    """A local SMTP server storing the messages it receives"""
+    server = socketserver.ThreadingTCPServer(('localhost', 0), SMTPHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.messages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import pytest
 
 @pytest.fixture(scope="module")
@@ -60,3 +61,22 @@ def test_error():
 def citations():
     return ['Seland, Øyvind; Bentsen, Mats; Oliviè, Dirk Jan Leo; Toniazzo, Thomas; Gjermundsen, Ada; Graff, Lise Seland; Debernard, Jens Boldingh; Gupta, Alok Kumar; He, Yanchun; Kirkevåg, Alf; Schwinger, Jörg; Tjiputra, Jerry; Aas, Kjetil Schanke; Bethke, Ingo; Fan, Yuanchao; Griesfeller, Jan; Grini, Alf; Guo, Chuncheng; Ilicak, Mehmet; Karset, Inger Helene Hafsahl; Landgren, Oskar Andreas; Liakka, Johan; Moseid, Kine Onsum; Nummelin, Aleksi; Spensberger, Clemens; Tang, Hui; Zhang, Zhongshi; Heinze, Christoph; Iversen, Trond; Schulz, Michael (2019). NCC NorESM2-LM model output prepared for CMIP6 CMIP historical. Version v20190920. Earth System Grid Federation. https://doi.org/10.22033/ESGF/CMIP6.8036',
             'Cao, Jian; Wang, Bin (2019). NUIST NESMv3 model output prepared for CMIP6 CMIP historical. Version v20190812. Earth System Grid Federation. https://doi.org/10.22033/ESGF/CMIP6.8769']
+
+
+@pytest.fixture(scope="module")
+def citation_html():
+    """Citation section of a WDCC CMIP6 page"""
+    return (b'<html><body><dl><dt>Title</dt><dd>CMIP6.CMIP.NCC.NorESM2-LM.historical</dd>'
+            b'<dt>Citation</dt><dd>Seland, Oyvind (2019). NCC NorESM2-LM model output prepared for '
+            b'CMIP6 CMIP historical. Version YYYYMMDD[1].Earth System Grid Federation. '
+            b'https://doi.org/10.22033/ESGF/CMIP6.8036 BibTeX  RIS</dd></dl></body></html>')
+
+
+@pytest.fixture(scope="module")
+def pages():
+    """Hand-written copies of the WDCC and ES-DOC pages, read by name"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+    def read_page(name):
+        with open(os.path.join(path, name), 'rb') as f:
+            return f.read()
+    return read_page
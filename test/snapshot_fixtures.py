@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from sqlalchemy import create_engine
+from clef import snapshot
+
+
+c6root = '/g/data/oi10/replicas/CMIP6/CMIP/CSIRO/ACCESS-ESM1-5/historical'
+c5root = '/g/data/rr3/publications/CMIP5/output1/CSIRO-BOM/ACCESS1-0/historical/mon/atmos/Amon/r1i1p1'
+
+c6files = [
+    # file_id, dataset_id, member, variable, version, period
+    ('f61', 'd61', 'r1i1p1f1', 'tas', '20191115', '[185001,201413)'),
+    ('f62', 'd62', 'r1i1p1f1', 'pr', '20191115', '[185001,201413)'),
+    ('f63', 'd63', 'r2i1p1f1', 'tas', '20200529', '[185001,194913)'),
+    ('f64', 'd63', 'r2i1p1f1', 'tas', '20200529', '[195001,201413)'),
+    ]
+
+c5files = [
+    ('f51', 'd51', 'tas', '20120115', '[185001,200513)'),
+    ]
+
+
+def add_snapshot_rows(conn, meta):
+    """Add the sample catalogue rows to a snapshot"""
+    t = meta.tables
+    for fid, did, member, var, version, period in c6files:
+        fname = f'{var}_Amon_ACCESS-ESM1-5_historical_{member}_gn_{period[1:7]}-{int(period[8:14])-1}.nc'
+        conn.execute(t['esgf_paths'].insert(), {'file_id': fid,
+            'path': f'{c6root}/{member}/Amon/{var}/gn/v{version}/{fname}'})
+        conn.execute(t['extended_metadata'].insert(), {'file_id': fid,
+            'version': version, 'variable': var, 'period': period})
+        conn.execute(t['c6_metadata_dataset_link'].insert(), {'file_id': fid, 'dataset_id': did})
+    for did, member, var in set((x[1], x[2], x[3]) for x in c6files):
+        conn.execute(t['cmip6_dataset'].insert(), {'dataset_id': did,
+            'project': 'CMIP6', 'activity_id': 'CMIP', 'institution_id': 'CSIRO',
+            'source_id': 'ACCESS-ESM1-5', 'source_type': 'AOGCM', 'experiment_id': 'historical',
+            'sub_experiment_id': 'none', 'frequency': 'mon', 'realm': 'atmos',
+            'r': int(member[1]), 'i': 1, 'p': 1, 'f': 1, 'variant_label': member,
+            'member_id': member, 'variable_id': var, 'grid_label': 'gn',
+            'nominal_resolution': '250 km', 'table_id': 'Amon'})
+    for fid, did, var, version, period in c5files:
+        conn.execute(t['esgf_paths'].insert(), {'file_id': fid,
+            'path': f'{c5root}/v{version}/{var}/{var}_Amon_ACCESS1-0_historical_r1i1p1_185001-200512.nc'})
+        conn.execute(t['extended_metadata'].insert(), {'file_id': fid,
+            'version': version, 'variable': var, 'period': period})
+        conn.execute(t['c5_metadata_dataset_link'].insert(), {'file_id': fid, 'dataset_id': did})
+        conn.execute(t['cmip5_dataset'].insert(), {'dataset_id': did,
+            'project': 'CMIP5', 'institute': 'CSIRO-BOM', 'model': 'ACCESS1.0',
+            'experiment': 'historical', 'frequency': 'mon', 'realm': 'atmos',
+            'r': 1, 'i': 1, 'p': 1, 'ensemble': 'r1i1p1', 'cmor_table': 'Amon'})
+    conn.execute(t['snapshot_info'].insert(), {'key': 'created', 'value': '2020-01-01T00:00:00+00:00'})
+
+
+@pytest.fixture(scope="module")
+def snapshot_file(tmp_path_factory):
+    """A catalogue snapshot with a few CMIP5 and CMIP6 files"""
+    path = str(tmp_path_factory.mktemp('snapshot') / 'catalogue.db')
+    engine = create_engine('sqlite:///' + path)
+    meta = snapshot.snapshot_metadata()
+    meta.create_all(engine)
+    with engine.begin() as conn:
+        snapshot.create_views(conn, meta)
+        add_snapshot_rows(conn, meta)
+    engine.dispose()
+    return path
+
+
+@pytest.fixture
+def snapshot_session(snapshot_file):
+    session = snapshot.connect(snapshot_file)
+    yield session
+    session.close()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from unittest import mock
+from clef.cache import QueryCache, catalogue_generation, query_cache, frame_to_json
+from clef.code import local_query, build_query
+from snapshot_fixtures import snapshot_file, snapshot_session
+
+# Tests for the query results cache in cache.py
+
+
+def test_key():
+    k1 = QueryCache.key('1', 'cmip6', True, {'variable_id': 'tas', 'table_id': ['Amon', 'day']})
+    k2 = QueryCache.key('1', 'CMIP6', True, {'table_id': ('day', 'Amon'), 'variable_id': 'tas'})
+    assert k1 == k2
+    assert k1 != QueryCache.key('2', 'CMIP6', True, {'variable_id': 'tas', 'table_id': ['Amon', 'day']})
+    assert k1 != QueryCache.key('1', 'CMIP6', False, {'variable_id': 'tas', 'table_id': ['Amon', 'day']})
+
+
+def test_put_get(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    df = pd.DataFrame({'path': ['a', 'b'], 'filename': [{'x.nc'}, {'y.nc', 'z.nc'}]})
+    assert cache.get('k') is None
+    cache.put('k', df)
+    assert cache.get('k').equals(df)
+
+    df = pd.DataFrame({'version': ['v1', None], 'file_count': [1, 2], 'latest': [True, False],
+                       'filename': [set(), {'x.nc'}]},
+                      index=pd.Index(['/a', '/b'], name='path'))
+    cache.put('k', df)
+    cached = cache.get('k')
+    assert cached.equals(df)
+    assert list(cached.dtypes) == list(df.dtypes)
+    assert cached.index.name == 'path'
+    # results are stored as JSON, not pickles that could run code when loaded
+    assert not any(f.suffix == '.pkl' or f.name.endswith('.pkl.gz') for f in tmp_path.iterdir())
+
+
+def test_unknown_types(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    # numpy scalars are written as the python values
+    df = pd.DataFrame({'path': ['a'], 'size': [np.int64(1)]}, dtype=object)
+    cache.put('k', df)
+    assert cache.get('k').loc[0, 'size'] == 1
+
+    # other types are not turned into strings, the result isn't cached
+    df = pd.DataFrame({'path': ['a'], 'updated': [pd.Timestamp('2020-01-01')]}, dtype=object)
+    with pytest.raises(TypeError):
+        frame_to_json(df)
+    cache.put('other', df)
+    assert cache.get('other') is None
+    assert QueryCache.key('1', 'CMIP6', True, {'variable_id': object()}) is None
+
+
+def test_evict(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    df = pd.DataFrame({'path': [str(x) for x in range(1000)]})
+    cache.put('old', df)
+    os.utime(tmp_path / 'old.json.gz', (0, 0))
+    cache.max_size = 2 * os.path.getsize(tmp_path / 'old.json.gz') + 100
+    cache.put('new', df)
+    cache.put('newer', df)
+    assert cache.get('old') is None
+    assert cache.get('new') is not None
+    assert cache.get('newer') is not None
+
+
+def test_local_query_cached(snapshot_session):
+    assert catalogue_generation(snapshot_session).endswith('#2020-01-01T00:00:00+00:00')
+    r0 = local_query(snapshot_session, 'CMIP6', variable_id='tas')
+    with mock.patch('clef.code.build_query', wraps=build_query) as build:
+        r1 = local_query(snapshot_session, 'CMIP6', variable_id='tas')
+        assert r0.equals(r1)
+        build.assert_not_called()
+        # a new catalogue generation invalidates the result
+        with mock.patch('clef.code.catalogue_generation', return_value='new'):
+            local_query(snapshot_session, 'CMIP6', variable_id='tas')
+        build.assert_called_once()
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setenv('CLEF_CACHE', '')
+    assert query_cache() is None
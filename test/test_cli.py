@@ -20,6 +20,7 @@ import pytest
 
 from click.testing import CliRunner
 from test_esgf import updated_query
+from snapshot_fixtures import snapshot_file, c6root
 import sys
 import logging
 
@@ -43,7 +44,7 @@ def dummy_connect(*args, **kwargs):
 @pytest.fixture()
 def mock_query(session):
     with mock.patch('clef.cli.connect', side_effect=dummy_connect):
-        with mock.patch('clef.cli.Session', side_effect = lambda: session):
+        with mock.patch('clef.cli.ReadOnlySession', side_effect = lambda: session):
             with mock.patch('clef.esgf.esgf_query', side_effect=updated_query) as query:
                 yield query
 
@@ -114,6 +115,39 @@ def test_model(runner, mock_query):
     assert mock_query.called
     assert mock_query.call_args[1]['source_id'] == ('CNRM-CM6-1',)
 
+def test_errata(runner, snapshot_file, monkeypatch):
+    monkeypatch.setenv('CLEF_SNAPSHOT', snapshot_file)
+    ctx = {'search':False, 'local': False, 'missing': False, 'request': False, 'flow': 'local',
+            'log': logging.getLogger('cleflog')}
+    tids = {f'{c6root}/r1i1p1f1/Amon/tas/gn/v20191115': {'hdl:1'}}
+    with mock.patch('clef.cli.db_session') as db_session, \
+         mock.patch('clef.cli.tracking_ids', return_value=tids) as tracking_ids, \
+         mock.patch('clef.cli.print_path_errata') as print_path_errata:
+        result = runner.invoke(cmip6, ['--errata', '--variable', 'tas'], obj=ctx, catch_exceptions=False)
+    assert result.exit_code == 0
+    # the snapshot has no tracking ids, they come from the clef database
+    db_session.assert_called_once()
+    assert tracking_ids.call_args[0][0] is db_session.return_value
+    paths = tracking_ids.call_args[0][2]
+    assert sorted(paths) == [f'{c6root}/r1i1p1f1/Amon/tas/gn/v20191115',
+                             f'{c6root}/r2i1p1f1/Amon/tas/gn/v20200529']
+    print_path_errata.assert_called_once_with(paths, tids)
+
+
+def test_facets(runner, snapshot_file, monkeypatch, clef_cache):
+    monkeypatch.setenv('CLEF_SNAPSHOT', snapshot_file)
+    ctx = {'search':False, 'local': False, 'missing': False, 'request': False, 'flow': 'local',
+            'log': logging.getLogger('cleflog')}
+    # variable isn't a CMIP5 dataset facet, it is applied as in the search
+    result = runner.invoke(cmip5, ['--facets', '-v', 'tas'], obj=ctx, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert 'model:\n  ACCESS1.0: 1\n' in result.output
+
+    result = runner.invoke(cmip6, ['--facets', '-v', 'tas'], obj=ctx, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert 'member_id:\n  r1i1p1f1: 1\n  r2i1p1f1: 1\n' in result.output
+
+
 @pytest.fixture
 def prod_cli(runner, session):
     with mock.patch('clef.cli.connect', side_effect=dummy_connect):
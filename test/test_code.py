@@ -16,8 +16,11 @@
 
 import pytest
 
-from clef.code import and_filter, matching, local_latest, search, stats, ids_df
+from clef import snapshot
+from clef.code import and_filter, matching, local_latest, search, stats, ids_df, post_summary, \
+                      tracking_ids, write_csv
 from code_fixtures import *
+from snapshot_fixtures import snapshot_file, c5root, c6root
 from clef.exception import ClefException
 
 # Tests for the functions defined in code.py
@@ -120,6 +123,88 @@ def test_stats(local_results, results5, results6):
     assert sorted(sdf.index.unique()) == ['EC-EARTH', 'MIROC5']
 
 
+def test_post_summary(summary_rows):
+    latest = post_summary(summary_rows.copy(), latest=True)
+    # both versions are in the same 'latest' directory, the newest is kept
+    assert len(latest.index) == 1
+    row = latest.iloc[0]
+    assert row['path'].endswith('/Amon/r1i1p1/latest/tas')
+    assert row['version'] == '20130201'
+    assert (row['fdate'], row['tdate']) == ('18500101', '20061231')
+    assert row['file_count'] == 1
+    assert 'period' not in latest.columns
+
+    versions = post_summary(summary_rows.copy(), latest=False)
+    assert sorted(versions['version']) == ['20120115', '20130201']
+    assert versions['path'].iloc[0].endswith('/files/tas_20120115')
+    # summaries work as local query results
+    assert stats(versions, 'CMIP5').loc['ACCESS1.0', 'count'] == 1
+    assert len(local_latest(versions).index) == 1
+
+
+def test_post_summary_merged(summary_rows):
+    # al33 output1 and output2 versions are both listed in the combined directory
+    root = '/g/data/al33/replicas/CMIP5/{}/CSIRO-BOM/ACCESS1-0/historical/mon/atmos/Amon/r1i1p1/v20120115/tas'
+    rows = summary_rows.copy()
+    rows['path'] = [root.format('output1'), root.format('output2')]
+    rows['version'] = '20120115'
+    rows['latest'] = True
+    rows['time_complete'] = [True, False]
+    merged = post_summary(rows, latest=True)
+    assert len(merged.index) == 1
+    row = merged.iloc[0]
+    assert row['path'] == root.format('combined')
+    assert (row['file_count'], row['total_size']) == (3, 300)
+    assert (row['fdate'], row['tdate']) == ('18500101', '20061231')
+    assert not row['time_complete']
+    assert 'latest' not in merged.columns
+
+
+def test_write_csv_summary(summary_rows, tmp_path, monkeypatch):
+    # summary results add file_count and total_size to the csv columns,
+    # see docs/new_features.rst
+    monkeypatch.chdir(tmp_path)
+    write_csv(post_summary(summary_rows.copy(), latest=True))
+    header = (tmp_path / 'CMIP5_query.csv').read_text().splitlines()[0].split(',')
+    assert header[0] == 'path'
+    assert {'model', 'experiment', 'ensemble', 'version', 'variable', 'fdate', 'tdate',
+            'file_count', 'total_size', 'time_complete'} <= set(header)
+    assert not {'filename', 'project', 'institute', 'realm', 'period', 'latest'} & set(header)
+
+
+def test_tracking_ids(snapshot_file, tmp_path):
+    # a catalogue with the file attributes, as on the clef database
+    session = snapshot.connect(snapshot.create_snapshot(snapshot.connect(snapshot_file),
+                                                        str(tmp_path / 'catalogue.db')))
+    session.execute("CREATE TABLE info_attributes (file_id TEXT PRIMARY KEY, tracking_id TEXT)")
+    session.execute("INSERT INTO info_attributes VALUES ('f61', 'hdl:1'), ('f63', 'hdl:3'), "
+                    "('f64', 'hdl:4'), ('f51', 'hdl:5')")
+
+    paths = [f'{c6root}/r2i1p1f1/Amon/tas/gn/v20200529', f'{c6root}/r1i1p1f1/Amon/tas/gn/v20191115']
+    found = tracking_ids(session, 'cmip6', paths, variable_id=['tas'])
+    assert found == {paths[0]: {'hdl:3', 'hdl:4'}, paths[1]: {'hdl:1'}}
+    # only the result paths are returned
+    assert tracking_ids(session, 'CMIP6', paths[:1], variable_id=['tas']) == {paths[0]: {'hdl:3', 'hdl:4'}}
+
+    # the files are grouped by the result path fix_path gives them
+    latest = c5root + '/latest/tas'
+    assert tracking_ids(session, 'CMIP5', [latest], latest=True, model=['ACCESS1.0']) == {latest: {'hdl:5'}}
+    assert tracking_ids(session, 'CMIP5', [latest], latest=False, model=['ACCESS1.0']) == {}
+
+@pytest.mark.production
+def test_summary_query(session):
+    facets = {
+        'experiment':'historical',
+        'cmor_table':'Amon',
+        'ensemble':'r1i1p1',
+        'variable':'tas'
+    }
+    files = search(session, project='cmip5', model='ACCESS1.0', **facets)
+    summary = search(session, project='cmip5', model='ACCESS1.0', summary=True, **facets)
+    assert sorted(summary['path']) == sorted(files['path'])
+    assert summary['file_count'].sort_index().tolist() == files['filename'].map(len).sort_index().tolist()
+
+
 @pytest.mark.production
 def test_search_results(session):
     facets = {
@@ -16,3 +16,66 @@
 from __future__ import print_function
 
 from clef.db import *
+
+import pytest
+
+from clef.exception import ClefException
+
+
+def test_connect_cached():
+    e1 = connect('sqlite://')
+    e2 = connect('sqlite://')
+    assert e1 is e2
+    assert Session.kw['bind'] is e1
+
+
+def test_connect_lazy_auth():
+    # Nothing is opened until the first query
+    engine = connect('sqlite:////nonexistent/clef.db')
+    with pytest.raises(ClefException):
+        engine.execute('SELECT 1')
+
+
+def test_connect_readonly():
+    engine = connect('sqlite://', readonly=True)
+    assert engine is not connect('sqlite://')
+    connect('sqlite://', readonly=True)
+    assert ReadOnlySession.kw['bind'] is engine
+    # the default sessions keep their transactions
+    assert Session.kw['bind'] is not engine
+    assert not Session.kw.get('autocommit', False)
+    assert ReadOnlySession().execute('SELECT 1').scalar() == 1
+
+
+def test_transaction_settings():
+    from unittest import mock
+    from clef.db import _transaction_settings
+
+    conn = mock.Mock()
+    _transaction_settings('clef', 60000)(conn, None, None)
+    conn.cursor.return_value.execute.assert_called_once_with(
+        'SELECT set_config(%s, %s, true), set_config(%s, %s, true)',
+        ['application_name', 'clef', 'statement_timeout', '60000'])
+
+
+def test_connect_settings(monkeypatch):
+    import clef.db
+
+    calls = []
+    def create(url, **kwargs):
+        calls.append(kwargs)
+        return sqlalchemy.create_engine('sqlite://')
+    monkeypatch.setattr(clef.db, '_engines', {})
+    monkeypatch.setattr(clef.db, 'create_engine', create)
+
+    connect('postgresql://localhost/clef', application_name='clef-test', statement_timeout=1000)
+    assert calls[-1]['connect_args'] == {'application_name': 'clef-test',
+                                         'options': '-c statement_timeout=1000'}
+    # read-only engines set the timeout for each transaction instead
+    connect('postgresql://localhost/clef', readonly=True, application_name='clef-test')
+    assert calls[-1]['connect_args'] == {'application_name': 'clef-test'}
+
+    # the refresh sizes the pool from its number of workers
+    connect('postgresql://localhost/clef', pool_size=8)
+    assert calls[-1]['pool_size'] == 8
+    assert calls[-2]['pool_size'] == 2
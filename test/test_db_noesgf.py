@@ -30,3 +30,14 @@ def test_vars_names(session):
 
 def test_cmor_names(session):
     assert session.cmor_names().sort() == ['ta', 'pr'].sort()
+
+def test_variable_path(session):
+    ds = session.query(Dataset).filter_by(name='DS1', version='1.0').one()
+    template = PathTemplate(ds)
+    for v in ds.variables:
+        assert v.path(template) == v.path() == f'/disk/data/DS1/v1/{v.frequency}/<year`>/<variable>_DS1_<fdate>_<todate>'
+    ds.drs = '/disk/data/<name>/<version>/<varname>_<grid>/'
+    ds.filename = '<varname>_<fdate>.nc'
+    v = ds.variables[0]
+    assert PathTemplate(ds).render(v) == f'/disk/data/DS1/1.0/{v.varname}_NA/{v.varname}_<fdate>.nc'
+    session.session.rollback()
@@ -17,11 +17,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from clef.download import write_request, helpdesk, find_dids
+from clef import download
+from clef.download import write_request, request_files, helpdesk, find_dids, load_queue, queue_index, RequestSpooler
 from unittest.mock import patch
 from smtplib import SMTPException
-from download_fixtures import qm, rows5, rows6
+from download_fixtures import qm, rows5, rows6, smtp_server
 import builtins
+import numpy as np
+import os
 
 def test_helpdesk(tmp_path):
     request = tmp_path / 'request'
@@ -54,6 +57,18 @@ def test_write_request(tmp_path):
                     write_request('dummy_project', ['a','b'])
                     helpdesk_.assert_not_called()
 
+def test_request_files(tmp_path):
+    files = request_files('CMIP5', 'abc123', ['d1 tas', 'd2 pr', 'd1 pr', 'd3 pr'], str(tmp_path))
+    # the variables of a file apply to all its datasets
+    assert [open(f).read() for f in files] == ['dataset_id=d1\nvariable= pr tas',
+                                              'dataset_id=d2\ndataset_id=d3\nvariable= pr']
+    # files written in the same second don't overwrite each other
+    again = request_files('CMIP6', 'abc123', ['d6'], str(tmp_path))
+    again += request_files('CMIP6', 'abc123', ['d7'], str(tmp_path))
+    assert len(set(again)) == 2
+    assert sorted(open(f).read() for f in again) == ['dataset_id=d6\n', 'dataset_id=d7\n']
+
+
 def test_find_dids(qm, rows5, rows6):
     dids5 = set([k[0] for k in rows5.keys()])
     dids6 = set([k for k in rows6.keys()])
@@ -66,3 +81,90 @@ def test_find_dids(qm, rows5, rows6):
                                                         'dataset1.output1.b pr': 'done',
                                                         'dataset2 pr': 'queued',
                                                         'dataset3 wmo': 'queued'}
+
+    index5 = queue_index(rows5, 'CMIP5')
+    assert index5['dataset1.output1.b'] == {'tas': 'done', 'pr': 'done'}
+    assert find_dids(qm, rows5, dids5, 'CMIP5', ['pr'], index5) == {'dataset1.output1.b pr': 'done',
+                                                                   'dataset2 pr': 'queued'}
+
+
+def test_load_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, 'queue_dir', str(tmp_path))
+    monkeypatch.setattr(download, '_queues', {})
+    assert load_queue('CMIP6') == {}
+
+    table = tmp_path / 'CMIP5_clef_table.csv'
+    table.write_text('tas,dataset1,done\npr,dataset1,queued\nwmo,dataset2,done\n')
+    queue = load_queue('CMIP5')
+    assert queue.get('dataset1') == {'tas': 'done', 'pr': 'queued'}
+    assert 'dataset2' in queue and 'dataset3' not in queue
+    assert (tmp_path / '.CMIP5_clef_table.bin').exists()
+    # written to a temporary file, readable by the other users, then renamed
+    assert (tmp_path / '.CMIP5_clef_table.bin').stat().st_mode & 0o777 == 0o644
+    assert not list(tmp_path.glob('*.tmp'))
+    assert find_dids([('dataset1',), ('dataset3',)], {}, set(), 'CMIP5', ['tas'], queue) == {
+        'dataset1 tas': 'done'}
+
+    # another process maps the binary table instead of reading the csv
+    monkeypatch.setattr(download, '_queues', {})
+    with patch('clef.download.read_queue', side_effect=AssertionError):
+        assert load_queue('CMIP5').get('dataset2') == {'wmo': 'done'}
+
+    # the table is made again when the csv changes
+    table.write_text('tas,dataset1,done\npr,dataset1,done\npr,dataset3,queued\n')
+    queue = load_queue('CMIP5')
+    assert queue.get('dataset1') == {'tas': 'done', 'pr': 'done'}
+    assert queue.get('dataset2') is None
+
+    # CMIP6 rows have no variable, and the queue directory may not be writable
+    table6 = tmp_path / 'CMIP6_clef_table.csv'
+    table6.write_text('dataset6,queued\n')
+    monkeypatch.setattr(download, '_table_files', lambda project: [str(tmp_path / 'ro' / 'x' / 'y')])
+    (tmp_path / 'ro').write_text('')
+    queue = load_queue('CMIP6')
+    assert queue.get('dataset6') == 'queued'
+
+
+
+def test_queue_table_collision(monkeypatch):
+    # every dataset_id has the same hash
+    monkeypatch.setattr(download.QueueTable, 'did_hash', staticmethod(lambda did: np.uint64(1)))
+    table = download.QueueTable(download.QueueTable.pack({('ds1', 'tas'): 'done', ('ds2', 'pr'): 'queued'},
+                                                         'CMIP5', (0, 0)))
+    assert table.get('ds1') == {'tas': 'done'}
+    assert table.get('ds2') == {'pr': 'queued'}
+    assert 'ds3' not in table
+
+
+def test_find_dids_order():
+    index = {'b': 'done', 'a': 'queued', 'c': 'done'}
+    qm = [('c',), ('a',), ('b',), ('a',)]
+    assert list(find_dids(qm, {}, set(), 'CMIP6', [], index)) == ['c', 'a', 'b']
+
+def test_request_spooler(tmp_path, monkeypatch, smtp_server):
+    monkeypatch.setattr(download, 'queue_dir', str(tmp_path))
+    monkeypatch.setattr(download, '_queues', {})
+    (tmp_path / 'CMIP5_clef_table.csv').write_text('tas,dataset1,done\n')
+    host, port = smtp_server.server_address
+
+    with RequestSpooler(user='abc123', window=3600, outdir=str(tmp_path),
+                        host=host, port=port) as spooler:
+        # queued and repeated requests are dropped
+        assert spooler.add('CMIP5', ['dataset1 tas', 'dataset1 pr', 'dataset2 pr']) == ['dataset1 pr', 'dataset2 pr']
+        assert spooler.add('CMIP5', ['dataset2 pr', 'dataset3 tas']) == ['dataset3 tas']
+        assert spooler.add('CMIP6', ['dataset6', 'dataset6']) == ['dataset6']
+        # nothing is sent until the window has passed
+        assert smtp_server.messages == []
+        spooler.window = 0
+        assert spooler.add('CMIP6', ['dataset7']) == ['dataset7']
+        assert len(spooler.files) == 3
+        assert spooler.add('CMIP6', ['dataset6']) == []
+
+    # one file and one e-mail per project and set of variables, all over one connection
+    assert len(smtp_server.messages) == 3
+    assert smtp_server.connections == 1
+    cmip5 = [f for f in spooler.files if os.path.basename(f).startswith('CMIP5')][0]
+    with open(cmip5) as f:
+        content = f.read()
+    assert content == 'dataset_id=dataset1\ndataset_id=dataset2\nvariable= pr'
+    assert 'Synda request: ' + os.path.basename(cmip5) in ''.join(smtp_server.messages)
@@ -14,9 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from clef.esdoc import get_doc, get_wdcc, errata, retrieve_error, citation  
+from clef.esdoc import get_doc, get_wdcc, errata, retrieve_error, citation
+from clef.esdoc import parse_html, citation_text, html_tables, print_doc, print_model
+from clef.esdoc import resolve_pids, check_errata, print_path_errata, sync_docs
 from esdoc_fixtures import *
 from code_fixtures import dids6
+from snapshot_fixtures import snapshot_file, snapshot_session
+from unittest import mock
+import requests
+from clef import esdoc
+from clef.docstore import DocStore
 #import pytest
 
 def test_esdoc_urls():
@@ -64,3 +71,180 @@ def test_retrieve_error(test_error):
 
 def test_citation(dids6, citations):
     assert citation(dids6) == citations
+
+
+def test_citation_cached(citation_html, clef_cache):
+    dids = ['CMIP6.CMIP.NCC.NorESM2-LM.historical.r1i1p1f1.Amon.tas.gn.v20190815',
+            'CMIP6.CMIP.NCC.NorESM2-LM.historical.r2i1p1f1.Amon.pr.gn.v20190920',
+            'CMIP6.CMIP.NCC.NorESM2-LM.historical.r3i1p1f1.Amon.pr.gn.none']
+    with mock.patch('clef.esdoc.requests.get') as get:
+        get.return_value.content = citation_html
+        cites = citation(dids)
+        # one request for the three datasets of the simulation
+        get.assert_called_once()
+        assert get.call_args[0][0].endswith('input=CMIP6.CMIP.NCC.NorESM2-LM.historical')
+        assert 'Version v20190815. Earth System' in cites[0]
+        assert 'Version v20190920. Earth System' in cites[1]
+        assert 'Accessed on' in cites[2]
+
+        # the citation is saved for the next call
+        get.reset_mock()
+        assert citation(dids[:1]) == cites[:1]
+        get.assert_not_called()
+
+
+def test_citation_failed(citation_html, clef_cache, capsys):
+    dids = ['CMIP6.CMIP.NCC.NorESM2-LM.historical.r1i1p1f1.Amon.tas.gn.v20190815',
+            'CMIP6.CMIP.MIROC.MIROC6.historical.r1i1p1f1.Amon.tas.gn.v20190311']
+
+    def fake_get(url, **kwargs):
+        if 'MIROC' in url:
+            raise requests.ConnectionError('no route to host')
+        return mock.Mock(content=citation_html)
+
+    with mock.patch('clef.esdoc.requests.get', side_effect=fake_get):
+        cites = citation(dids)
+    # the failed simulation is reported and left out
+    assert len(cites) == 1 and 'NorESM2-LM' in cites[0]
+    assert 'CMIP6.CMIP.MIROC.MIROC6.historical: no route to host' in capsys.readouterr().out
+
+    # the citation that was retrieved is saved
+    with mock.patch('clef.esdoc.requests.get') as get:
+        assert citation(dids[:1]) == cites
+        get.assert_not_called()
+
+def test_citation_text(pages):
+    cite = citation_text(parse_html(pages('wdcc_citation.html')))
+    assert cite == ('Seland, Øyvind; Bentsen, Mats; Oliviè, Dirk Jan Leo (2019). NCC NorESM2-LM '
+                    'model output prepared for CMIP6 CMIP historical. Version YYYYMMDD[1].Earth '
+                    'System Grid Federation. https://doi.org/10.22033/ESGF/CMIP6.8036')
+    assert citation_text(parse_html(pages('esdoc_model.html'))) is None
+
+
+def test_html_tables(pages, capsys):
+    tables = html_tables(parse_html(pages('esdoc_experiment.html')))
+    # header rows are left out and the whitespace collapsed
+    assert tables[0][0] == ['Name', 'historical']
+    assert tables[0][3][1] == ('Simulation of the recent past (1850 to 2014). Impose '
+                               'changing conditions (consistent with observations).')
+    assert tables[1] == [['Temporal constraint', '1850-2014 165yrs'],
+                         ['Ensemble', 'HistoricalEnsemble']]
+    print_doc(tables, 'experiment')
+    out = capsys.readouterr().out.splitlines()
+    assert 'Name > historical' in out
+    assert not any(l.startswith('Keywords') or l.startswith('Rationale') for l in out)
+
+    print_model(html_tables(parse_html(pages('esdoc_model.html'))))
+    out = capsys.readouterr().out.splitlines()
+    assert out == ['Name > MIROC6', 'Institutes > MIROC', 'Type > GCM',
+                   'Atmosphere - Key Properties > Atmosphere component of MIROC6',
+                   'Ocean - Key Properties > Ocean component of MIROC6']
+
+
+def test_check_errata(test_error, clef_cache, capsys):
+    issue = next(iter(test_error.values()))
+    uid = issue['uid']
+    tids = [f'hdl:21.14100/file{i}' for i in range(5)]
+
+    def fake_get(url, params=None, **kwargs):
+        response = mock.Mock()
+        if 'resolve' in url:
+            pids = params['pids'].split(',')
+            # only the first file has errata
+            response.json.return_value = {'errata': [[p, [[uid if p.endswith('file0') else '']]]
+                                                     for p in pids]}
+        else:
+            response.json.return_value = {'issue': issue}
+        return response
+
+    with mock.patch('clef.esdoc.requests.get', side_effect=fake_get) as get:
+        assert resolve_pids(tids, batch=2) == {tids[0]: [uid]}
+        # the tracking ids are sent two at a time
+        assert get.call_count == 3
+
+        get.reset_mock()
+        assert check_errata(tids) == {tids[0]: [issue]}
+        assert get.call_count == 2
+
+        # the issue is saved for the next call, only the tracking ids are resolved again
+        get.reset_mock()
+        print_path_errata(['/a', '/b'], {'/a': tids[:2], '/b': tids[2:]})
+        assert get.call_count == 1
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == '/a'
+    assert out[1].startswith('    errata (critical, resolved): Missing scaling factor')
+    assert out[1].endswith(uid)
+    assert out[2:] == ['/b']
+
+
+def test_check_errata_failed(test_error, clef_cache, capsys):
+    issue = next(iter(test_error.values()))
+    uid = issue['uid']
+    tids = ['hdl:21.14100/file0', 'hdl:21.14100/file1', 'hdl:21.14100/file2']
+
+    def fake_get(url, params=None, **kwargs):
+        response = mock.Mock()
+        if 'resolve' in url:
+            if 'file2' in params['pids']:
+                # an error page instead of JSON
+                response.json.side_effect = ValueError('Expecting value')
+            else:
+                response.json.return_value = {'errata': [['21.14100/file0', [[uid + ';bad-uid']]],
+                                                         ['21.14100/file1', [['bad-uid']]]]}
+        elif url.endswith('bad-uid'):
+            response.raise_for_status.side_effect = requests.HTTPError('500 Server Error')
+        else:
+            response.json.return_value = {'issue': issue}
+        return response
+
+    with mock.patch('clef.esdoc.requests.get', side_effect=fake_get):
+        # the batch with an error page is skipped
+        assert resolve_pids(tids, batch=2) == {tids[0]: [uid, 'bad-uid'], tids[1]: ['bad-uid']}
+        assert check_errata(tids[:2]) == {tids[0]: [issue], tids[1]: []}
+    out = capsys.readouterr().out
+    assert 'Issue with handles: hdl:21.14100/file2' in out
+    assert 'Errata issue bad-uid not available' in out
+
+    # the issue that was retrieved is saved
+    with mock.patch('clef.esdoc.requests.get') as get:
+        assert esdoc.retrieve_issues([uid]) == {uid: issue}
+        get.assert_not_called()
+
+def test_sync_docs(citation_html, pages, clef_cache, capsys, caplog, monkeypatch):
+    sims = [('CMIP', 'CSIRO', 'ACCESS-ESM1-5', 'historical')]
+
+    def fake_get(url, **kwargs):
+        if 'MIROC' in url:
+            raise requests.ConnectionError('no route to host')
+        response = mock.Mock()
+        response.content = pages('esdoc_model.html') if 'es-doc' in url else citation_html
+        response.json.return_value = {'identifier': {'id': url}}
+        return response
+
+    # documents are written as they are retrieved
+    monkeypatch.setattr(esdoc, 'sync_batch', 1)
+    put_many = DocStore.put_many
+    with mock.patch('clef.esdoc.requests.get', side_effect=fake_get) as get, \
+         mock.patch.object(DocStore, 'put_many', autospec=True, side_effect=put_many) as put:
+        saved, failed = sync_docs(sims)
+        assert failed == 0
+        assert saved == get.call_count
+        assert put.call_count == saved
+        # nothing left to download
+        get.reset_mock()
+        assert sync_docs(sims) == (0, 0)
+        get.assert_not_called()
+
+        # failures are logged with the document
+        assert sync_docs([('CMIP', 'MIROC', 'MIROC6', 'historical')]) == (0, 3)
+    assert 'citation CMIP6.CMIP.MIROC.MIROC6.historical: no route to host' in caplog.text
+
+    # lookups read the stored documents
+    with mock.patch('clef.esdoc.requests.get') as get:
+        cites = citation(['CMIP6.CMIP.CSIRO.ACCESS-ESM1-5.historical.r1i1p1f1.Amon.tas.gn.v20191115'])
+        assert 'Version v20191115. Earth System' in cites[0]
+        url, r = get_wdcc('CMIP6.CMIP.CSIRO.ACCESS-ESM1-5.historical.r1i1p1f1.Amon.tas.gn.v20191115')
+        assert r.json() == {'identifier': {'id': url}}
+        get_doc('model', 'ACCESS-ESM1-5')
+        get.assert_not_called()
+    assert capsys.readouterr().out.splitlines()[0] == 'Name > MIROC6'
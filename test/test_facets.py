@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from clef import facets
+from clef.exception import ClefException
+from snapshot_fixtures import snapshot_file, snapshot_session
+
+# Tests for the facet counts in facets.py
+
+
+def test_facet_counts(snapshot_session):
+    counts = facets.facet_counts(snapshot_session, 'cmip6', experiment_id='historical')
+    assert counts['member_id'] == {'r1i1p1f1': 2, 'r2i1p1f1': 1}
+    assert counts['variable_id'] == {'pr': 1, 'tas': 2}
+
+    counts = facets.facet_counts(snapshot_session, 'CMIP6', variable_id='tas', member_id=['r2i1p1f1', 'r3i1p1f1'])
+    assert counts['source_id'] == {'ACCESS-ESM1-5': 1}
+
+    counts = facets.facet_counts(snapshot_session, 'CMIP6', source_id='MIROC6')
+    assert all(len(v) == 0 for v in counts.values())
+
+    # search options that aren't dataset facets are applied with the search filters
+    counts = facets.facet_counts(snapshot_session, 'CMIP6', variable='tas')
+    assert counts == facets.facet_counts(snapshot_session, 'CMIP6', variable_id='tas')
+    counts = facets.facet_counts(snapshot_session, 'CMIP6', activity_id='CM', variable_id=('tas', 'pr'))
+    assert counts['member_id'] == {'r1i1p1f1': 2, 'r2i1p1f1': 1}
+    counts = facets.facet_counts(snapshot_session, 'CMIP5', variable=('tas',), experiment_family=('Historical',))
+    assert counts['model'] == {'ACCESS1.0': 1}
+    assert facets.facet_counts(snapshot_session, 'CMIP5', variable='pr')['model'] == {}
+
+    with pytest.raises(ClefException):
+        facets.facet_index(snapshot_session, 'CMIP6').counts(variable='tas')
+
+    # CMIP5 uses the same constraint names as the command line
+    counts = facets.facet_counts(snapshot_session, 'cmip5', time_frequency='mon')
+    assert counts['model'] == {'ACCESS1.0': 1}
+
+
+def test_facet_index_cache(snapshot_session, clef_cache, monkeypatch):
+    monkeypatch.setattr(facets, '_indexes', {})
+    index = facets.facet_index(snapshot_session, 'CMIP5')
+    assert index.count(model='ACCESS1.0') == 1
+    assert len(list((clef_cache / 'facets').iterdir())) == 1
+
+    # a new session reads the saved index instead of the database
+    monkeypatch.setattr(facets, '_indexes', {})
+    monkeypatch.setattr(facets, 'build_index', None)
+    saved = facets.facet_index(snapshot_session, 'CMIP5')
+    assert saved.values == index.values
+    assert saved.counts() == index.counts()
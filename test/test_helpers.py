@@ -14,11 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import re
 import pytest
 
 from clef.exception import ClefException
 from clef.helpers import check_values, load_vocabularies, check_keys, get_version, get_member, time_axis, \
-                         get_keys, fix_model, fix_path, get_range, convert_periods, get_facets, get_id, get_ids
+                         get_keys, fix_model, model_aliases, fix_path, get_range, convert_periods, get_facets, get_id, get_ids
 from code_fixtures import c5_kwargs, c5_vocab, c5_keys, nranges, periods, empty, dids6, dids5, \
                           results5, results6, remote_results
 
@@ -65,6 +67,16 @@ def test_fix_model():
     arg_model = ['CESM1-BGC', 'ACCESS1-0']
     models = fix_model('CMIP5', arg_model)
     assert models == ['CESM1(BGC)', 'ACCESS1.0']
+    assert fix_model('CORDEX', ['CCAM-1391M']) == ['CSIRO-CCAM']
+    assert fix_model('CMIP6', ['ACCESS-CM2']) == ['ACCESS-CM2']
+
+
+def test_model_alias_sql():
+    # the package copy of the aliases matches the database table
+    sql = open(os.path.join(os.path.dirname(__file__), '..', 'db', 'model_alias.sql')).read()
+    rows = re.findall(r"\('(\w+)', '([^']+)', '([^']+)'\)", sql)
+    for project in ['CMIP5', 'CORDEX']:
+        assert {m: a for p, m, a in rows if p == project} == model_aliases(project)
 
 
 def test_convert_periods(nranges, periods, empty):
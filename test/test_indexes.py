@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import print_function
+
+# Check the query plans of the common local query shapes use the search
+# indexes from db/indexes.sql
+
+from clef.code import build_query
+
+import json
+import pytest
+import sqlalchemy as sa
+
+
+@pytest.fixture
+def no_seqscan(session):
+    # The test database is nearly empty, so force the planner to show which
+    # indexes it is able to use
+    session.execute(sa.text('SET enable_seqscan = off'))
+    yield session
+    session.execute(sa.text('RESET enable_seqscan'))
+
+
+def plan_indexes(session, query):
+    """Return the set of (relation, index) used by the plan for query"""
+    sql = query.statement.compile(dialect=session.get_bind().dialect,
+                                  compile_kwargs={'literal_binds': True})
+    plan = session.execute(sa.text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    found = set()
+    def walk(node):
+        if 'Index Name' in node:
+            found.add((node.get('Relation Name'), node['Index Name']))
+        for child in node.get('Plans', []):
+            walk(child)
+    walk(plan[0]['Plan'])
+    return found
+
+
+def facet_indexes(found, relation):
+    # Search indexes, not the file_id or dataset_id ones
+    return {i for r, i in found if r == relation and i.endswith('_idx')}
+
+
+@pytest.mark.parametrize('constraints', [
+    {'variable_id': 'tas', 'table_id': 'Amon'},
+    {'variable_id': 'tas', 'table_id': 'day', 'experiment_id': 'historical'},
+    {'source_id': 'ACCESS-CM2', 'experiment_id': 'historical'},
+    {'member_id': 'r1i1p1f1'},
+    ])
+def test_cmip6_plan(no_seqscan, constraints):
+    q = build_query(no_seqscan, 'CMIP6', **constraints)
+    assert facet_indexes(plan_indexes(no_seqscan, q), 'cmip6_files')
+
+
+@pytest.mark.parametrize('constraints', [
+    {'model': 'ACCESS1.0', 'experiment': 'historical'},
+    {'experiment': 'historical', 'cmor_table': 'Amon'},
+    {'experiment_family': 'ESM', 'cmor_table': 'Amon'},
+    ])
+def test_cmip5_plan(no_seqscan, constraints):
+    q = build_query(no_seqscan, 'CMIP5', **constraints)
+    assert facet_indexes(plan_indexes(no_seqscan, q), 'cmip5_files')
+
+
+def test_cmip5_variable_plan(no_seqscan):
+    q = build_query(no_seqscan, 'CMIP5', variable='tas')
+    assert ('cmip5_files', 'cmip5_files_variable_idx') in plan_indexes(no_seqscan, q)
+
+
+@pytest.mark.parametrize('constraints', [
+    {'domain': 'AUS-44i', 'experiment': 'rcp85'},
+    {'model_id': 'CSIRO-CCAM', 'driving_model': 'CSIRO-BOM-ACCESS1-0'},
+    ])
+def test_cordex_plan(no_seqscan, constraints):
+    q = build_query(no_seqscan, 'CORDEX', **constraints)
+    assert facet_indexes(plan_indexes(no_seqscan, q), 'cordex_files')
+
+
+def test_text_search_plan(no_seqscan):
+    q = build_query(no_seqscan, 'CMIP6', query='ACCESS ocean biogeochem')
+    assert ('file_search', 'file_search_document_idx') in plan_indexes(no_seqscan, q)
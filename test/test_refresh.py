@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import pytest
+
+import clef.refresh
+from clef.refresh import refresh_order, upsert_sql, refresh_graph, schedule, refresh_table
+
+
+def test_refresh_order():
+    tables = [x[0] for x in refresh_order]
+    # every table is updated after the tables its keys are selected from
+    for i, (table, key, keys) in enumerate(refresh_order):
+        for other in tables[i:]:
+            assert f' {other} ' not in keys + ' ', (table, other)
+    assert tables.index('esgf_paths') < tables.index('c6_metadata_dataset_link')
+    assert tables.index('c6_metadata_dataset_link') < tables.index('cmip6_dataset')
+    assert tables.index('cmip6_dataset') < tables.index('cmip6_files')
+    assert tables.index('extended_metadata') < tables.index('cmip6_files')
+    assert tables.index('cmip6_files') < tables.index('cmip6_summary')
+
+
+def test_upsert_sql():
+    delete, upsert = upsert_sql('checksums', 'ch_hash', ['ch_hash', 'ch_md5', 'ch_sha256'])
+    assert delete.startswith('DELETE FROM checksums WHERE ch_hash IN (SELECT ch_hash FROM refresh_keys_checksums)')
+    assert 'NOT IN (SELECT ch_hash FROM checksums_v' in delete
+    assert upsert.startswith('INSERT INTO checksums (ch_hash, ch_md5, ch_sha256) '
+                             'SELECT ch_hash, ch_md5, ch_sha256 FROM checksums_v')
+    assert 'ON CONFLICT (ch_hash) DO UPDATE SET (ch_md5, ch_sha256) = ROW(EXCLUDED.ch_md5, EXCLUDED.ch_sha256)' in upsert
+    assert upsert.endswith('IS DISTINCT FROM ROW(EXCLUDED.ch_md5, EXCLUDED.ch_sha256)')
+
+    delete, upsert = upsert_sql('esgf_paths', 'file_id', ['file_id'])
+    assert upsert.endswith('ON CONFLICT (file_id) DO NOTHING')
+
+    # partitioned table
+    delete, upsert = upsert_sql('esgf_paths', 'file_id', ['file_id', 'cmip_era', 'path'],
+                                unique=['file_id', 'cmip_era'])
+    assert delete.endswith('AND (file_id, cmip_era) NOT IN (SELECT file_id, cmip_era FROM esgf_paths_v '
+                           'WHERE file_id IN (SELECT file_id FROM refresh_keys_esgf_paths))')
+    assert 'ON CONFLICT (file_id, cmip_era) DO UPDATE SET (path) = ROW(EXCLUDED.path)' in upsert
+
+
+
+def test_refresh_table_full(monkeypatch):
+    monkeypatch.setattr(clef.refresh, 'table_columns', lambda conn, table: ['ch_hash', 'ch_md5'])
+    monkeypatch.setattr(clef.refresh, 'unique_key', lambda conn, table, key: [key])
+
+    class Conn:
+        statements = []
+
+        def execute(self, sql):
+            self.statements.append(str(sql))
+            return type('Result', (), {'rowcount': 1})()
+
+    conn = Conn()
+    assert refresh_table(conn, 'checksums', 'ch_hash', 'SELECT 1', full=True) == 2
+    # a full refresh goes through the upsert of every key, without a TRUNCATE
+    assert not any('TRUNCATE' in x for x in conn.statements)
+    assert conn.statements[0] == ('CREATE TEMPORARY TABLE refresh_keys_checksums ON COMMIT DROP AS '
+                                  'SELECT ch_hash FROM checksums_v UNION SELECT ch_hash FROM checksums')
+    assert conn.statements[-1].startswith('INSERT INTO checksums')
+
+
+def test_refresh_table_partitioned(monkeypatch):
+    monkeypatch.setattr(clef.refresh, 'table_columns', lambda conn, table: ['file_id', 'cmip_era'])
+    monkeypatch.setattr(clef.refresh, 'unique_key', lambda conn, table, key: [key, 'cmip_era'])
+
+    class Conn:
+        def __init__(self, duplicate):
+            self.duplicate = duplicate
+            self.statements = []
+
+        def execute(self, sql):
+            self.statements.append(str(sql))
+            return type('Result', (), {'rowcount': 1, 'scalar': lambda _: self.duplicate})()
+
+    # the unique index includes cmip_era, file_id is checked by the refresh
+    conn = Conn(None)
+    assert refresh_table(conn, 'esgf_paths', 'file_id', 'SELECT 1') == 2
+    assert conn.statements[-1].endswith('GROUP BY file_id HAVING count(*) > 1 LIMIT 1')
+    with pytest.raises(ValueError):
+        refresh_table(Conn('abc'), 'esgf_paths', 'file_id', 'SELECT 1')
+
+def test_refresh_graph():
+    edges = [
+        ('esgf_paths', 'esgf_filter'),
+        ('esgf_filter', 'paths'),
+        ('checksums', 'metadata'),
+        ('checksums', 'esgf_paths'),
+        ('c6_dataset_metadata', 'esgf_paths'),
+        ('c6_metadata_dataset_link', 'c6_dataset_metadata'),
+        ('cmip6_dataset', 'c6_dataset_metadata'),
+        ('cmip6_dataset', 'c6_metadata_dataset_link'),
+        ]
+    materialized = {'esgf_paths', 'checksums', 'c6_metadata_dataset_link', 'cmip6_dataset'}
+    assert refresh_graph(edges, materialized) == {
+        'esgf_paths': set(),
+        'checksums': {'esgf_paths'},
+        'c6_metadata_dataset_link': {'esgf_paths'},
+        'cmip6_dataset': {'esgf_paths', 'c6_metadata_dataset_link'},
+        }
+
+
+def test_schedule():
+    graph = {'a': set(), 'b': {'a'}, 'c': {'a'}, 'd': {'b', 'c'}}
+    lock = threading.Lock()
+    running = set()
+    overlap = []
+    finished = []
+
+    def run(node):
+        with lock:
+            for dep in graph[node]:
+                assert dep in finished
+            running.add(node)
+            overlap.append(set(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(node)
+            finished.append(node)
+
+    durations = schedule(graph, run, workers=4)
+    assert finished[0] == 'a' and finished[-1] == 'd'
+    assert set(durations) == set(graph)
+    assert all(d.total_seconds() >= 0.05 for _, d in durations.values())
+    # b and c are independent so they run at the same time
+    assert {'b', 'c'} in overlap
+
+
+def test_schedule_cycle():
+    with pytest.raises(ValueError):
+        schedule({'a': {'b'}, 'b': {'a'}}, lambda node: None)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Copyright 2020 ARC Centre of Excellence for Climate Extremes
+# author: Paola Petrelli <paola.petrelli@utas.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from unittest import mock
+
+from clef import snapshot
+from clef.code import local_query, search
+from clef.exception import ClefException
+from snapshot_fixtures import snapshot_file, snapshot_session
+
+# Tests for the catalogue snapshot in snapshot.py
+
+
+def test_connect_missing(tmp_path):
+    with pytest.raises(ClefException):
+        snapshot.connect(str(tmp_path / 'missing.db'))
+
+
+def test_local_query(snapshot_session):
+    r = local_query(snapshot_session, 'CMIP6', latest=True, variable_id='tas')
+    assert len(r.index) == 2
+    assert sorted(r['member_id']) == ['r1i1p1f1', 'r2i1p1f1']
+    row = r[r['member_id'] == 'r2i1p1f1'].iloc[0]
+    assert (row['fdate'], row['tdate']) == ('18500101', '20141231')
+    assert row['time_complete']
+
+    r = local_query(snapshot_session, 'CMIP6', latest=True, variable_id='pr', member_id='r2i1p1f1')
+    assert len(r.index) == 0
+
+    r = local_query(snapshot_session, 'CMIP5', latest=False, variable='tas',
+                    experiment_family='Historical')
+    assert list(r['model']) == ['ACCESS1.0']
+
+
+def test_local_query_text(snapshot_session):
+    r = local_query(snapshot_session, 'CMIP6', query='ACCESS-ESM1-5 r2i1p1f1')
+    assert list(r['member_id']) == ['r2i1p1f1']
+
+    r = local_query(snapshot_session, 'CMIP6', query='access tas', member_id='r1i1p1f1')
+    assert list(r['variable_id']) == ['tas']
+
+    r = local_query(snapshot_session, 'CMIP6', query='MIROC')
+    assert len(r.index) == 0
+
+
+def test_search(snapshot_session):
+    r = search(snapshot_session, project='CMIP5', model='ACCESS1-0', variable='tas')
+    assert len(r.index) == 1
+
+
+def test_create_snapshot(snapshot_session, tmp_path):
+    path = snapshot.create_snapshot(snapshot_session, str(tmp_path / 'copy.db'))
+    copy = snapshot.connect(path)
+    r0 = local_query(snapshot_session, 'CMIP6', variable_id='tas')
+    r1 = local_query(copy, 'CMIP6', variable_id='tas')
+    assert r0.equals(r1)
+    indexes = [x[0] for x in copy.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert 'cmip6_dataset_source_id_idx' in indexes
+    views = [x[0] for x in copy.execute("SELECT name FROM sqlite_master WHERE type = 'view'")]
+    assert sorted(views) == ['cmip5_files', 'cmip6_files', 'cordex_files']
+
+
+def test_last_updated(snapshot_session, tmp_path):
+    from datetime import datetime, timezone, timedelta
+
+    path = snapshot.create_snapshot(snapshot_session, str(tmp_path / 'copy.db'))
+    updated = snapshot.last_updated(path)
+    assert datetime.now(timezone.utc) - updated < timedelta(minutes=1)
+
+
+def test_sync(snapshot_file, tmp_path):
+    # make a copy to use as the server
+    server = snapshot.connect(snapshot.create_snapshot(snapshot.connect(snapshot_file),
+                                                       str(tmp_path / 'server.db')))
+    path = snapshot.create_snapshot(server, str(tmp_path / 'local.db'))
+
+    # nothing to do
+    with mock.patch('clef.snapshot.changed_files', return_value=set()):
+        assert snapshot.sync(server, path) == (0, 0)
+
+    # remove a file and its dataset, change a file and add a new one
+    server.execute("DELETE FROM esgf_paths WHERE file_id = 'f62'")
+    server.execute("DELETE FROM c6_metadata_dataset_link WHERE file_id = 'f62'")
+    server.execute("UPDATE extended_metadata SET version = '20200101' WHERE file_id = 'f61'")
+    server.execute("INSERT INTO esgf_paths (file_id, path) VALUES ('f65', '/g/data/oi10/new.nc')")
+    server.execute("INSERT INTO c6_metadata_dataset_link VALUES ('f65', 'd63')")
+    server.commit()
+
+    with mock.patch('clef.snapshot.changed_files', return_value={'f61'}) as changed:
+        assert snapshot.sync(server, path) == (2, 1)
+        changed.assert_called_once()
+    local = snapshot.connect(path)
+    assert local.execute("SELECT count(*) FROM cmip6_dataset").scalar() == 2
+    assert local.execute("SELECT version FROM extended_metadata WHERE file_id = 'f61'").scalar() == '20200101'
+    assert snapshot.partition_hashes(local) == snapshot.partition_hashes(server)
+
+
+def test_sync_watermark(snapshot_file, tmp_path):
+    server = snapshot.connect(snapshot_file)
+    with mock.patch('clef.snapshot.refresh_time', return_value='2020-01-01T00:00:00+00:00'):
+        path = snapshot.create_snapshot(server, str(tmp_path / 'local.db'))
+    # files are looked for from the refresh the snapshot was copied from, not from the sync
+    with mock.patch('clef.snapshot.refresh_time', return_value='2020-02-01T00:00:00+00:00'), \
+         mock.patch('clef.snapshot.changed_files', return_value=set()) as changed:
+        snapshot.sync(server, path)
+        snapshot.sync(server, path)
+    assert [c[0][1] for c in changed.call_args_list] == ['2020-01-01T00:00:00+00:00',
+                                                          '2020-02-01T00:00:00+00:00']
+
+
+def test_sync_upgrade(snapshot_file, tmp_path):
+    server = snapshot.connect(snapshot.create_snapshot(snapshot.connect(snapshot_file),
+                                                       str(tmp_path / 'server.db')))
+    server.execute("UPDATE esgf_paths SET basename = 'f61.nc' WHERE file_id = 'f61'")
+    server.commit()
+    path = snapshot.create_snapshot(server, str(tmp_path / 'local.db'))
+    # a snapshot made before esgf_paths had the basename column
+    local = snapshot.connect(path)
+    local.execute("DROP VIEW cmip6_files")
+    local.execute("DROP INDEX esgf_paths_basename_idx")
+    local.execute("ALTER TABLE esgf_paths DROP COLUMN basename")
+    local.execute("CREATE VIEW cmip6_files AS SELECT file_id, path FROM esgf_paths")
+    local.commit()
+    local.close()
+
+    with mock.patch('clef.snapshot.changed_files', return_value=set()):
+        assert snapshot.sync(server, path) == (5, 0)
+    local = snapshot.connect(path)
+    assert local.execute("SELECT basename FROM esgf_paths WHERE file_id = 'f61'").scalar() == 'f61.nc'
+    assert local.execute("SELECT version FROM cmip6_files WHERE file_id = 'f61'").scalar() == '20191115'
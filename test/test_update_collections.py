@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright 2018 ARC Centre of Excellence for Climate Extremes 
+# author: Scott Wales <scott.wales@unimelb.edu.au>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine
+
+from clef import collections
+from clef import update_collections as uc
+from clef.db_noesgf import Dataset, Variable, ECMWF
+from clef.exception import ClefException
+
+# Tests for the not-ESGF catalogue loaders in update_collections.py
+
+
+def test_variable_table(tmp_path, monkeypatch):
+    monkeypatch.setenv('CLEF_DB', f'sqlite:///{tmp_path}/clef.db')
+    uc.add_dataset('ERA5', '1.0', 'netcdf', drs='/data/ERA5/<frequency>/')
+    uc.add_ecmwf_table([{'code': f'{i}.128', 'name': f'v{i}', 'cds_name': f'var_{i}', 'units': 'K',
+                         'long_name': f'variable {i}', 'standard_name': f'std_{i}',
+                         'cmor_name': f'c{i}', 'cell_methods': ''} for i in range(1000)])
+
+    db = collections.connect().session
+    statements = []
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    # every loader opens its own connection
+    event.listen(Engine, 'before_cursor_execute', record)
+
+    common = {'levels': 'surface', 'grid': 'NA', 'resolution': '0.25', 'frequency': '1hr',
+              'fdate': '19790101', 'tdate': '20201231', 'stream': 'oper', 'realm': 'atmos'}
+    rows = [dict(common, code=f'{i}.128') for i in range(1000)] + [dict(common, code='bad')]
+    uc.add_variable_table(rows, 'ERA5', 'netcdf', '1.0')
+    # the codes are looked up 500 at a time, not one per row
+    assert len([s for s in statements if s.startswith('SELECT') and 'FROM ecmwf_vars' in s]) == 3
+
+    variables = db.query(Variable).order_by(Variable.id).all()
+    assert len(variables) == 1001
+    assert variables[5].varname == 'v5' and variables[5].cmor_name == 'c5'
+    assert variables[-1].varname is None
+
+    statements.clear()
+    updates = [{'varname': f'v{i}', 'frequency': '1hr', 'tdate': '20211231'} for i in range(500)]
+    updates.append({'varname': 'missing', 'frequency': '1hr', 'tdate': '20211231'})
+    uc.update_variable_table(updates, ['varname', 'frequency'], 'ERA5', 'netcdf', '1.0')
+    # one select of the existing variables and one executemany update
+    assert len([s for s in statements if s.startswith('SELECT') and 'FROM variables' in s]) == 1
+    assert len([s for s in statements if s.startswith('UPDATE')]) == 1
+
+    event.remove(Engine, 'before_cursor_execute', record)
+    db.expire_all()
+    assert db.query(Variable).filter_by(tdate='20211231').count() == 500
+    assert db.query(Variable).filter_by(varname='v500').one().tdate == '20201231'
+
+
+def test_connect_readonly(tmp_path, monkeypatch):
+    url = f'sqlite:///{tmp_path}/clef.db'
+    monkeypatch.setattr(collections, '_engines', {})
+    db = collections.connect(url)
+    uc.insert_unique(db.session, Dataset, name='DS1', version='1.0', fileformat='netcdf')
+    db.session.commit()
+    # engines are reused
+    assert collections.connect(url).session.get_bind() is db.session.get_bind()
+
+    # the schema version skips the tables check for a new engine
+    monkeypatch.setattr(collections, '_engines', {})
+    monkeypatch.setattr(collections.Base.metadata, 'create_all', None)
+    assert collections.connect(url).dsets() == ['DS1 v1.0 (netcdf)']
+
+    ro = collections.connect(url, readonly=True).session
+    assert ro.query(Dataset).one().name == 'DS1'
+    ro.add(Dataset(name='DS2', version='1.0', fileformat='netcdf'))
+    with pytest.raises(OperationalError):
+        ro.commit()
+
+    # a missing catalogue isn't created by a read-only connection
+    with pytest.raises(ClefException, match='missing.db'):
+        collections.connect(f'sqlite:///{tmp_path}/missing.db', readonly=True)
+    assert not (tmp_path / 'missing.db').exists()